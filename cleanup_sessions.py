@@ -1,14 +1,17 @@
 #!/usr/bin/env python3
 """
 清理数据库中的旧会话脚本
-用于删除无效的实时检测会话记录
+用于删除无效的实时检测会话记录, 使用 --retention 时按照保留策略清理视频检测结果和异常事件片段
 """
 
+import argparse
 import pymongo
 import toml
 import sys
 import logging
 
+import servers.retention as retention
+
 logging.basicConfig(
     level=logging.INFO,
     format='[%(asctime)s] [%(levelname)s] %(message)s',
@@ -101,8 +104,50 @@ def delete_session_by_id(database, session_id):
         logger.error(f"❌ 删除失败: {e}")
         return False
 
+def run_retention(database, arguments):
+    """按照保留策略清理存储的检测结果"""
+    configs = toml.load('servers/configs/config.toml')
+
+    max_age_days = configs['retention-days'] if arguments.max_age_days is None else arguments.max_age_days
+    quota_gb = configs['retention-quota-gb'] if arguments.quota_gb is None else arguments.quota_gb
+
+    if arguments.dry_run:
+        logger.info("🔍 试运行模式, 不会删除任何内容")
+
+    try:
+        report = retention.run_retention(
+            database, max_age_days, int(quota_gb * 1024 ** 3), configs['retention-grace'], configs['retention-workers'], arguments.dry_run,
+            arguments.remove_orphans or configs['retention-remove-orphans'], configs['retention-orphan-max-ratio'],
+        )
+    except Exception as e:
+        logger.error(f"❌ 清理失败: {e}")
+        return False
+
+    logger.info(f"  过期视频: {report['expiredVideos']}")
+    logger.info(f"  超出配额淘汰的视频: {report['evictedVideos']}")
+    logger.info(f"  结果文件丢失的视频记录: {report['orphanVideos']}")
+    logger.info(f"  没有数据库记录的文件: {report['orphanFiles']}")
+
+    if report['orphanAborted']:
+        logger.warning("⚠️ 结果文件丢失的视频记录过多, 未删除这些记录, 请检查存储目录是否正常挂载")
+    logger.info(f"  过期异常事件: {report['expiredEvents']}")
+    logger.info(f"  删除文件: {report['removedFiles']} 个, 共 {report['freedBytes'] / 1024 ** 2:.1f} MB")
+
+    if report.get('failedFiles'):
+        logger.warning(f"⚠️ {report['failedFiles']} 个文件删除失败")
+
+    return True
+
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description='清理数据库中的会话和存储的检测结果')
+    parser.add_argument('--retention', action='store_true', help='按照保留策略清理视频检测结果和异常事件片段')
+    parser.add_argument('--dry-run', action='store_true', help='只输出清理报告, 不删除任何内容')
+    parser.add_argument('--max-age-days', type=float, default=None, help='覆盖配置中的 retention-days')
+    parser.add_argument('--quota-gb', type=float, default=None, help='覆盖配置中的 retention-quota-gb')
+    parser.add_argument('--remove-orphans', action='store_true', help='同时删除结果视频丢失的视频记录')
+    arguments = parser.parse_args()
+
     logger.info("=" * 60)
     logger.info("🗑️ 数据库会话清理工具")
     logger.info("=" * 60)
@@ -126,6 +171,11 @@ def main():
 
     database = client
 
+    if arguments.retention or arguments.dry_run:
+        success = run_retention(database, arguments)
+        client.close()
+        return 0 if success else 1
+
     # 列出会话
     logger.info("")
     sessions = list_sessions(database)
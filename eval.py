@@ -1,3 +1,4 @@
+import time
 import torch
 import toml
 import utils
@@ -5,7 +6,7 @@ import sklearn.metrics as metrics
 
 from torch.utils.data import DataLoader
 
-from models import AnomalyDetectionModel
+from models import create_model
 from dataset import AnomalyDetectionDataset
 
 
@@ -36,11 +37,17 @@ smoothing_window = configs['smoothing-window']
 
 log_interval = configs['log-interval']
 
-model = AnomalyDetectionModel(attention_window, alpha=configs['alpha'])
+model = create_model(configs)
 model = model.to(device)
 
+parameter_count = sum(parameter.numel() for parameter in model.parameters())
+
+step_profiler = utils.StepProfiler(configs, 'eval', device)
+
 print(f'\n---------- evaluation start at: {device} ----------\n')
 
+step_profiler.start()
+
 with torch.no_grad():
     scores0 = []
     scores1 = []
@@ -51,11 +58,22 @@ with torch.no_grad():
     model.load_state_dict(torch.load(configs['load-checkpoint-path'], map_location=device, weights_only=True))
     model.eval()
 
-    for index, (inputs, labels, _) in enumerate(dataloader, start=1):
+    forward_seconds = 0.0
+    segment_count = 0
+
+    for index, (inputs, labels, _) in enumerate(step_profiler.iterate(dataloader, 'eval'), start=1):
         inputs = inputs.to(device)
         labels = labels.to(device)
 
+        forward_start = time.perf_counter()
         scores = model(inputs).sigmoid()
+
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+
+        forward_seconds += time.perf_counter() - forward_start
+        segment_count += inputs.shape[0] * inputs.shape[1]
+
         scores = utils.score_smoothing(scores, smoothing_window).repeat_interleave(16, dim=1)
 
         scores = scores.mean(dim=0)
@@ -71,6 +89,8 @@ with torch.no_grad():
         if index % log_interval == 0:
             print(f'{utils.current_time()} [valid] [{index:04d}/{dataloader_size:04d}]')
 
+    step_profiler.stop()
+
     scores0 = torch.cat(scores0).cpu()
     scores1 = torch.cat(scores1).cpu()
 
@@ -119,4 +139,8 @@ with torch.no_grad():
 
     print(f'\nAUC: {auc_score:<8.4f} AP: {ap_score:.4f}')
 
+    print('\n--------------------------------')
+    print(f'Model: {configs["model-variant"]} Parameters: {parameter_count}')
+    print(f'Speed: {forward_seconds / segment_count * 1e6:.2f} us/segment {segment_count / forward_seconds:.0f} segments/s')
+
 print(f'\n---------- evaluation finished ----------\n')
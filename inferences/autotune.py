@@ -0,0 +1,217 @@
+import argparse
+import concurrent.futures
+import hashlib
+import itertools
+import logging
+import os
+import platform
+import sys
+import threading
+import time
+
+import numpy as np
+import onnxruntime as ort
+import toml
+
+logger = logging.getLogger(__name__)
+
+# CPU 作为后备单独调优, 远程推理 Provider 不在本机执行计算, 均不作为加速 Provider
+ignored_providers = {'AzureExecutionProvider', 'CPUExecutionProvider'}
+
+execution_modes = {
+    'sequential': ort.ExecutionMode.ORT_SEQUENTIAL,
+    'parallel': ort.ExecutionMode.ORT_PARALLEL,
+}
+
+
+def host_fingerprint(model_paths):
+    # 主机、ONNX Runtime 版本或模型文件变化后原有的调优结果不再适用
+    fingerprint = hashlib.sha256()
+    fingerprint.update(f'{platform.node()}|{platform.machine()}|{os.cpu_count()}|{ort.__version__}|{",".join(ort.get_available_providers())}'.encode())
+
+    for model_path in model_paths:
+        model_stat = os.stat(model_path)
+        fingerprint.update(f'|{os.path.abspath(model_path)}|{model_stat.st_size}|{model_stat.st_mtime_ns}'.encode())
+
+    return fingerprint.hexdigest()
+
+
+def session_options(model_profile):
+    # 根据调优结果创建会话选项, 没有调优结果时使用 ONNX Runtime 默认值
+    options = ort.SessionOptions()
+
+    if 'intra-op-threads' in model_profile:
+        options.intra_op_num_threads = model_profile['intra-op-threads']
+        options.inter_op_num_threads = model_profile['inter-op-threads']
+        options.execution_mode = execution_modes[model_profile['execution-mode']]
+
+    return options
+
+
+def load_profile(profile_path, model_paths):
+    if not profile_path or not all(os.path.exists(path) for path in [profile_path, *model_paths]):
+        return {}
+
+    profile = toml.load(profile_path)
+
+    if profile.get('fingerprint') != host_fingerprint(model_paths):
+        logger.warning(f"⚠️ 调优结果与当前主机或模型不匹配, 已忽略: {profile_path}")
+        return {}
+
+    return profile
+
+
+def candidate_providers(configured_providers):
+    # 依次尝试每个可用的加速 Provider, 均以 CPU 作为后备
+    available_providers = ort.get_available_providers()
+    providers = [[provider, 'CPUExecutionProvider'] for provider in dict.fromkeys(configured_providers + available_providers) if provider in available_providers and provider not in ignored_providers]
+
+    return providers + [['CPUExecutionProvider']]
+
+
+def thread_counts(limit):
+    counts = [1]
+
+    while counts[-1] * 2 <= limit:
+        counts.append(counts[-1] * 2)
+
+    if counts[-1] != limit:
+        counts.append(limit)
+
+    return counts
+
+
+def benchmark(model_path, inputs, providers, intra_op_threads, inter_op_threads, execution_mode, concurrency, duration):
+    """
+    以 concurrency 个线程共享同一个推理会话持续运行 duration 秒, 与实时检测中多个计算线程共享会话的方式一致
+    返回每秒完成的推理次数和单次推理耗时的中位数
+    """
+    profile = {'intra-op-threads': intra_op_threads, 'inter-op-threads': inter_op_threads, 'execution-mode': execution_mode}
+    session = ort.InferenceSession(model_path, sess_options=session_options(profile), providers=providers)
+
+    # 预热, 排除首次运行时的内存分配和图优化
+    for _ in range(2):
+        session.run(['outputs'], {'inputs': inputs})
+
+    latencies = []
+    latencies_lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def run_until_deadline():
+        run_latencies = []
+
+        while time.perf_counter() < deadline:
+            start_seconds = time.perf_counter()
+            session.run(['outputs'], {'inputs': inputs})
+            run_latencies.append(time.perf_counter() - start_seconds)
+
+        with latencies_lock:
+            latencies.extend(run_latencies)
+
+    start_seconds = time.perf_counter()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(run_until_deadline) for _ in range(concurrency)]:
+            future.result()
+
+    elapsed = time.perf_counter() - start_seconds
+
+    return len(latencies) / elapsed, float(np.median(latencies))
+
+
+def tune_model(model_path, inputs, configured_providers, duration, core_count, concurrency_counts=None):
+    # 计算线程数与每次推理线程数的乘积不超过核心数, 避免多个会话同时推理时超额占用核心
+    # 指定 concurrency_counts 时只测量这些计算线程数, 所有候选设置都无法运行时返回 None
+    best = None
+
+    for providers in candidate_providers(configured_providers):
+        # Provider 无法加载模型时 ONNX Runtime 可能静默回退到 CPU, 此时跳过该 Provider
+        try:
+            loaded_providers = ort.InferenceSession(model_path, providers=providers).get_providers()
+        except Exception as e:
+            logger.warning(f"⚠️ 跳过 {providers[0]}: {e}")
+            continue
+
+        if loaded_providers[0] != providers[0]:
+            logger.warning(f"⚠️ 跳过 {providers[0]}: 模型未能在该 Provider 上加载")
+            continue
+
+        for concurrency in concurrency_counts or thread_counts(core_count):
+            for intra_op_threads, execution_mode in itertools.product(thread_counts(core_count // concurrency), execution_modes):
+                inter_op_threads = 1 if execution_mode == 'sequential' else max(1, core_count // concurrency // intra_op_threads)
+
+                try:
+                    throughput, latency = benchmark(model_path, inputs, providers, intra_op_threads, inter_op_threads, execution_mode, concurrency, duration)
+                except Exception as e:
+                    logger.warning(f"⚠️ 跳过 {providers[0]} 计算线程={concurrency} intra={intra_op_threads} {execution_mode}: {e}")
+                    continue
+
+                logger.info(f"   {providers[0]:<28} 计算线程={concurrency:<3} intra={intra_op_threads:<3} inter={inter_op_threads:<3} {execution_mode:<10} {throughput:8.1f} 次/秒  {latency * 1000:8.1f} ms")
+
+                if best is None or throughput > best['throughput']:
+                    best = {
+                        'providers': providers,
+                        'intra-op-threads': intra_op_threads,
+                        'inter-op-threads': inter_op_threads,
+                        'execution-mode': execution_mode,
+                        'concurrency': concurrency,
+                        'throughput': throughput,
+                        'latency': latency,
+                    }
+
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ONNX Runtime settings on this host and cache the best profile.')
+    parser.add_argument('--config', default='inferences/configs/config.toml')
+    parser.add_argument('--duration', type=float, default=2.0, help='seconds to run each candidate setting')
+    parser.add_argument('--cores', type=int, default=os.cpu_count(), help='cores available to inference')
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    configs = toml.load(arguments.config)
+    precision_dtype = np.float16 if configs['precision'] == 'fp16' else np.float32
+
+    extraction_inputs = np.random.default_rng(0).standard_normal(
+        (1, 3, configs['segment-length'], configs['crop-y2'] - configs['crop-y1'], configs['crop-x2'] - configs['crop-x1'])
+    ).astype(precision_dtype)
+    detection_inputs = np.random.default_rng(0).standard_normal((1, configs['history-length'], configs['feature-size'])).astype(precision_dtype)
+
+    model_paths = [configs['extraction-model-path'], configs['detection-model-path']]
+    profile = {'fingerprint': host_fingerprint(model_paths), 'created': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+    # 每个计算线程依次执行特征提取和异常检测, 特征提取是实时检测的主要开销, 其最佳并发数作为计算线程数,
+    # 异常检测只在该并发数下调优, 保证两个模型的线程设置在相同的计算线程数下都不超额占用核心
+    concurrency_counts = None
+
+    for name, model_path, inputs in [('extraction', model_paths[0], extraction_inputs), ('detection', model_paths[1], detection_inputs)]:
+        logger.info(f"正在调优 {name}: {model_path}")
+        best = tune_model(model_path, inputs, configs['providers'], arguments.duration, arguments.cores, concurrency_counts)
+
+        if best is None:
+            logger.error(f"❌ {name}: 没有可以运行的设置, 推理时使用默认设置")
+            continue
+
+        profile[name] = best
+        logger.info(f"✅ {name}: {best}")
+
+        if concurrency_counts is None:
+            concurrency_counts = [best['concurrency']]
+            profile['compute-workers'] = best['concurrency']
+
+    if 'compute-workers' not in profile:
+        logger.error("❌ 调优失败, 未写入调优结果")
+        return 1
+
+    with open(configs['autotune-profile'], 'w') as profile_file:
+        toml.dump(profile, profile_file)
+
+    logger.info(f"✅ 调优结果已写入: {configs['autotune-profile']}")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,197 @@
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import toml
+
+logger = logging.getLogger(__name__)
+
+
+def measure_profile(video_paths):
+    """
+    在当前进程使用的提取配置下逐个检测视频, 返回每个视频的检测耗时、视频时长以及逐帧异常得分
+    提取配置在推理引擎导入时确定, 每个提取配置在独立的子进程中测量
+    """
+    import cv2
+    import inferences.engines as engines
+
+    # 预热, 排除首次推理时的内存分配和图优化
+    engines.extract_segment_features(np.zeros(engines.segment_shape, dtype=engines.precision_dtype))
+
+    results = []
+
+    for video_path in video_paths:
+        capture = cv2.VideoCapture(video_path)
+        source_fps = capture.get(cv2.CAP_PROP_FPS) or engines.configs['default-source-fps']
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        capture.release()
+
+        start_seconds = time.perf_counter()
+        scores = engines.detection_by_video(video_path)
+        elapsed = time.perf_counter() - start_seconds
+
+        results.append({
+            'video': video_path,
+            'seconds': elapsed,
+            'duration': frame_count / source_fps,
+            'scores': engines.expand_scores(scores, engines.sample_stride(source_fps)).tolist(),
+        })
+
+    return results
+
+
+def measure_decoder(backend, video_paths, size):
+    # 解码全部视频帧并缩放到 size, OpenCV 解码后单独缩放, PyAV 在解码器中缩放, CPU 时间包含解码线程
+    import cv2
+    import inferences.decoders as decoders
+
+    frame_count = 0
+    start_seconds = time.perf_counter()
+    start_cpu_seconds = time.process_time()
+
+    for video_path in video_paths:
+        capture = decoders.open_video(video_path, size, backend)
+
+        try:
+            while True:
+                read_success, frame = capture.read()
+
+                if not read_success:
+                    break
+
+                if frame.shape[1::-1] != size:
+                    frame = cv2.resize(frame, size, interpolation=cv2.INTER_LINEAR)
+
+                frame_count += 1
+        finally:
+            capture.release()
+
+    elapsed = time.perf_counter() - start_seconds
+    cpu_seconds = time.process_time() - start_cpu_seconds
+
+    return {'frames': frame_count, 'fps': frame_count / elapsed, 'cpu-ms-per-frame': cpu_seconds / max(1, frame_count) * 1000}
+
+
+def run_profile(profile_name, video_paths):
+    environment = {**os.environ, 'SURVEILLANCE_EXTRACTION_PROFILE': profile_name}
+    completed = subprocess.run(
+        [sys.executable, '-m', 'inferences.benchmark', '--measure', *video_paths],
+        env=environment, stdout=subprocess.PIPE, check=True,
+    )
+
+    return json.loads(completed.stdout.decode().strip().splitlines()[-1])
+
+
+def compare_scores(reference_results, results, threshold):
+    # 以参考配置的逐帧得分为基准, 统计得分的平均绝对误差和异常判定的一致率
+    absolute_errors = []
+    agreements = []
+
+    for reference, result in zip(reference_results, results):
+        frame_count = min(len(reference['scores']), len(result['scores']))
+        reference_scores = np.array(reference['scores'][:frame_count])
+        scores = np.array(result['scores'][:frame_count])
+
+        absolute_errors.append(np.abs(reference_scores - scores))
+        agreements.append((reference_scores > threshold) == (scores > threshold))
+
+    return float(np.concatenate(absolute_errors).mean()), float(np.concatenate(agreements).mean())
+
+
+def benchmark_decoders(configs, video_paths, output_path):
+    size = (configs['segment-width'], configs['segment-height'])
+    report = {'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'videos': video_paths, 'size': list(size), 'decoders': {}}
+
+    logger.info(f"{'解码后端':<10} {'帧数':>8} {'帧/秒':>10} {'CPU ms/帧':>10}")
+
+    for backend in ['opencv', 'pyav']:
+        try:
+            report['decoders'][backend] = result = measure_decoder(backend, video_paths, size)
+        except ImportError:
+            logger.error(f"❌ 解码后端 {backend} 不可用, 已跳过")
+            continue
+
+        logger.info(f"{backend:<10} {result['frames']:>8} {result['fps']:>10.1f} {result['cpu-ms-per-frame']:>10.2f}")
+
+    with open(output_path, 'w') as report_file:
+        toml.dump(report, report_file)
+
+    logger.info(f"✅ 测量结果已写入: {output_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the speed and score agreement of each extraction profile, or the speed of each decoder backend.')
+    parser.add_argument('videos', nargs='+', help='videos to score with every profile or decode with every backend')
+    parser.add_argument('--profiles', nargs='*', help='profiles to measure, defaults to every profile in the config')
+    parser.add_argument('--reference', default='native', help='profile whose scores the others are compared against')
+    parser.add_argument('--decoders', action='store_true', help='compare decoder backends instead of extraction profiles')
+    parser.add_argument('--output', help='report path, defaults to inferences/configs/<extraction|decoder>-benchmark.toml')
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S', stream=sys.stderr)
+
+    if arguments.measure:
+        print(json.dumps(measure_profile(arguments.videos)))
+        return 0
+
+    configs = toml.load('inferences/configs/config.toml')
+
+    if arguments.decoders:
+        benchmark_decoders(configs, arguments.videos, arguments.output or 'inferences/configs/decoder-benchmark.toml')
+        return 0
+
+    output_path = arguments.output or 'inferences/configs/extraction-benchmark.toml'
+    profile_names = arguments.profiles or list(configs['extraction-profiles'])
+    profile_names = [arguments.reference] + [name for name in profile_names if name != arguments.reference]
+
+    measurements = {}
+
+    for profile_name in profile_names:
+        logger.info(f"正在测量提取配置: {profile_name}")
+
+        try:
+            measurements[profile_name] = run_profile(profile_name, arguments.videos)
+        except subprocess.CalledProcessError:
+            logger.error(f"❌ 提取配置 {profile_name} 测量失败, 已跳过")
+
+    if arguments.reference not in measurements:
+        logger.error(f"❌ 参考配置 {arguments.reference} 测量失败, 无法比较")
+        return 1
+
+    reference_seconds = sum(result['seconds'] for result in measurements[arguments.reference])
+    video_seconds = sum(result['duration'] for result in measurements[arguments.reference])
+
+    report = {'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'reference': arguments.reference, 'videos': arguments.videos, 'profiles': {}}
+
+    logger.info(f"{'提取配置':<16} {'耗时/视频时长':>12} {'加速比':>8} {'得分误差':>10} {'判定一致率':>10}")
+
+    for profile_name, results in measurements.items():
+        seconds = sum(result['seconds'] for result in results)
+        score_error, decision_agreement = compare_scores(measurements[arguments.reference], results, configs['anomaly-threshold'])
+
+        report['profiles'][profile_name] = {
+            **configs['extraction-profiles'][profile_name],
+            'seconds-per-video-second': seconds / video_seconds,
+            'speedup': reference_seconds / seconds,
+            'score-error': score_error,
+            'decision-agreement': decision_agreement,
+        }
+
+        logger.info(f"{profile_name:<16} {seconds / video_seconds:>12.3f} {reference_seconds / seconds:>8.2f} {score_error:>10.4f} {decision_agreement:>10.2%}")
+
+    with open(output_path, 'w') as report_file:
+        toml.dump(report, report_file)
+
+    logger.info(f"✅ 测量结果已写入: {output_path}")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
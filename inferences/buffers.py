@@ -0,0 +1,135 @@
+import queue
+import contextlib
+import cv2
+import numpy as np
+import multiprocessing.shared_memory as shared_memory_module
+
+
+class SegmentBufferPool:
+    def __init__(self, pool_size, segment_shape, dtype):
+        self.buffers = [np.zeros(segment_shape, dtype=dtype) for _ in range(pool_size)]
+        self.free_queue = queue.Queue()
+
+        for index in range(pool_size):
+            self.free_queue.put(index)
+
+    def __getitem__(self, index):
+        return self.buffers[index]
+
+    def acquire(self, timeout=None):
+        return self.free_queue.get(timeout=timeout)
+
+    def release(self, index):
+        self.free_queue.put(index)
+
+
+class FeatureRingBuffer:
+    """
+    特征环形缓冲区, 每个特征同时写入 position 和 position + capacity 两个位置,
+    使按时间顺序排列的最近 count 个特征在内存中始终连续, 无需拷贝即可作为检测模型输入
+    """
+
+    def __init__(self, capacity, feature_size, dtype):
+        self.buffer = np.zeros((1, 2 * capacity, feature_size), dtype=dtype)
+        self.capacity = capacity
+        self.position = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, features):
+        self.buffer[0, self.position] = features
+        self.buffer[0, self.position + self.capacity] = features
+
+        self.position = (self.position + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def view(self):
+        finish = self.position + self.capacity
+
+        return self.buffer[:, finish - self.count:finish]
+
+
+class SharedFrameRing:
+    """
+    共享内存视频帧环形缓冲区, 由一个写入方发布最新视频帧及异常得分, 多个进程直接读取共享内存
+    第 0 行头部记录最新序号, 其余每行记录对应槽位的 (序号, 帧时间, 得分, 得分时间), 写入时先将槽位序号置为 -1
+    """
+
+    def __init__(self, shared_memory, frame_shape, slot_count):
+        self.shared_memory = shared_memory
+        self.frame_shape = tuple(frame_shape)
+        self.slot_count = slot_count
+
+        self.header = np.ndarray((slot_count + 1, 4), dtype=np.float64, buffer=shared_memory.buf)
+        self.frames = np.ndarray((slot_count, *self.frame_shape), dtype=np.uint8, buffer=shared_memory.buf, offset=self.header.nbytes)
+
+    @property
+    def name(self):
+        return self.shared_memory.name
+
+    @staticmethod
+    def buffer_size(frame_shape, slot_count):
+        return (slot_count + 1) * 4 * 8 + slot_count * int(np.prod(frame_shape))
+
+    @classmethod
+    def create(cls, frame_shape, slot_count):
+        shared_memory = shared_memory_module.SharedMemory(create=True, size=cls.buffer_size(frame_shape, slot_count))
+        ring = cls(shared_memory, frame_shape, slot_count)
+        ring.header[:] = 0
+
+        return ring
+
+    @classmethod
+    def attach(cls, name, frame_shape, slot_count):
+        return cls(shared_memory_module.SharedMemory(name=name), frame_shape, slot_count)
+
+    def publish(self, frame, frame_time, score, score_time):
+        sequence = int(self.header[0, 0]) + 1
+        slot = sequence % self.slot_count
+        metadata = self.header[slot + 1]
+
+        metadata[0] = -1
+
+        if frame.shape == self.frame_shape:
+            np.copyto(self.frames[slot], frame)
+        else:
+            cv2.resize(frame, (self.frame_shape[1], self.frame_shape[0]), dst=self.frames[slot], interpolation=cv2.INTER_LINEAR)
+
+        metadata[1] = frame_time
+        metadata[2] = np.nan if score is None else score
+        metadata[3] = np.nan if score_time is None else score_time
+        metadata[0] = sequence
+
+        self.header[0, 0] = sequence
+
+    def latest(self):
+        sequence = int(self.header[0, 0])
+
+        if sequence <= 0:
+            return None
+
+        slot = sequence % self.slot_count
+        sequence_check, frame_time, score, score_time = self.header[slot + 1]
+
+        if sequence_check != sequence:
+            return None
+
+        return sequence, self.frames[slot], frame_time, None if np.isnan(score) else float(score)
+
+    def valid(self, sequence):
+        # 读取方使用槽位数据后再次校验序号, 序号改变说明槽位在读取期间已被覆盖
+        return self.header[sequence % self.slot_count + 1, 0] == sequence
+
+    def close(self):
+        self.header = None
+        self.frames = None
+
+        # 仍有读取方持有槽位视图时无法立即关闭, 映射在视图释放后回收
+        with contextlib.suppress(BufferError):
+            self.shared_memory.close()
+
+    def unlink(self):
+        with contextlib.suppress(FileNotFoundError):
+            self.shared_memory.unlink()
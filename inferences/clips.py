@@ -0,0 +1,193 @@
+import threading
+import collections
+import concurrent.futures
+import os
+import struct
+import uuid
+import cv2
+import toml
+import logging
+import traceback
+
+logger = logging.getLogger(__name__)
+
+configs = toml.load('inferences/configs/config.toml')
+
+clip_directory = configs['clip-directory']
+clip_width = configs['clip-width']
+clip_quality = configs['clip-quality']
+
+pre_roll_seconds = configs['clip-pre-roll']
+post_roll_seconds = configs['clip-post-roll']
+max_clip_seconds = configs['clip-max-seconds']
+memory_budget = configs['clip-memory-budget'] * 1024 * 1024
+
+anomaly_threshold = configs['anomaly-threshold']
+release_threshold = anomaly_threshold - configs['clip-hysteresis']
+
+clip_encoder = concurrent.futures.ThreadPoolExecutor(max_workers=configs['clip-encoders'], thread_name_prefix='ClipEncoder')
+
+
+def compress_frame(frame):
+    height, width = frame.shape[:2]
+
+    if width > clip_width:
+        width, height = clip_width, round(height * clip_width / width)
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+    encode_success, encoded_frame = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, clip_quality])
+
+    if not encode_success:
+        return None, None
+
+    return encoded_frame.tobytes(), (width, height)
+
+
+def write_clip(clip_path, frames, frame_size):
+    # 视频帧已是 JPEG 压缩结果, 直接封装为 MJPEG AVI, 不需要解码和重新编码
+    # 片段帧率由视频帧时间戳计算, 与视频源实际帧率一致
+    duration = frames[-1][0] - frames[0][0]
+    fps = (len(frames) - 1) / duration if duration > 0 else 1
+
+    width, height = frame_size
+    frame_count = len(frames)
+    max_frame_size = max(len(encoded_frame) for _, encoded_frame in frames)
+
+    def chunk(chunk_id, data):
+        return chunk_id + struct.pack('<I', len(data)) + data + (b'\0' if len(data) % 2 else b'')
+
+    def chunk_list(list_type, data):
+        return chunk(b'LIST', list_type + data)
+
+    main_header = struct.pack('<10I4I', round(1000000 / fps), max_frame_size * round(fps), 0, 0x10, frame_count, 0, 1, max_frame_size, width, height, 0, 0, 0, 0)
+    stream_header = b'vidsMJPG' + struct.pack('<IHHIIIIIIIIhhhh', 0, 0, 0, 0, 1000, round(fps * 1000), 0, frame_count, max_frame_size, 0xFFFFFFFF, 0, 0, 0, width, height)
+    stream_format = struct.pack('<IiiHH4sIiiII', 40, width, height, 1, 24, b'MJPG', width * height * 3, 0, 0, 0, 0)
+
+    header_list = chunk_list(b'hdrl', chunk(b'avih', main_header) + chunk_list(b'strl', chunk(b'strh', stream_header) + chunk(b'strf', stream_format)))
+
+    movie_chunks = []
+    index_entries = []
+    offset = 4
+
+    for _, encoded_frame in frames:
+        frame_chunk = chunk(b'00dc', encoded_frame)
+        index_entries.append(b'00dc' + struct.pack('<III', 0x10, offset, len(encoded_frame)))
+        movie_chunks.append(frame_chunk)
+        offset += len(frame_chunk)
+
+    body = b'AVI ' + header_list + chunk_list(b'movi', b''.join(movie_chunks)) + chunk(b'idx1', b''.join(index_entries))
+
+    with open(clip_path, 'wb') as clip_file:
+        clip_file.write(b'RIFF' + struct.pack('<I', len(body)) + body)
+
+
+class ClipRecorder:
+    """
+    异常片段录制器, 保存最近视频帧的 JPEG 压缩结果, 总大小不超过 clip-memory-budget
+    得分超过 anomaly-threshold 时开始一个异常事件, 低于 anomaly-threshold - clip-hysteresis 时结束,
+    事件结束并收集完 post-roll 视频帧后, 在后台线程中将 [开始 - pre-roll, 结束 + post-roll] 范围内的视频帧写入片段文件,
+    片段由已压缩的视频帧直接封装, 不重新读取视频源, 也不需要额外的解码
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frames = collections.deque()
+        self.frame_bytes = 0
+        self.frame_size = None
+        self.last_frame_time = None
+
+        # 得分对应的segment起始时间落后于最新视频帧的时长, 空闲时额外保留这部分视频帧, 保证 pre-roll 完整
+        self.score_lag = 0.0
+
+        self.event = None
+        self.event_outbox = collections.deque(maxlen=256)
+
+    def add_frame(self, frame_time, frame):
+        encoded_frame, frame_size = compress_frame(frame)
+
+        if encoded_frame is None:
+            return
+
+        with self.lock:
+            self.frame_size = frame_size
+            self.last_frame_time = frame_time
+            self.frames.append((frame_time, encoded_frame))
+            self.frame_bytes += len(encoded_frame)
+
+            # 没有进行中的事件时只保留 pre-roll 范围内的视频帧, 任何情况下都不超过内存预算
+            keep_since = frame_time - self.score_lag if self.event is None else self.event['start']
+            keep_since -= pre_roll_seconds
+
+            while self.frames and (self.frame_bytes > memory_budget or self.frames[0][0] < keep_since):
+                self.frame_bytes -= len(self.frames.popleft()[1])
+
+            if self.event is not None:
+                finish_time = self.event['finish']
+
+                if finish_time is None and frame_time - self.event['start'] > max_clip_seconds:
+                    self.event['finish'] = finish_time = frame_time
+
+                if finish_time is not None and frame_time >= finish_time + post_roll_seconds:
+                    self.submit_clip()
+
+    def update_score(self, score, segment_start_time, segment_finish_time):
+        with self.lock:
+            if self.last_frame_time is not None:
+                self.score_lag = max(0.0, self.last_frame_time - segment_start_time)
+
+            if self.event is None:
+                if score > anomaly_threshold:
+                    self.event = {'start': segment_start_time, 'finish': None, 'peak': score}
+                    logger.info(f"🚨 异常事件开始: 得分 = {score:.4f}")
+            elif self.event['finish'] is None:
+                self.event['peak'] = max(self.event['peak'], score)
+
+                if score < release_threshold:
+                    self.event['finish'] = segment_finish_time
+                    logger.info(f"异常事件结束: 峰值得分 = {self.event['peak']:.4f}, 等待 post-roll {post_roll_seconds}s")
+
+    def submit_clip(self):
+        event = self.event
+        self.event = None
+
+        since_time = event['start'] - pre_roll_seconds
+        until_time = event['finish'] + post_roll_seconds
+        frames = [(frame_time, encoded_frame) for frame_time, encoded_frame in self.frames if since_time <= frame_time <= until_time]
+
+        if len(frames) < 2:
+            logger.warning("⚠️ 异常事件视频帧不足, 跳过片段录制")
+            return
+
+        event['clipId'] = uuid.uuid4().hex
+        clip_encoder.submit(self.encode_clip, event, frames, self.frame_size)
+
+    def encode_clip(self, event, frames, frame_size):
+        clip_path = os.path.join(clip_directory, f"clip.{event['clipId']}.avi")
+
+        try:
+            os.makedirs(clip_directory, exist_ok=True)
+            write_clip(clip_path, frames, frame_size)
+        except Exception as e:
+            logger.error(f"❌ 异常片段写入失败: {e}")
+            logger.error(f"异常堆栈:\n{traceback.format_exc()}")
+            return
+
+        logger.info(f"✅ 异常片段写入完成: {clip_path} ({len(frames)}帧)")
+
+        # 片段文件写入完成后再交由服务端记录事件, 数据库中的记录总是指向已存在的片段
+        self.event_outbox.append({
+            'clipId': event['clipId'],
+            'start': event['start'],
+            'finish': event['finish'],
+            'peakScore': float(event['peak']),
+            'clipStart': frames[0][0],
+            'clipFinish': frames[-1][0],
+        })
+
+    def drain_events(self):
+        events = []
+
+        while self.event_outbox:
+            events.append(self.event_outbox.popleft())
+
+        return events
@@ -0,0 +1,116 @@
+import logging
+import cv2
+import toml
+
+logger = logging.getLogger(__name__)
+
+configs = toml.load('inferences/configs/config.toml')
+
+decoder_backend = configs['decoder-backend']
+decoder_threads = configs['decoder-threads']
+
+# 实时检测打开视频源时与 OpenCV 后端一同尝试的伪后端标识
+pyav_backend = 'pyav'
+
+if decoder_backend == pyav_backend:
+    try:
+        import av
+    except ImportError:
+        logger.warning("⚠️ decoder-backend 为 pyav 但未安装 PyAV (pip install av), 回退到 OpenCV 解码")
+        decoder_backend = 'opencv'
+
+
+class PyAVDecoder:
+    """
+    基于 PyAV (FFmpeg) 的多线程视频解码器, 提供与 cv2.VideoCapture 相同的 read/grab/retrieve/get/release 接口
+    指定 size 时在颜色转换的同时缩放到 (宽, 高), 不产生全分辨率的 BGR 视频帧
+    grab() 只解码, retrieve() 才进行缩放和颜色转换, 与 OpenCV 一致
+    """
+
+    def __init__(self, source, size=None, threads=0, live=False, timeout=None):
+        import av
+
+        self.av = av
+        self.size = size
+        self.container = None
+        self.frame = None
+
+        try:
+            self.container = av.open(source, timeout=timeout)
+            self.stream = self.container.streams.video[0]
+        except (av.FFmpegError, OSError, IndexError) as e:
+            logger.warning(f"⚠️ PyAV 无法打开视频源 {source}: {e}")
+            self.release()
+            return
+
+        # 帧级多线程会使输出延迟若干帧, 实时视频源只使用片级多线程
+        self.stream.thread_type = 'SLICE' if live else 'AUTO'
+        self.stream.thread_count = threads
+        self.frames = self.container.decode(self.stream)
+
+    def isOpened(self):
+        return self.container is not None
+
+    def grab(self):
+        if self.container is None:
+            return False
+
+        try:
+            self.frame = next(self.frames)
+        except (StopIteration, self.av.FFmpegError):
+            self.frame = None
+
+        return self.frame is not None
+
+    def retrieve(self):
+        if self.frame is None:
+            return False, None
+
+        if self.size is None:
+            return True, self.frame.to_ndarray(format='bgr24')
+
+        return True, self.frame.to_ndarray(width=self.size[0], height=self.size[1], format='bgr24', interpolation='BILINEAR')
+
+    def read(self):
+        if not self.grab():
+            return False, None
+
+        return self.retrieve()
+
+    def get(self, property_id):
+        if self.container is None:
+            return 0.0
+
+        if property_id == cv2.CAP_PROP_FPS:
+            rate = self.stream.average_rate or self.stream.guessed_rate
+            return float(rate) if rate else 0.0
+
+        if property_id == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self.stream.frames)
+
+        if property_id == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.stream.codec_context.width)
+
+        if property_id == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.stream.codec_context.height)
+
+        return 0.0
+
+    def set(self, property_id, value):
+        return False
+
+    def release(self):
+        if self.container is not None:
+            self.container.close()
+            self.container = None
+
+
+def open_video(source, size=None, backend=None):
+    """
+    按配置的解码后端打开视频文件, size 为 (宽, 高) 时 PyAV 在解码器中缩放到该尺寸
+    OpenCV 不支持解码时缩放, 仍然返回原始尺寸的视频帧, 调用方需要自行缩放
+    """
+    if (backend or decoder_backend) == pyav_backend:
+        return PyAVDecoder(source, size, decoder_threads)
+
+    return cv2.VideoCapture(source)
@@ -5,6 +5,11 @@ import numpy as np
 import logging
 import traceback
 import os
+import time
+import atexit
+import inferences.metrics as metrics
+import inferences.autotune as autotune
+import inferences.decoders as decoders
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -16,17 +21,42 @@ logger.info("初始化推理引擎模块")
 configs = toml.load('inferences/configs/config.toml')
 logger.info("✅ 配置文件加载成功")
 
+profiling_directory = configs['profiling-directory']
+profiling_onnx = configs['profiling-onnx']
+
+# 按比例采样预处理各阶段的耗时, 比例为 0 时不做任何计时
+preprocess_trace = metrics.TraceSampler(configs['profiling-preprocess-rate'])
+
+if profiling_onnx or preprocess_trace.rate > 0:
+    os.makedirs(profiling_directory, exist_ok=True)
+
+
+def profiling_options(options, name):
+    if profiling_onnx:
+        options.enable_profiling = True
+        options.profile_file_prefix = f'{profiling_directory}/{name}'
+
+    return options
+
+
 # 加载ONNX模型
 try:
     detection_model_path = configs['detection-model-path']
     extraction_model_path = configs['extraction-model-path']
 
+    # 存在与当前主机和模型匹配的调优结果时使用其中的 Provider 和线程设置
+    profile = autotune.load_profile(configs['autotune-profile'], [extraction_model_path, detection_model_path])
+
+    if profile:
+        logger.info(f"✅ 已加载调优结果: {configs['autotune-profile']} ({profile['created']})")
+
     logger.info(f"正在加载检测模型: {detection_model_path}")
     if not os.path.exists(detection_model_path):
         logger.error(f"❌ 检测模型文件不存在: {detection_model_path}")
         raise FileNotFoundError(f"Detection model not found: {detection_model_path}")
 
-    detection_session = ort.InferenceSession(detection_model_path, providers=configs['providers'])
+    detection_profile = profile.get('detection', {})
+    detection_session = ort.InferenceSession(detection_model_path, sess_options=profiling_options(autotune.session_options(detection_profile), 'detection'), providers=detection_profile.get('providers', configs['providers']))
     logger.info(f"✅ 检测模型加载成功")
     logger.info(f"   - Providers: {detection_session.get_providers()}")
 
@@ -35,7 +65,8 @@ try:
         logger.error(f"❌ 特征提取模型文件不存在: {extraction_model_path}")
         raise FileNotFoundError(f"Extraction model not found: {extraction_model_path}")
 
-    extraction_session = ort.InferenceSession(extraction_model_path, providers=configs['providers'])
+    extraction_profile = profile.get('extraction', {})
+    extraction_session = ort.InferenceSession(extraction_model_path, sess_options=profiling_options(autotune.session_options(extraction_profile), 'extraction'), providers=extraction_profile.get('providers', configs['providers']))
     logger.info(f"✅ 特征提取模型加载成功")
     logger.info(f"   - Providers: {extraction_session.get_providers()}")
 
@@ -48,21 +79,51 @@ except Exception as e:
     logger.error("  3. 配置文件中的路径是否正确")
     raise
 
-width = configs['segment-width']
-height = configs['segment-height']
+# 提取配置决定采样帧率和预处理分辨率, 环境变量可覆盖配置文件中的选择, 用于对比不同提取配置
+extraction_profile_name = os.environ.get('SURVEILLANCE_EXTRACTION_PROFILE', configs['extraction-profile'])
+extraction_settings = configs['extraction-profiles'][extraction_profile_name]
+
+target_fps = extraction_settings['target-fps']
+frame_scale = extraction_settings['frame-scale']
+center_crop = extraction_settings['center-crop']
+
+width = round(configs['segment-width'] * frame_scale)
+height = round(configs['segment-height'] * frame_scale)
 length = configs['segment-length']
 
-x1 = configs['crop-x1']
-x2 = configs['crop-x2']
-y1 = configs['crop-y1']
-y2 = configs['crop-y2']
+x1 = round(configs['crop-x1'] * frame_scale)
+x2 = round(configs['crop-x2'] * frame_scale)
+y1 = round(configs['crop-y1'] * frame_scale)
+y2 = round(configs['crop-y2'] * frame_scale)
 
 std = configs['normalization-std']
 mean = configs['normalization-mean']
 
+feature_size = configs['feature-size']
+history_length = configs['history-length']
+
+if configs['precision'] == 'fp16':
+    precision_dtype = np.float16
+else:
+    precision_dtype = np.float32
+
+segment_shape = (1, 3, length, y2 - y1, x2 - x1)
+
+# center-crop 时先在原始帧上裁剪再直接缩放到裁剪尺寸, 只缩放保留的像素
+resized_shape = (y2 - y1, x2 - x1, 3) if center_crop else (height, width, 3)
+
+# 特征提取模型的输入尺寸固定时, 缩小分辨率的提取配置无法使用
+for model_size, segment_size in zip(extraction_session.get_inputs()[0].shape[3:], segment_shape[3:]):
+    if isinstance(model_size, int) and model_size != segment_size:
+        raise ValueError(f"extraction profile {extraction_profile_name} does not match extraction model input {extraction_session.get_inputs()[0].shape}")
+
 smoothing_weight = np.ones(configs['smoothing-window']) / configs['smoothing-window']
 
+extraction_latency = metrics.Histogram()
+detection_latency = metrics.Histogram()
+
 logger.info(f"推理参数配置:")
+logger.info(f"  - 提取配置: {extraction_profile_name} (目标帧率={target_fps or '原始帧率'}, 缩放={frame_scale}, 中心裁剪={center_crop})")
 logger.info(f"  - 视频段: {width}x{height}, 长度={length}帧")
 logger.info(f"  - 裁剪区域: [{x1}:{x2}, {y1}:{y2}]")
 logger.info(f"  - 归一化: mean={mean}, std={std}")
@@ -70,21 +131,117 @@ logger.info(f"  - 平滑窗口: {configs['smoothing-window']}")
 logger.info("=" * 60)
 
 
+def write_profiles():
+    # ONNX Runtime 在 end_profiling 时写出 Chrome trace 文件, 进程退出时调用
+    if profiling_onnx:
+        for session in (extraction_session, detection_session):
+            logger.info(f"ONNX Runtime 性能分析结果: {session.end_profiling()}")
+
+    if preprocess_trace.events:
+        trace_path = f'{profiling_directory}/preprocess.{os.getpid()}.json'
+        preprocess_trace.write(trace_path)
+        logger.info(f"预处理耗时采样结果: {trace_path}")
+
+
+atexit.register(write_profiles)
+
+
 def normalize(inputs):
     return (inputs - mean) / std
 
 
+def sample_stride(source_fps):
+    # 每个采样帧对应的源视频帧数, 未指定目标帧率或源帧率不高于目标帧率时逐帧采样
+    if target_fps <= 0 or source_fps <= target_fps:
+        return 1.0
+
+    return source_fps / target_fps
+
+
+class FrameSampler:
+    """
+    按目标帧率从源视频帧中均匀采样, 依次对每个源视频帧调用 take(), 返回 False 的帧只 grab 不解码
+    """
+
+    def __init__(self, source_fps):
+        self.stride = sample_stride(source_fps)
+        self.position = 0.0
+        self.index = 0
+
+    def take(self):
+        taken = self.index + 1e-6 >= self.position
+
+        if taken:
+            self.position += self.stride
+
+        self.index += 1
+
+        return taken
+
+
+def crop_resize(frame, resized=None):
+    # 返回按提取配置缩放并裁剪后的视频帧, 形状为 (y2 - y1, x2 - x1, 3), 解码器已缩放到目标尺寸时只需裁剪
+    if frame.shape[:2] == (height, width):
+        return frame[y1:y2, x1:x2]
+
+    if not center_crop:
+        return cv2.resize(frame, (width, height), dst=resized, interpolation=cv2.INTER_LINEAR)[y1:y2, x1:x2]
+
+    frame_height, frame_width = frame.shape[:2]
+    source_x1, source_x2 = x1 * frame_width // width, x2 * frame_width // width
+    source_y1, source_y2 = y1 * frame_height // height, y2 * frame_height // height
+
+    return cv2.resize(frame[source_y1:source_y2, source_x1:source_x2], (x2 - x1, y2 - y1), dst=resized, interpolation=cv2.INTER_LINEAR)
+
+
 def frame_preprocess(frame):
-    preprocessed = cv2.resize(frame, (width, height), interpolation=cv2.INTER_LINEAR)
-    preprocessed = preprocessed[y1:y2, x1:x2]
+    span = preprocess_trace.span('frame_preprocess')
 
-    return cv2.cvtColor(preprocessed, cv2.COLOR_BGR2RGB)
+    preprocessed = crop_resize(frame)
 
+    if span is not None:
+        span.mark('resize')
 
-def load_next_segment(capture):
+    preprocessed = cv2.cvtColor(preprocessed, cv2.COLOR_BGR2RGB)
+
+    if span is not None:
+        span.finish('crop-convert')
+
+    return preprocessed
+
+
+def segment_frame_preprocess(frame, segment, index, resized=None):
+    # 原地写入 segment[0, :, index], 与 frame_preprocess + segment_preprocess 的结果一致
+    span = preprocess_trace.span('segment_frame_preprocess')
+
+    resized = crop_resize(frame, resized)
+
+    if span is not None:
+        span.mark('resize')
+
+    preprocessed = resized.transpose((2, 0, 1))[::-1]
+
+    target = segment[0, :, index]
+    np.subtract(preprocessed, mean, out=target)
+    np.divide(target, std, out=target)
+
+    if span is not None:
+        span.finish('normalize')
+
+    return segment
+
+
+def load_next_segment(capture, frame_sampler=None):
     segment_frames = []
 
     while len(segment_frames) < length:
+        # 未采样的帧只 grab 不解码
+        if frame_sampler is not None and not frame_sampler.take():
+            if not capture.grab():
+                return False, None
+
+            continue
+
         read_success, captured_frame = capture.read()
 
         if read_success:
@@ -96,21 +253,31 @@ def load_next_segment(capture):
 
 
 def segment_preprocess(frames):
+    span = preprocess_trace.span('segment_preprocess')
+
     preprocessed = np.stack(frames, axis=0).transpose((3, 0, 1, 2))
 
+    if span is not None:
+        span.mark('stack')
+
     if configs['precision'] == 'fp16':
         preprocessed = normalize(preprocessed).astype(np.float16)
     else:
         preprocessed = normalize(preprocessed).astype(np.float32)
 
+    if span is not None:
+        span.finish('normalize')
+
     return np.expand_dims(preprocessed, axis=0)
 
 
 def extract_segment_features(segment):
     try:
         logger.debug(f"   特征提取输入shape: {segment.shape}, dtype: {segment.dtype}")
+        start_seconds = time.perf_counter()
         extraction_outputs = extraction_session.run(['outputs'], {'inputs': segment})
         extraction_outputs = extraction_outputs[0]
+        extraction_latency.observe(time.perf_counter() - start_seconds)
 
         result = np.squeeze(extraction_outputs, axis=0)
         logger.debug(f"   特征提取输出shape: {result.shape}")
@@ -122,17 +289,33 @@ def extract_segment_features(segment):
         raise
 
 
-def extract_video_features(video_path):
+def iterate_video_features(video_path):
+    # 逐个产生 (segment特征, segment总数), 视频帧和segment处理完即释放
+    capture = decoders.open_video(video_path, (width, height))
+    frame_sampler = FrameSampler(capture.get(cv2.CAP_PROP_FPS))
+    segment_total = max(1, int(capture.get(cv2.CAP_PROP_FRAME_COUNT) / (length * frame_sampler.stride)))
+
+    try:
+        while capture.isOpened():
+            load_success, preprocessed_segment = load_next_segment(capture, frame_sampler)
+
+            if not load_success:
+                break
+
+            yield extract_segment_features(preprocessed_segment), segment_total
+    finally:
+        capture.release()
+
+
+def extract_video_features(video_path, progress=None):
+    # progress(已处理segment数, segment总数) 在每个segment完成后调用, 可通过抛出异常中止处理
     features = []
-    capture = cv2.VideoCapture(video_path)
 
-    while capture.isOpened():
-        load_success, preprocessed_segment = load_next_segment(capture)
+    for segment_features, segment_total in iterate_video_features(video_path):
+        features.append(segment_features)
 
-        if load_success:
-            features.append(extract_segment_features(preprocessed_segment))
-        else:
-            capture.release()
+        if progress is not None:
+            progress(len(features), segment_total)
 
     return np.stack(features, axis=0)
 
@@ -153,8 +336,10 @@ def sigmoid(inputs):
 def detection_by_features(features):
     try:
         logger.debug(f"   异常检测输入shape: {features.shape}, dtype: {features.dtype}")
+        start_seconds = time.perf_counter()
         detection_outputs = detection_session.run(['outputs'], {'inputs': features})
         detection_outputs = detection_outputs[0]
+        detection_latency.observe(time.perf_counter() - start_seconds)
 
         result = sigmoid(np.squeeze(detection_outputs, axis=0))
         logger.debug(f"   异常检测输出shape: {result.shape}, 范围: [{result.min():.4f}, {result.max():.4f}]")
@@ -166,21 +351,64 @@ def detection_by_features(features):
         raise
 
 
+def metrics_snapshot():
+    return {
+        'extraction-latency': extraction_latency.snapshot(),
+        'detection-latency': detection_latency.snapshot(),
+    }
+
+
 def score_smoothing(scores):
     return np.convolve(scores, smoothing_weight, mode='same').round(decimals=2)
 
 
-def expand_scores(scores):
-    return np.array(scores).repeat(length, axis=0)
+def expand_scores(scores, stride=1.0):
+    # 按帧率采样后每个segment覆盖 length * stride 个源视频帧
+    scores = np.array(scores)
+    frame_count = round(len(scores) * length * stride)
+
+    return scores[np.minimum(np.arange(frame_count) // (length * stride), len(scores) - 1).astype(int)]
 
 
-def detection_by_video(video_path):
-    features = extract_video_features(video_path)
+def detection_by_video(video_path, progress=None):
+    features = extract_video_features(video_path, progress)
     features = features_preprocess(features)
 
     return score_smoothing(detection_by_features(features))
 
 
+def progressive_detection_by_video(video_path, progress=None):
+    """
+    逐个segment产生临时得分, 全部处理完成后产生与 detection_by_video 相同的平滑后的最终得分
+    临时得分由最近 history-length 个segment特征组成的滚动窗口检测得到, 与实时检测一致
+    只保留segment特征, 保存在按需倍增的预分配数组中, 视频帧处理完即释放
+    依次产生 ('provisional', segment序号, segment总数, 临时得分), 最后产生 ('final', 最终得分)
+    """
+    features = None
+    feature_count = 0
+
+    for segment_features, segment_total in iterate_video_features(video_path):
+        if features is None:
+            features = np.empty((segment_total, feature_size), dtype=precision_dtype)
+        elif feature_count == len(features):
+            features = np.concatenate([features, np.empty_like(features)])
+
+        features[feature_count] = segment_features
+        feature_count += 1
+
+        if progress is not None:
+            progress(feature_count, segment_total)
+
+        window = features[max(0, feature_count - history_length):feature_count]
+
+        yield 'provisional', feature_count, max(segment_total, feature_count), float(detection_by_features(np.expand_dims(window, axis=0))[-1])
+
+    if feature_count == 0:
+        raise ValueError('video is shorter than one segment')
+
+    yield 'final', score_smoothing(detection_by_features(features_preprocess(features[:feature_count])))
+
+
 def anomaly_prompt_enhancement(frame, prompt):
     return cv2.putText(frame, prompt, (120, 60), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 215), thickness=2)
 
@@ -0,0 +1,93 @@
+import threading
+import time
+import logging
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+class LiveFrameGrabber:
+    """
+    实时视频源读取线程, 持续调用 grab() 取走视频源后端缓冲区中的视频帧, 使画面始终是最新的
+    只有下游可以接收时才调用 retrieve() 完成解码后的颜色转换并交付视频帧, 其余视频帧只 grab 不 retrieve
+    sample_frame 返回 False 的视频帧按目标帧率被采样跳过, 同样只 grab 不 retrieve, 且不视为丢弃
+    paced 为 True 时按照视频源帧率 grab, 用本地视频文件模拟实时视频流
+    """
+
+    def __init__(self, capture, frame_period, retry_interval, accept_frame, deliver_frame, skip_frame, sample_frame=None, paced=False, name='LiveGrabber'):
+        self.capture = capture
+        self.frame_period = frame_period
+        self.retry_interval = retry_interval
+        self.paced = paced
+
+        self.accept_frame = accept_frame
+        self.deliver_frame = deliver_frame
+        self.skip_frame = skip_frame
+        self.sample_frame = sample_frame
+
+        self.grab_count = 0
+        self.retrieve_count = 0
+        self.error_count = 0
+
+        self.running = True
+        self.thread = threading.Thread(target=self.grab_process, name=name, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def grab_process(self):
+        logger.info("🎥 LiveGrabber 开始运行")
+
+        next_seconds = time.perf_counter()
+
+        while self.running:
+            if self.paced:
+                delay_seconds = next_seconds - time.perf_counter()
+
+                if delay_seconds > 0:
+                    time.sleep(delay_seconds)
+
+                next_seconds = max(next_seconds + self.frame_period, time.perf_counter())
+
+            try:
+                # grab 时刻即视频帧离开视频源后端缓冲区的时刻, 用于计算端到端得分延迟
+                grab_success = self.capture.grab()
+                grabbed_time = time.time()
+
+                if not grab_success:
+                    logger.warning(f"⚠️ grab 视频帧失败 (已 grab {self.grab_count} 帧)")
+                    self.error_count += 1
+                    time.sleep(self.retry_interval)
+                    continue
+
+                self.grab_count += 1
+
+                if self.sample_frame is not None and not self.sample_frame():
+                    continue
+
+                if not self.accept_frame():
+                    self.skip_frame()
+                    continue
+
+                retrieve_success, frame = self.capture.retrieve()
+
+                if retrieve_success:
+                    self.retrieve_count += 1
+                    self.deliver_frame(grabbed_time, frame)
+                else:
+                    self.error_count += 1
+                    self.skip_frame()
+
+            except Exception as e:
+                logger.error(f"❌ LiveGrabber 异常: {e}")
+                logger.error(f"异常堆栈:\n{traceback.format_exc()}")
+                self.error_count += 1
+                time.sleep(self.retry_interval)
+
+        logger.info(f"🎥 LiveGrabber 已停止: grab {self.grab_count} 帧, retrieve {self.retrieve_count} 帧")
+
+    def stop(self, timeout=5):
+        self.running = False
+
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(timeout=timeout)
@@ -0,0 +1,147 @@
+import threading
+import bisect
+import collections
+import json
+import os
+import random
+import time
+
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+duration_buckets = (1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+
+class Histogram:
+    """
+    累积直方图, 每次记录只做一次二分查找和计数, 可在推理热路径上常开
+    snapshot 返回可序列化的 (桶边界, 各桶计数, 总和, 总数), 用于跨进程汇总和输出
+    """
+
+    def __init__(self, buckets=latency_buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            self.counts[index] += 1
+            self.total += value
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            return self.buckets, list(self.counts), self.total, self.count
+
+
+def merge_snapshots(snapshots):
+    snapshots = list(snapshots)
+    buckets, counts, total, count = snapshots[0]
+    counts = list(counts)
+
+    for _, other_counts, other_total, other_count in snapshots[1:]:
+        counts = [current + other for current, other in zip(counts, other_counts)]
+        total += other_total
+        count += other_count
+
+    return buckets, counts, total, count
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+class MetricsWriter:
+    """按照 Prometheus 文本格式输出指标, 同一指标的所有序列写在同一组 HELP/TYPE 之后"""
+
+    def __init__(self):
+        self.lines = []
+
+    def write_header(self, name, help_text, metric_type):
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} {metric_type}')
+
+    def gauge(self, name, help_text, samples):
+        self.write_header(name, help_text, 'gauge')
+
+        for labels, value in samples:
+            self.lines.append(f'{name}{format_labels(labels)} {value}')
+
+    def counter(self, name, help_text, samples):
+        self.write_header(name, help_text, 'counter')
+
+        for labels, value in samples:
+            self.lines.append(f'{name}{format_labels(labels)} {value}')
+
+    def histogram(self, name, help_text, samples):
+        self.write_header(name, help_text, 'histogram')
+
+        for labels, (buckets, counts, total, count) in samples:
+            cumulative = 0
+
+            for bucket, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                self.lines.append(f'{name}_bucket{format_labels({**labels, "le": bucket})} {cumulative}')
+
+            self.lines.append(f'{name}_bucket{format_labels({**labels, "le": "+Inf"})} {count}')
+            self.lines.append(f'{name}_sum{format_labels(labels)} {total}')
+            self.lines.append(f'{name}_count{format_labels(labels)} {count}')
+
+    def render(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+class TraceSpan:
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+        self.start = self.last = time.perf_counter()
+
+    def mark(self, stage):
+        # 记录上一个阶段结束到现在的耗时
+        now = time.perf_counter()
+        self.trace.add(stage, self.last, now)
+        self.last = now
+
+    def finish(self, stage):
+        self.mark(stage)
+        self.trace.add(self.name, self.start, self.last)
+
+
+class TraceSampler:
+    """
+    按比例采样记录热路径中各阶段的耗时, 以 Chrome trace 格式输出, 可在 chrome://tracing 或 Perfetto 中查看
+    只保留最近 capacity 个事件, 采样比例为 0 时 span 直接返回 None
+    """
+
+    def __init__(self, rate, capacity=100000):
+        self.rate = rate
+        self.events = collections.deque(maxlen=capacity)
+        self.origin = time.perf_counter()
+
+    def span(self, name):
+        if self.rate <= 0 or random.random() >= self.rate:
+            return None
+
+        return TraceSpan(self, name)
+
+    def add(self, name, start, finish):
+        self.events.append({
+            'name': name,
+            'ph': 'X',
+            'ts': (start - self.origin) * 1e6,
+            'dur': (finish - start) * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+        })
+
+    def write(self, path):
+        with open(path, 'w') as trace_file:
+            json.dump({'traceEvents': list(self.events), 'displayTimeUnit': 'ms'}, trace_file)
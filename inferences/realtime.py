@@ -1,5 +1,7 @@
 import threading
+import queue
 import collections
+import os
 import cv2
 import time
 import toml
@@ -7,6 +9,12 @@ import numpy as np
 import logging
 import traceback
 import inferences.engines as engines
+import inferences.decoders as decoders
+import inferences.buffers as buffers
+import inferences.metrics as metrics
+import inferences.clips as clips
+import inferences.grabbers as grabbers
+import inferences.scheduler as realtime_scheduler
 
 # 配置日志
 logging.basicConfig(
@@ -25,12 +33,36 @@ logger.info(f"配置文件加载成功: inferences/configs/config.toml")
 segment_length = configs['segment-length']
 history_length = configs['history-length']
 
-capture_interval = configs['capture-interval']
-prepare_interval = configs['prepare-interval']
-predict_interval = configs['predict-interval']
+frame_queue_size = configs['frame-queue-size']
+segment_queue_size = configs['segment-queue-size']
+
+# 除等待或正在特征提取的片段外, 还需要一个缓冲区用于组装下一个片段
+segment_pool_size = segment_queue_size + 1
+
+retry_interval = configs['retry-interval']
+default_source_fps = configs['default-source-fps']
+
+live_grabber = configs['live-grabber']
+capture_buffer_size = configs['capture-buffer-size']
+source_open_timeout = configs['source-open-timeout']
+
+capture_workers = configs['capture-workers']
+# 未指定计算线程数时优先使用调优结果, 使计算线程数与每次推理的线程数之积不超过核心数
+compute_workers = configs['compute-workers'] or engines.profile.get('compute-workers') or os.cpu_count()
+latency_window = configs['latency-window']
+score_buffer_size = configs['score-buffer-size']
+clip_enabled = configs['clip-enabled']
+
+scheduler_lock = threading.Lock()
+scheduler = None
+
+live_source_prefixes = ('rtsp://', 'rtmp://', 'http://', 'https://', 'udp://', 'tcp://')
+
+# 各视频源上一次成功打开时使用的后端, 重新打开时优先尝试, 跳过已知不可用的后端
+source_backends = {}
 
 logger.info(f"配置参数: segment_length={segment_length}, history_length={history_length}")
-logger.info(f"时间间隔: capture={capture_interval}s, prepare={prepare_interval}s, predict={predict_interval}s")
+logger.info(f"调度参数: capture_workers={capture_workers}, compute_workers={compute_workers}, frame_queue={frame_queue_size}, 重试间隔={retry_interval}s")
 
 
 def execute_task_in_seconds(task, args=None, target_seconds=0):
@@ -52,11 +84,31 @@ def execute_task_in_seconds(task, args=None, target_seconds=0):
     return task_execution_result
 
 
+def get_scheduler():
+    global scheduler
+
+    # 所有会话共享同一个调度器, 在创建第一个会话时启动
+    with scheduler_lock:
+        if scheduler is None:
+            scheduler = realtime_scheduler.RealtimeScheduler(capture_workers, compute_workers, frame_queue_size, latency_window)
+
+        return scheduler
+
+
+def is_live_source(source):
+    if isinstance(source, int) or (isinstance(source, str) and source.isdigit()):
+        return True
+
+    return isinstance(source, str) and source.lower().startswith(live_source_prefixes)
+
+
 class RealtimeInferenceSession:
-    def __init__(self, source):
+    def __init__(self, source, scheduler=None, grabber=None):
         logger.info("=" * 60)
         logger.info(f"创建实时检测会话: source='{source}'")
 
+        self.source = source
+
         # 初始化视频捕获
         try:
             self.capture = self._open_video_source(source)
@@ -74,45 +126,99 @@ class RealtimeInferenceSession:
             logger.error(f"异常堆栈:\n{traceback.format_exc()}")
             raise
 
-        # 初始化队列
-        logger.info(f"初始化队列: segment_queue(maxlen={segment_length}), feature_queue(maxlen={history_length})")
-        self.segment_queue = collections.deque(maxlen=segment_length)
-        self.feature_queue = collections.deque(maxlen=history_length)
+        # 按照视频源帧率调度读取, 本地视频文件以此模拟实时视频流
+        self.live_source = is_live_source(source)
+        source_fps = self.capture.get(cv2.CAP_PROP_FPS)
+        self.frame_period = 1 / (source_fps if source_fps > 0 else default_source_fps)
+        self.retry_interval = retry_interval
+
+        # 按提取配置的目标帧率采样, 未采样的帧只 grab 不解码, 也不计入帧序号
+        self.frame_sampler = engines.FrameSampler(source_fps if source_fps > 0 else default_source_fps)
+
+        # 实时视频源尽量缩小后端缓冲区, 避免处理停顿时缓冲区积压导致画面落后于现实
+        if self.live_source and capture_buffer_size > 0:
+            if self.capture.set(cv2.CAP_PROP_BUFFERSIZE, capture_buffer_size):
+                logger.info(f"视频源缓冲区大小设置为 {capture_buffer_size} 帧")
+            else:
+                logger.info("当前视频源后端不支持设置缓冲区大小")
 
-        # 初始化线程控制标志
-        self.capture_running = True
-        self.prepare_running = True
-        self.predict_running = True
+        # 初始化预分配缓冲区: segment按特征提取模型输入形状原地写入, 特征历史使用环形缓冲区
+        logger.info(f"初始化缓冲区: segment_buffers({segment_pool_size}x{engines.segment_shape}), feature_buffer({history_length}x{engines.feature_size})")
+        self.segment_buffers = buffers.SegmentBufferPool(segment_pool_size, engines.segment_shape, engines.precision_dtype)
+        self.feature_buffer = buffers.FeatureRingBuffer(history_length, engines.feature_size, engines.precision_dtype)
+        self.resized_frame = np.empty(engines.resized_shape, dtype=np.uint8)
+
+        self.released = False
+        self.frame_shape = (height, width, 3)
+
+        # 进程隔离模式下由工作进程设置, 将最新视频帧和异常得分发布到共享内存
+        self.publisher = None
 
         # 初始化共享变量
         self.current_frame = None
         self.current_score = None
+        self.current_score_time = None
+
+        # 待持久化的 (得分时间, 得分), 推理线程只追加不等待数据库, 超出容量时丢弃最旧的得分
+        self.score_outbox = collections.deque(maxlen=score_buffer_size)
+
+        # 保存最近视频帧的压缩结果, 检测到异常事件时录制包含 pre-roll 和 post-roll 的片段
+        self.clip_recorder = clips.ClipRecorder() if clip_enabled else None
+
+        # 初始化segment组装状态
+        self.segment_index = None
+        self.segment_position = 0
+        self.segment_start_time = None
+        self.last_frame_index = None
+        self.frame_index = 0
 
         # 初始化统计计数器
         self.frame_count = 0
         self.segment_count = 0
         self.predict_count = 0
+        self.dropped_count = 0
+        self.sampled_out_count = 0
         self.error_count = 0
 
+        # 初始化监控指标
+        self.capture_fps = 0.0
+        self.last_captured_time = None
+        self.segment_lag = metrics.Histogram()
+        self.score_latency = metrics.Histogram()
+
         # 初始化锁
         self.current_lock = threading.Lock()
-        self.segment_lock = threading.Lock()
 
-        # 启动工作线程
-        logger.info("启动工作线程...")
-        self.capture_thread = threading.Thread(target=self.capture_process, name="CaptureThread")
-        self.prepare_thread = threading.Thread(target=self.prepare_process, name="PrepareThread")
-        self.predict_thread = threading.Thread(target=self.predict_process, name="PredictThread")
+        # 开启 live-grabber 时实时视频源由独立的读取线程持续 grab, 本地视频文件可指定 grabber=True 以按帧率模拟实时视频流
+        if grabber is None:
+            grabber = live_grabber and self.live_source
+
+        if grabber:
+            self.grabber = grabbers.LiveFrameGrabber(
+                self.capture, self.frame_period, self.retry_interval,
+                accept_frame=lambda: self.scheduler.accepts(self),
+                deliver_frame=self.deliver_frame,
+                skip_frame=self.skip_frame,
+                sample_frame=self.sample_frame,
+                paced=not self.live_source,
+            )
+        else:
+            self.grabber = None
+
+        # 注册到共享调度器, 使用独立读取线程时调度器只负责计算
+        self.scheduler = scheduler if scheduler is not None else get_scheduler()
+        self.scheduler.register(self, capture=self.grabber is None)
 
-        self.capture_thread.start()
-        self.prepare_thread.start()
-        self.predict_thread.start()
+        if self.grabber is not None:
+            self.grabber.start()
 
-        logger.info("✅ 所有线程启动成功")
+        logger.info(f"✅ 会话已注册到调度器 (读取模式: {'LiveGrabber' if self.grabber is not None else '调度器'})")
         logger.info("=" * 60)
 
     def __del__(self):
-        self.release()
+        # 视频源打开失败时会话未完成初始化, 没有需要释放的资源
+        if hasattr(self, 'released'):
+            self.release()
 
     def _open_video_source(self, source):
         """
@@ -148,27 +254,10 @@ class RealtimeInferenceSession:
                 ]
 
             # 尝试不同的后端
-            for backend, backend_name in backends_to_try:
-                logger.info(f"  尝试使用 {backend_name} 后端...")
-
-                try:
-                    cap = cv2.VideoCapture(source_int, backend)
-
-                    if cap.isOpened():
-                        # 尝试读取一帧验证
-                        ret, frame = cap.read()
-                        if ret:
-                            logger.info(f"  ✅ 使用 {backend_name} 后端成功!")
-                            return cap
-                        else:
-                            logger.warning(f"  ⚠️ {backend_name} 打开成功但无法读取帧")
-                            cap.release()
-                    else:
-                        logger.warning(f"  ⚠️ {backend_name} 无法打开")
+            cap = self._try_video_backends(source, source_int, backends_to_try)
 
-                except Exception as e:
-                    logger.warning(f"  ⚠️ {backend_name} 出错: {e}")
-                    continue
+            if cap is not None:
+                return cap
 
             # 所有后端都失败
             logger.error(f"❌ 无法打开摄像头 {source}")
@@ -190,9 +279,24 @@ class RealtimeInferenceSession:
             # 文件路径或 RTSP 地址
             logger.info(f"  检测到文件路径或网络地址: {source}")
 
-            cap = cv2.VideoCapture(source)
+            # 网络视频流使用 FFmpeg 后端并设置打开和读取超时, 避免不可达的地址长时间阻塞
+            if is_live_source(source):
+                backends_to_try = [
+                    (cv2.CAP_FFMPEG, "FFmpeg"),
+                    (cv2.CAP_ANY, "Auto"),
+                ]
+            else:
+                backends_to_try = [
+                    (cv2.CAP_ANY, "Auto"),
+                ]
+
+            # 配置为 PyAV 解码时优先尝试, 失败后仍回退到 OpenCV 后端
+            if decoders.decoder_backend == decoders.pyav_backend:
+                backends_to_try.insert(0, (decoders.pyav_backend, "PyAV"))
+
+            cap = self._try_video_backends(source, source, backends_to_try)
 
-            if not cap.isOpened():
+            if cap is None:
                 logger.error(f"❌ 无法打开视频源: {source}")
                 logger.error("可能原因:")
                 logger.error("  1. 文件不存在或路径错误")
@@ -202,29 +306,71 @@ class RealtimeInferenceSession:
 
                 raise RuntimeError(f"Failed to open video source: {source}")
 
-            # 验证能否读取
-            ret, frame = cap.read()
-            if not ret:
-                logger.error(f"❌ 视频源打开成功但无法读取帧")
-                cap.release()
-                raise RuntimeError(f"Cannot read from video source: {source}")
-
             logger.info(f"  ✅ 视频源打开成功!")
             return cap
 
+    def _try_video_backends(self, source, capture_source, backends_to_try):
+        # 上一次成功的后端排在最前, 其余后端保持原有顺序
+        cached_backend = source_backends.get(source)
+        backends_to_try = sorted(backends_to_try, key=lambda backend: backend[0] != cached_backend)
+
+        timeout_params = [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, int(source_open_timeout * 1000), cv2.CAP_PROP_READ_TIMEOUT_MSEC, int(source_open_timeout * 1000)]
+
+        for backend, backend_name in backends_to_try:
+            logger.info(f"  尝试使用 {backend_name} 后端...")
+
+            try:
+                if backend == decoders.pyav_backend:
+                    cap = decoders.PyAVDecoder(capture_source, threads=decoders.decoder_threads, live=is_live_source(source), timeout=source_open_timeout)
+                elif backend == cv2.CAP_FFMPEG:
+                    cap = cv2.VideoCapture(capture_source, backend, timeout_params)
+                else:
+                    cap = cv2.VideoCapture(capture_source, backend)
+
+                if cap.isOpened():
+                    # 尝试读取一帧验证
+                    ret, frame = cap.read()
+                    if ret:
+                        logger.info(f"  ✅ 使用 {backend_name} 后端成功!")
+                        source_backends[source] = backend
+                        return cap
+                    else:
+                        logger.warning(f"  ⚠️ {backend_name} 打开成功但无法读取帧")
+                        cap.release()
+                else:
+                    logger.warning(f"  ⚠️ {backend_name} 无法打开")
+
+            except Exception as e:
+                logger.warning(f"  ⚠️ {backend_name} 出错: {e}")
+                continue
+
+        source_backends.pop(source, None)
+
+        return None
+
     def capture_task(self):
+        # 由调度器的读取线程调用, 返回距离下一次读取的间隔
         try:
+            if not self.sample_frame():
+                if self.capture.grab():
+                    return self.frame_period
+
+                logger.warning(f"⚠️ grab 帧失败 (尝试 {self.frame_count + 1})")
+                self.error_count += 1
+
+                return self.retry_interval
+
             read_success, captured_frame = self.capture.read()
+            captured_time = time.time()
 
             if read_success:
-                with self.current_lock:
-                    self.current_frame = captured_frame
-                    self.frame_count += 1
+                self.deliver_frame(captured_time, captured_frame)
 
-                # 每100帧输出一次统计
-                if self.frame_count % 100 == 0:
-                    logger.debug(f"📹 已捕获 {self.frame_count} 帧, 当前segment队列长度: {len(self.segment_queue)}")
+                return self.frame_period
             else:
+                # 读取失败的帧同样占用一个帧序号, 以便下游识别帧序列的中断
+                self.frame_index += 1
+
                 logger.warning(f"⚠️ 读取帧失败 (尝试 {self.frame_count + 1})")
                 self.error_count += 1
 
@@ -233,103 +379,175 @@ class RealtimeInferenceSession:
             logger.error(f"异常堆栈:\n{traceback.format_exc()}")
             self.error_count += 1
 
-    def capture_process(self):
-        logger.info("🎬 CaptureThread 开始运行")
-        try:
-            while self.capture_running:
-                execute_task_in_seconds(self.capture_task, target_seconds=capture_interval)
-        except Exception as e:
-            logger.error(f"❌ capture_process异常: {e}")
-            logger.error(f"异常堆栈:\n{traceback.format_exc()}")
-        finally:
-            logger.info("🎬 CaptureThread 已停止")
+        return self.retry_interval
 
-    def prepare_task(self):
-        try:
-            with self.current_lock:
-                current_frame = self.current_frame
+    def deliver_frame(self, captured_time, captured_frame):
+        # 由调度器的读取线程或 LiveGrabber 调用, 丢弃的帧同样占用一个帧序号
+        self.frame_index += 1
 
-            if current_frame is not None:
-                # 预处理帧
-                preprocessed = engines.frame_preprocess(current_frame)
+        # 读取帧率使用指数滑动平均, 避免为每一帧保留样本
+        if self.last_captured_time is not None and captured_time > self.last_captured_time:
+            self.capture_fps = 0.9 * self.capture_fps + 0.1 / (captured_time - self.last_captured_time)
 
-                with self.segment_lock:
-                    self.segment_queue.append(preprocessed)
+        self.last_captured_time = captured_time
 
-                # 当segment队列满时输出日志
-                if len(self.segment_queue) == segment_length:
-                    self.segment_count += 1
-                    logger.debug(f"📦 Segment队列已满 ({segment_length}帧), 准备进行特征提取 (第{self.segment_count}个segment)")
+        with self.current_lock:
+            self.current_frame = captured_frame
+            self.frame_count += 1
 
-        except Exception as e:
-            logger.error(f"❌ prepare_task异常: {e}")
-            logger.error(f"异常堆栈:\n{traceback.format_exc()}")
-            self.error_count += 1
+            if self.publisher is not None:
+                self.publisher.publish(captured_frame, captured_time, self.current_score, self.current_score_time)
 
-    def prepare_process(self):
-        logger.info("🔧 PrepareThread 开始运行")
-        try:
-            while self.prepare_running:
-                execute_task_in_seconds(self.prepare_task, target_seconds=prepare_interval)
-        except Exception as e:
-            logger.error(f"❌ prepare_process异常: {e}")
-            logger.error(f"异常堆栈:\n{traceback.format_exc()}")
-        finally:
-            logger.info("🔧 PrepareThread 已停止")
+        # 每100帧输出一次统计
+        if self.frame_count % 100 == 0:
+            logger.debug(f"📹 已捕获 {self.frame_count} 帧, 已丢弃 {self.dropped_count} 帧")
 
-    def load_segment_frames(self):
-        if not len(self.segment_queue) == segment_length:
-            current_segment_frames = None
-        else:
-            current_segment_frames = self.segment_queue.copy()
-            self.segment_queue.clear()
+        if not self.scheduler.submit(self, ('frame', (self.frame_index, captured_time, captured_frame))):
+            self.dropped_count += 1
+
+    def sample_frame(self):
+        if self.frame_sampler.take():
+            return True
+
+        self.sampled_out_count += 1
+
+        return False
+
+    def skip_frame(self):
+        # LiveGrabber 在下游积压已满时只 grab 不 retrieve, 跳过的帧不解码
+        self.frame_index += 1
+        self.dropped_count += 1
 
-        return current_segment_frames
+    def compute_task(self, item):
+        # 由调度器的计算线程调用, 同一会话的数据按顺序串行处理
+        item_type, item_data = item
 
-    def predict_task(self):
+        if item_type == 'frame':
+            self.prepare_task(item_data)
+        else:
+            self.predict_task(item_data)
+
+    def prepare_task(self, frame_item):
         try:
-            with self.segment_lock:
-                segment_frames = self.load_segment_frames()
+            frame_index, frame_time, frame = frame_item
+
+            # 帧序号不连续时丢弃未完成的segment, 保证segment由真实的连续帧组成
+            if self.segment_position > 0 and frame_index != self.last_frame_index + 1:
+                logger.warning(f"⚠️ 帧序列中断 ({self.last_frame_index} -> {frame_index}), 丢弃未完成的segment ({self.segment_position}帧)")
+                self.segment_position = 0
 
-            if segment_frames is not None:
-                logger.debug(f"🔍 开始处理 segment (feature_queue长度: {len(self.feature_queue)})")
+            self.last_frame_index = frame_index
 
-                # 特征提取
-                logger.debug("   → 步骤1: segment预处理")
-                preprocessed_segment = engines.segment_preprocess(segment_frames)
+            if self.clip_recorder is not None:
+                self.clip_recorder.add_frame(frame_time, frame)
 
-                logger.debug("   → 步骤2: 特征提取")
-                extracted_features = engines.extract_segment_features(preprocessed_segment)
-                self.feature_queue.append(extracted_features)
+            if self.segment_index is None:
+                try:
+                    self.segment_index = self.segment_buffers.acquire(timeout=0)
+                except queue.Empty:
+                    logger.warning("⚠️ 没有空闲的segment缓冲区, 丢弃当前帧")
+                    self.dropped_count += 1
+                    return
+
+            if self.segment_position == 0:
+                self.segment_start_time = frame_time
 
-                logger.debug(f"   → 步骤3: 特征序列准备 (队列长度: {len(self.feature_queue)})")
-                features = np.stack(self.feature_queue, axis=0)
-                features = engines.features_preprocess(features)
+            engines.segment_frame_preprocess(frame, self.segment_buffers[self.segment_index], self.segment_position, self.resized_frame)
+            self.segment_position += 1
 
-                logger.debug("   → 步骤4: 异常检测推理")
-                realtime_scores = engines.detection_by_features(features)
+            if self.segment_position == segment_length:
+                segment = (self.segment_start_time, frame_time, self.segment_index)
+                self.segment_index = None
+                self.segment_position = 0
+                self.segment_count += 1
 
-                with self.current_lock:
-                    self.current_score = realtime_scores[-1]
-                    self.predict_count += 1
+                self.segment_lag.observe(time.time() - frame_time)
+                logger.debug(f"📦 Segment已组装 ({segment_length}帧), 准备进行特征提取 (第{self.segment_count}个segment)")
 
-                logger.info(f"✅ 推理完成 (#{self.predict_count}): 当前异常得分 = {self.current_score:.4f}")
+                # 已组装的segment插入队首, 在后续视频帧之前完成推理
+                if not self.scheduler.submit(self, ('segment', segment), urgent=True):
+                    self.segment_buffers.release(segment[2])
 
         except Exception as e:
-            logger.error(f"❌ predict_task异常: {e}")
+            logger.error(f"❌ prepare_task异常: {e}")
             logger.error(f"异常堆栈:\n{traceback.format_exc()}")
             self.error_count += 1
 
-    def predict_process(self):
-        logger.info("🧠 PredictThread 开始运行")
+    def predict_task(self, segment):
+        segment_start_time, segment_finish_time, segment_index = segment
+
         try:
-            while self.predict_running:
-                execute_task_in_seconds(self.predict_task, target_seconds=predict_interval)
+            logger.debug(f"🔍 开始处理 segment (feature_buffer长度: {len(self.feature_buffer)})")
+
+            # 特征提取, segment缓冲区已按模型输入形状原地写入
+            logger.debug("   → 步骤1: 特征提取")
+            extracted_features = engines.extract_segment_features(self.segment_buffers[segment_index])
+            self.feature_buffer.append(extracted_features)
+
+            logger.debug(f"   → 步骤2: 特征序列准备 (缓冲区长度: {len(self.feature_buffer)})")
+            features = self.feature_buffer.view()
+
+            logger.debug("   → 步骤3: 异常检测推理")
+            realtime_scores = engines.detection_by_features(features)
+
+            with self.current_lock:
+                self.current_score = realtime_scores[-1]
+                self.current_score_time = segment_finish_time
+                self.predict_count += 1
+
+            self.score_outbox.append((segment_finish_time, float(realtime_scores[-1])))
+
+            if self.clip_recorder is not None:
+                self.clip_recorder.update_score(realtime_scores[-1], segment_start_time, segment_finish_time)
+
+            score_latency = time.time() - segment_finish_time
+            self.scheduler.record('score-latency', score_latency)
+            self.score_latency.observe(score_latency)
+            logger.info(f"✅ 推理完成 (#{self.predict_count}): 当前异常得分 = {self.current_score:.4f}, 端到端延迟 = {score_latency:.3f}s")
+
         except Exception as e:
-            logger.error(f"❌ predict_process异常: {e}")
+            logger.error(f"❌ predict_task异常: {e}")
             logger.error(f"异常堆栈:\n{traceback.format_exc()}")
+            self.error_count += 1
         finally:
-            logger.info("🧠 PredictThread 已停止")
+            self.segment_buffers.release(segment_index)
+
+    def drain_scores(self):
+        scores = []
+
+        while self.score_outbox:
+            scores.append(self.score_outbox.popleft())
+
+        return scores
+
+    def drain_events(self):
+        if self.clip_recorder is None:
+            return []
+
+        return self.clip_recorder.drain_events()
+
+    def metrics_snapshot(self):
+        return {
+            'capture-fps': self.capture_fps,
+            'grabbed': self.frame_index + self.sampled_out_count,
+            'sampled-out': self.sampled_out_count,
+            'frames': self.frame_count,
+            'segments': self.segment_count,
+            'predictions': self.predict_count,
+            'dropped': self.dropped_count,
+            'errors': self.error_count,
+            'segment-lag': self.segment_lag.snapshot(),
+            'score-latency': self.score_latency.snapshot(),
+        }
+
+    def get_frame(self):
+        # 返回 (帧序号, 当前帧, 当前得分), 当前帧仍可能在等待预处理, 调用方不能修改
+        with self.current_lock:
+            return self.frame_count, self.current_frame, self.current_score
+
+    def valid(self, sequence):
+        # 每次读取都会得到新的帧数组, 已返回的帧不会被覆盖
+        return True
 
     def get_result(self):
         with self.current_lock:
@@ -342,25 +560,25 @@ class RealtimeInferenceSession:
         if result_score is None:
             return None
 
-        return engines.draw_detection_result(result_frame, result_score)
+        # 当前帧同时在等待预处理, 叠加检测结果时不能修改原始帧
+        return engines.draw_detection_result(result_frame.copy(), result_score)
 
     def release(self):
+        if self.released:
+            return
+
+        self.released = True
+
         logger.info("=" * 60)
         logger.info("正在释放实时检测会话...")
 
-        # 停止所有线程
-        logger.info("停止工作线程...")
-        self.capture_running = False
-        self.prepare_running = False
-        self.predict_running = False
+        # 先停止 LiveGrabber, 再从调度器注销, 等待正在执行的读取和计算任务结束
+        if self.grabber is not None:
+            logger.info("停止 LiveGrabber...")
+            self.grabber.stop()
 
-        # 等待线程结束
-        logger.info("等待CaptureThread结束...")
-        self.capture_thread.join(timeout=5)
-        logger.info("等待PrepareThread结束...")
-        self.prepare_thread.join(timeout=5)
-        logger.info("等待PredictThread结束...")
-        self.predict_thread.join(timeout=5)
+        logger.info("从调度器注销...")
+        self.scheduler.unregister(self)
 
         # 释放摄像头
         logger.info("释放视频捕获资源...")
@@ -372,6 +590,7 @@ class RealtimeInferenceSession:
         logger.info(f"  - 总捕获帧数: {self.frame_count}")
         logger.info(f"  - 处理segment数: {self.segment_count}")
         logger.info(f"  - 推理次数: {self.predict_count}")
+        logger.info(f"  - 丢弃帧数: {self.dropped_count}")
         logger.info(f"  - 错误次数: {self.error_count}")
         logger.info("会话已释放")
         logger.info("=" * 60)
@@ -0,0 +1,238 @@
+import threading
+import collections
+import heapq
+import itertools
+import time
+import numpy as np
+import logging
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledStream:
+    def __init__(self, session):
+        self.session = session
+        self.pending = collections.deque()
+
+        self.capture_active = False
+        self.compute_active = False
+        self.compute_queued = False
+        self.released = False
+
+
+class RealtimeScheduler:
+    """
+    多路视频流调度器, 所有会话共享固定数量的视频帧读取线程和计算线程
+    读取线程按照各视频流的截止时间依次读取视频帧, 计算线程在有待处理数据的视频流之间轮询,
+    每次只处理一个视频流的一项数据, 同一视频流的数据按顺序串行处理
+    """
+
+    def __init__(self, capture_workers, compute_workers, backlog_size, latency_window):
+        self.lock = threading.Lock()
+        self.capture_condition = threading.Condition(self.lock)
+        self.compute_condition = threading.Condition(self.lock)
+        self.idle_condition = threading.Condition(self.lock)
+
+        self.streams = {}
+        self.capture_heap = []
+        self.compute_ready = collections.deque()
+        self.capture_sequence = itertools.count()
+
+        self.backlog_size = backlog_size
+        self.latency_samples = collections.defaultdict(lambda: collections.deque(maxlen=latency_window))
+        self.running = True
+
+        self.workers = []
+
+        for index in range(capture_workers):
+            self.workers.append(threading.Thread(target=self.capture_process, name=f"CaptureWorker-{index}", daemon=True))
+
+        for index in range(compute_workers):
+            self.workers.append(threading.Thread(target=self.compute_process, name=f"ComputeWorker-{index}", daemon=True))
+
+        for worker in self.workers:
+            worker.start()
+
+        logger.info(f"✅ 调度器启动成功: 读取线程={capture_workers}, 计算线程={compute_workers}, 积压上限={backlog_size}")
+
+    def register(self, session, capture=True):
+        # capture 为 False 时视频帧由会话自行读取后提交, 调度器只负责计算
+        with self.lock:
+            stream = ScheduledStream(session)
+            self.streams[session] = stream
+
+            if capture:
+                heapq.heappush(self.capture_heap, (time.perf_counter(), next(self.capture_sequence), stream))
+                self.capture_condition.notify()
+
+            logger.info(f"调度器注册视频流, 当前视频流数: {len(self.streams)}")
+
+    def unregister(self, session, timeout=5):
+        with self.lock:
+            stream = self.streams.pop(session, None)
+
+            if stream is None:
+                return
+
+            stream.released = True
+            stream.pending.clear()
+
+            if stream.compute_queued:
+                self.compute_ready.remove(stream)
+                stream.compute_queued = False
+
+            # 等待正在执行的读取和计算任务结束, 之后会话资源即可安全释放
+            self.idle_condition.wait_for(lambda: not stream.capture_active and not stream.compute_active, timeout=timeout)
+
+            logger.info(f"调度器注销视频流, 当前视频流数: {len(self.streams)}")
+
+    def submit(self, session, item, urgent=False):
+        with self.lock:
+            stream = self.streams.get(session)
+
+            if stream is None:
+                return False
+
+            # 积压已满时拒绝新的视频帧, 以限制排队延迟; 紧急数据 (已组装的segment) 插入队首
+            if urgent:
+                stream.pending.appendleft((time.perf_counter(), item))
+            elif len(stream.pending) < self.backlog_size:
+                stream.pending.append((time.perf_counter(), item))
+            else:
+                return False
+
+            if not stream.compute_active and not stream.compute_queued:
+                self.compute_ready.append(stream)
+                stream.compute_queued = True
+                self.compute_condition.notify()
+
+            return True
+
+    def accepts(self, session):
+        # 视频流积压未满时才值得解码新的视频帧, 无锁读取, 结果仅作为提示
+        stream = self.streams.get(session)
+
+        return stream is not None and len(stream.pending) < self.backlog_size
+
+    def record(self, name, seconds):
+        self.latency_samples[name].append(seconds)
+
+    def statistics(self):
+        with self.lock:
+            statistics = {
+                'streams': len(self.streams),
+                'workers': len(self.workers),
+                'ready': len(self.compute_ready),
+                'backlog': sum(len(stream.pending) for stream in self.streams.values()),
+            }
+
+            samples = {name: list(values) for name, values in self.latency_samples.items()}
+
+        for name, values in samples.items():
+            if values:
+                statistics[f'{name}-p50'] = float(np.percentile(values, 50))
+                statistics[f'{name}-p99'] = float(np.percentile(values, 99))
+
+        return statistics
+
+    def capture_process(self):
+        logger.info("🎬 CaptureWorker 开始运行")
+
+        while True:
+            with self.lock:
+                while self.running:
+                    if self.capture_heap:
+                        delay_seconds = self.capture_heap[0][0] - time.perf_counter()
+
+                        if delay_seconds <= 0:
+                            break
+                    else:
+                        delay_seconds = None
+
+                    self.capture_condition.wait(timeout=delay_seconds)
+
+                if not self.running:
+                    break
+
+                due_seconds, _, stream = heapq.heappop(self.capture_heap)
+
+                if stream.released:
+                    continue
+
+                stream.capture_active = True
+
+            start_seconds = time.perf_counter()
+
+            try:
+                capture_interval = stream.session.capture_task()
+            except Exception as e:
+                logger.error(f"❌ 读取任务异常: {e}")
+                logger.error(f"异常堆栈:\n{traceback.format_exc()}")
+                capture_interval = stream.session.retry_interval
+
+            self.record('capture-lag', start_seconds - due_seconds)
+
+            with self.lock:
+                stream.capture_active = False
+
+                if stream.released:
+                    self.idle_condition.notify_all()
+                    continue
+
+                # 按截止时间调度下一次读取, 落后时从当前时间重新开始计时, 避免连续突发读取
+                next_seconds = max(due_seconds + capture_interval, time.perf_counter())
+                heapq.heappush(self.capture_heap, (next_seconds, next(self.capture_sequence), stream))
+                self.capture_condition.notify()
+
+        logger.info("🎬 CaptureWorker 已停止")
+
+    def compute_process(self):
+        logger.info("🧠 ComputeWorker 开始运行")
+
+        while True:
+            with self.lock:
+                while self.running and not self.compute_ready:
+                    self.compute_condition.wait()
+
+                if not self.running:
+                    break
+
+                stream = self.compute_ready.popleft()
+                stream.compute_queued = False
+                stream.compute_active = True
+
+                enqueue_seconds, item = stream.pending.popleft()
+
+            start_seconds = time.perf_counter()
+            self.record('compute-wait', start_seconds - enqueue_seconds)
+
+            try:
+                stream.session.compute_task(item)
+            except Exception as e:
+                logger.error(f"❌ 计算任务异常: {e}")
+                logger.error(f"异常堆栈:\n{traceback.format_exc()}")
+
+            self.record('compute-time', time.perf_counter() - start_seconds)
+
+            with self.lock:
+                stream.compute_active = False
+
+                if stream.released:
+                    self.idle_condition.notify_all()
+                elif stream.pending:
+                    # 重新排到队尾, 各视频流轮流获得计算线程
+                    self.compute_ready.append(stream)
+                    stream.compute_queued = True
+                    self.compute_condition.notify()
+
+        logger.info("🧠 ComputeWorker 已停止")
+
+    def shutdown(self):
+        with self.lock:
+            self.running = False
+            self.capture_condition.notify_all()
+            self.compute_condition.notify_all()
+
+        for worker in self.workers:
+            worker.join(timeout=5)
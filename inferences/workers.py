@@ -0,0 +1,371 @@
+import concurrent.futures
+import threading
+import time
+import contextlib
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import logging
+import traceback
+import inferences.engines as engines
+import inferences.buffers as buffers
+import inferences.realtime as realtime
+
+logger = logging.getLogger(__name__)
+
+
+def worker_process(connection, slot_count):
+    # 工作进程拥有独立的调度器和推理会话, 视频解码及预处理不再占用服务端进程的GIL
+    # 每个回复附带请求编号, 打开视频源在单独的线程中执行, 不阻塞同一工作进程中其他会话的请求
+    sessions = {}
+    sessions_lock = threading.Lock()
+    send_lock = threading.Lock()
+
+    def reply(request_id, *message):
+        with send_lock:
+            connection.send((request_id, *message))
+
+    def create_session(request_id, session_key, source):
+        try:
+            session = realtime.RealtimeInferenceSession(source)
+            session.publisher = buffers.SharedFrameRing.create(session.frame_shape, slot_count)
+        except Exception as e:
+            logger.error(f"❌ 工作进程创建会话失败: {e}")
+            logger.error(f"异常堆栈:\n{traceback.format_exc()}")
+            reply(request_id, 'error', str(e), None)
+            return
+
+        with sessions_lock:
+            sessions[session_key] = session
+
+        reply(request_id, 'created', session.publisher.name, session.frame_shape)
+
+    try:
+        while True:
+            request_id, command, session_key, argument = connection.recv()
+
+            if command == 'create':
+                threading.Thread(target=create_session, args=(request_id, session_key, argument), name=f"CreateSession-{session_key}", daemon=True).start()
+
+            elif command == 'release':
+                with sessions_lock:
+                    session = sessions.pop(session_key, None)
+
+                if session is not None:
+                    session.release()
+                    session.publisher.close()
+                    session.publisher.unlink()
+
+                reply(request_id, 'released', None, None)
+
+            elif command == 'metrics':
+                session = sessions.get(session_key)
+                reply(request_id, 'metrics', None if session is None else session.metrics_snapshot(), None)
+
+            elif command == 'scores':
+                session = sessions.get(session_key)
+                reply(request_id, 'scores', [] if session is None else session.drain_scores(), None)
+
+            elif command == 'events':
+                session = sessions.get(session_key)
+                reply(request_id, 'events', [] if session is None else session.drain_events(), None)
+
+            elif command == 'engine-metrics':
+                reply(request_id, 'metrics', engines.metrics_snapshot(), None)
+
+            elif command == 'cpu':
+                reply(request_id, 'cpu', time.process_time(), None)
+
+            elif command == 'stop':
+                break
+
+    except (EOFError, KeyboardInterrupt):
+        pass
+
+    finally:
+        with sessions_lock:
+            remaining_sessions = list(sessions.values())
+            sessions.clear()
+
+        for session in remaining_sessions:
+            session.release()
+            session.publisher.close()
+            session.publisher.unlink()
+
+        # 工作进程退出时不执行 atexit 注册的函数
+        engines.write_profiles()
+
+
+class RemoteRealtimeSession:
+    """
+    服务端进程中的会话代理, 接口与 RealtimeInferenceSession 一致
+    视频帧和异常得分由工作进程发布到共享内存环形缓冲区, 服务端直接读取, 不经过进程间管道传输
+    """
+
+    def __init__(self, worker, session_key, source):
+        self.worker = worker
+        self.session_key = session_key
+        self.source = source
+        self.ring = None
+        self.released = False
+
+    def attach(self, ring_name, frame_shape, slot_count):
+        previous_ring = self.ring
+        self.ring = buffers.SharedFrameRing.attach(ring_name, frame_shape, slot_count)
+
+        if previous_ring is not None:
+            previous_ring.close()
+
+    def get_frame(self):
+        # 返回 (帧序号, 共享内存中的当前帧, 当前得分), 调用方使用后需通过 valid 校验帧序号
+        ring = self.ring
+
+        if ring is None:
+            return None, None, None
+
+        latest = ring.latest()
+
+        if latest is None:
+            return None, None, None
+
+        sequence, frame, _, score = latest
+
+        return sequence, frame, score
+
+    def drain_scores(self):
+        try:
+            _, scores, _ = self.worker.request('scores', self.session_key)
+        except RuntimeError:
+            scores = []
+
+        return scores
+
+    def drain_events(self):
+        try:
+            _, events, _ = self.worker.request('events', self.session_key)
+        except RuntimeError:
+            events = []
+
+        return events
+
+    def metrics_snapshot(self):
+        try:
+            _, snapshot, _ = self.worker.request('metrics', self.session_key)
+        except RuntimeError:
+            snapshot = None
+
+        return snapshot
+
+    def valid(self, sequence):
+        ring = self.ring
+
+        return ring is not None and ring.valid(sequence)
+
+    def get_result(self):
+        ring = self.ring
+
+        if ring is None:
+            return None
+
+        latest = ring.latest()
+
+        if latest is None:
+            return None
+
+        sequence, frame, _, score = latest
+
+        if score is None:
+            return None
+
+        result_frame = frame.copy()
+
+        if not ring.valid(sequence):
+            return None
+
+        return engines.draw_detection_result(result_frame, score)
+
+    def release(self):
+        self.released = True
+        self.worker.release_session(self)
+
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+
+class RealtimeWorker:
+    def __init__(self, context, index, slot_count):
+        self.context = context
+        self.index = index
+        self.slot_count = slot_count
+
+        # lock 保护会话表和等待回复的请求, send_lock 只用于发送, 两者同时持有时先获取 send_lock
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.sessions = {}
+        self.request_ids = itertools.count()
+
+        self.process = None
+        self.connection = None
+        self.pending = None
+        self.start()
+
+    def start(self):
+        self.connection, worker_connection = self.context.Pipe()
+        self.pending = {}
+        self.process = self.context.Process(target=worker_process, args=(worker_connection, self.slot_count), name=f"RealtimeWorker-{self.index}", daemon=True)
+        self.process.start()
+
+        worker_connection.close()
+        threading.Thread(target=self.receive_replies, args=(self.connection, self.pending), name=f"RealtimeWorkerReplies-{self.index}", daemon=True).start()
+        logger.info(f"✅ 实时检测工作进程启动: RealtimeWorker-{self.index}, pid={self.process.pid}")
+
+    def receive_replies(self, connection, pending):
+        # 按请求编号将回复交给等待中的请求, 工作进程退出后所有未完成的请求以 RuntimeError 结束
+        try:
+            while True:
+                request_id, *reply = connection.recv()
+
+                with self.lock:
+                    future = pending.pop(request_id, None)
+
+                if future is not None:
+                    future.set_result(tuple(reply))
+        except (EOFError, OSError) as e:
+            error = e
+
+        with self.send_lock, self.lock:
+            connection.close()
+            futures = list(pending.values())
+            pending.clear()
+
+        for future in futures:
+            future.set_exception(RuntimeError(f"Realtime worker {self.index} is unavailable: {error}"))
+
+    def request(self, command, session_key, argument=None):
+        future = concurrent.futures.Future()
+
+        with self.lock:
+            connection, pending = self.connection, self.pending
+            request_id = next(self.request_ids)
+
+            if connection.closed:
+                raise RuntimeError(f"Realtime worker {self.index} is unavailable: connection closed")
+
+            pending[request_id] = future
+
+        try:
+            with self.send_lock:
+                connection.send((request_id, command, session_key, argument))
+        except (EOFError, OSError) as e:
+            with self.lock:
+                pending.pop(request_id, None)
+
+            raise RuntimeError(f"Realtime worker {self.index} is unavailable: {e}")
+
+        return future.result()
+
+    def open_session(self, session):
+        reply, ring_name, frame_shape = self.request('create', session.session_key, session.source)
+
+        if reply != 'created':
+            raise RuntimeError(f"Failed to open video source: {session.source} ({ring_name})")
+
+        session.attach(ring_name, frame_shape, self.slot_count)
+
+    def create_session(self, session_key, source):
+        session = RemoteRealtimeSession(self, session_key, source)
+        self.open_session(session)
+
+        with self.lock:
+            self.sessions[session_key] = session
+
+        return session
+
+    def release_session(self, session):
+        with self.lock:
+            if self.sessions.pop(session.session_key, None) is None:
+                return
+
+        try:
+            self.request('release', session.session_key)
+        except RuntimeError as e:
+            logger.warning(f"⚠️ 释放会话失败: {e}")
+
+    def restart(self):
+        self.process.join()
+        logger.warning(f"⚠️ 工作进程 RealtimeWorker-{self.index} 已退出 (exitcode={self.process.exitcode}), 正在重启...")
+
+        with self.send_lock, self.lock:
+            self.connection.close()
+            self.start()
+
+            sessions = list(self.sessions.values())
+
+        # 在新的工作进程中重新打开该分片的所有会话
+        for session in sessions:
+            try:
+                self.open_session(session)
+            except RuntimeError as e:
+                logger.error(f"❌ 会话恢复失败: {session.source} ({e})")
+
+    def stop(self):
+        with contextlib.suppress(RuntimeError):
+            self.request('stop', None)
+
+        self.process.join(timeout=5)
+
+
+class RealtimeWorkerPool:
+    """
+    实时检测工作进程池, 每个工作进程负责一个会话分片, 新会话分配给当前会话数最少的工作进程
+    工作进程异常退出后自动重启并恢复其会话, 不影响服务端进程和其他分片
+    """
+
+    def __init__(self, process_count, slot_count):
+        context = multiprocessing.get_context('spawn')
+
+        self.workers = [RealtimeWorker(context, index, slot_count) for index in range(process_count)]
+        self.session_keys = itertools.count()
+        self.running = True
+
+        self.monitor_thread = threading.Thread(target=self.monitor_process, name="WorkerMonitor", daemon=True)
+        self.monitor_thread.start()
+
+    def create_session(self, source):
+        worker = min(self.workers, key=lambda candidate: len(candidate.sessions))
+
+        return worker.create_session(next(self.session_keys), source)
+
+    def engine_metrics(self):
+        snapshots = []
+
+        for worker in self.workers:
+            with contextlib.suppress(RuntimeError):
+                snapshots.append(worker.request('engine-metrics', None)[1])
+
+        return snapshots
+
+    def cpu_seconds(self):
+        # 所有工作进程累计占用的 CPU 时间, 重启的工作进程从 0 开始计时
+        cpu_seconds = 0.0
+
+        for worker in self.workers:
+            with contextlib.suppress(RuntimeError):
+                cpu_seconds += worker.request('cpu', None)[1]
+
+        return cpu_seconds
+
+    def monitor_process(self):
+        while self.running:
+            sentinels = {worker.process.sentinel: worker for worker in self.workers}
+
+            for sentinel in multiprocessing.connection.wait(list(sentinels)):
+                if self.running:
+                    sentinels[sentinel].restart()
+
+    def shutdown(self):
+        self.running = False
+
+        for worker in self.workers:
+            worker.stop()
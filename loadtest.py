@@ -0,0 +1,630 @@
+#!/usr/bin/env python3
+"""
+服务端压力测试脚本
+在临时目录中使用进程内 MongoDB 替代 (mongomock)、合成视频、由视频文件模拟的摄像头以及随机生成的小型 ONNX 模型启动服务端, 无需网络
+并发执行视频上传、列表/详情查询以及大量 MJPEG 观看者, 输出各场景的 p50/p99 延迟、吞吐量以及服务端进程及其子进程的 CPU/RSS
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import http.client
+import importlib.util
+import json
+import logging
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import cv2
+import numpy as np
+import toml
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='[%(asctime)s] [%(levelname)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+repository_directory = os.path.dirname(os.path.abspath(__file__))
+
+camera_width = 640
+camera_height = 360
+camera_fps = 25
+
+# 服务端写入数据库失败时只记录警告, 请求本身仍然成功
+server_error_pattern = re.compile(r'failed to (write|set up) [\w ]+|Traceback')
+
+
+def build_models(model_directory, inference_configs):
+    """生成与配置的输入输出形状一致的小型特征提取和异常检测模型"""
+    import onnx
+    import onnx.helper
+    import onnx.numpy_helper
+
+    feature_size = inference_configs['feature-size']
+    segment_length = inference_configs['segment-length']
+    segment_height = inference_configs['crop-y2'] - inference_configs['crop-y1']
+    segment_width = inference_configs['crop-x2'] - inference_configs['crop-x1']
+
+    rng = np.random.default_rng(0)
+
+    def save_model(nodes, inputs, outputs, initializers, model_path):
+        graph = onnx.helper.make_graph(nodes, 'loadtest', [inputs], [outputs], initializers)
+        model = onnx.helper.make_model(graph, opset_imports=[onnx.helper.make_opsetid('', 13)])
+        model.ir_version = 8
+        onnx.save(model, model_path)
+
+    # 特征提取: 按通道求均值后线性映射到特征维度
+    save_model(
+        [
+            onnx.helper.make_node('ReduceMean', ['inputs'], ['means'], axes=[2, 3, 4], keepdims=0),
+            onnx.helper.make_node('MatMul', ['means', 'weights'], ['outputs']),
+        ],
+        onnx.helper.make_tensor_value_info('inputs', onnx.TensorProto.FLOAT, [1, 3, segment_length, segment_height, segment_width]),
+        onnx.helper.make_tensor_value_info('outputs', onnx.TensorProto.FLOAT, [1, feature_size]),
+        [onnx.numpy_helper.from_array(rng.standard_normal((3, feature_size)).astype(np.float32), 'weights')],
+        f'{model_directory}/extraction-fp32.onnx',
+    )
+
+    # 异常检测: 每个片段的特征线性映射为一个得分
+    save_model(
+        [
+            onnx.helper.make_node('MatMul', ['inputs', 'weights'], ['logits']),
+            onnx.helper.make_node('Squeeze', ['logits', 'axes'], ['outputs']),
+        ],
+        onnx.helper.make_tensor_value_info('inputs', onnx.TensorProto.FLOAT, [1, 'segments', feature_size]),
+        onnx.helper.make_tensor_value_info('outputs', onnx.TensorProto.FLOAT, [1, 'segments']),
+        [
+            onnx.numpy_helper.from_array((rng.standard_normal((feature_size, 1)) * 0.05).astype(np.float32), 'weights'),
+            onnx.numpy_helper.from_array(np.array([2], dtype=np.int64), 'axes'),
+        ],
+        f'{model_directory}/detection-fp32.onnx',
+    )
+
+
+def write_synthetic_video(video_path, width, height, fps, seconds):
+    """生成带有移动方块和噪声的合成视频"""
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter.fourcc(*'mp4v'), fps, (width, height))
+    rng = np.random.default_rng(len(video_path))
+
+    try:
+        for index in range(int(fps * seconds)):
+            frame = rng.integers(0, 48, (height, width, 3), dtype=np.uint8)
+            x = index * 7 % max(1, width - height // 4)
+            cv2.rectangle(frame, (x, height // 3), (x + height // 4, height // 3 + height // 4), (40, 160, 220), -1)
+            writer.write(frame)
+    finally:
+        writer.release()
+
+
+def prepare_workspace(workspace, arguments):
+    """在工作目录中准备配置文件、模型、合成视频和摄像头视频"""
+    inference_configs = toml.load(f'{repository_directory}/inferences/configs/config.toml')
+    server_configs = toml.load(f'{repository_directory}/servers/configs/config.toml')
+
+    for directory in ('inferences/configs', 'inferences/models', 'servers/configs', 'servers/videos', 'servers/covers', 'cameras'):
+        os.makedirs(f'{workspace}/{directory}', exist_ok=True)
+
+    inference_configs['precision'] = 'fp32'
+    inference_configs['providers'] = ['CPUExecutionProvider']
+    inference_configs['extraction-model-path'] = 'inferences/models/extraction-fp32.onnx'
+    inference_configs['detection-model-path'] = 'inferences/models/detection-fp32.onnx'
+
+    server_configs['retention-interval'] = 0
+
+    if arguments.realtime_processes is not None:
+        server_configs['realtime-processes'] = arguments.realtime_processes
+
+    with open(f'{workspace}/inferences/configs/config.toml', 'w') as config_file:
+        toml.dump(inference_configs, config_file)
+
+    with open(f'{workspace}/servers/configs/config.toml', 'w') as config_file:
+        toml.dump(server_configs, config_file)
+
+    logger.info("正在生成模型和合成视频...")
+
+    build_models(f'{workspace}/inferences/models', inference_configs)
+
+    write_synthetic_video(f'{workspace}/upload.mp4', server_configs['video-width'], server_configs['video-height'], server_configs['video-speed'], arguments.video_seconds)
+
+    # 本地视频文件按照其帧率读取, 时长需要覆盖整个观看场景
+    for index in range(arguments.cameras):
+        write_synthetic_video(f'{workspace}/cameras/camera.{index}.mp4', camera_width, camera_height, camera_fps, arguments.duration + 10)
+
+
+def serve(workspace, port, mode, seed_videos):
+    """子进程入口: 使用 mongomock 替代数据库后启动服务端"""
+    import mongomock
+    import mongomock.gridfs
+    import pymongo
+
+    os.chdir(workspace)
+    sys.path.insert(0, repository_directory)
+
+    mongomock.gridfs.enable_gridfs_integration()
+    pymongo.MongoClient = mongomock.MongoClient
+
+    import servers.timeseries as timeseries
+
+    # mongomock 不支持时间序列集合, 得分写入普通集合
+    timeseries.setup_score_collections = lambda database, retention_days: None
+
+    # 较新的 pymongo 在批量更新中传入 sort 参数, mongomock 尚不支持, 忽略该参数以免得分聚合写入失败
+    add_update = mongomock.collection.BulkOperationBuilder.add_update
+    mongomock.collection.BulkOperationBuilder.add_update = lambda self, *args, sort=None, **kwargs: add_update(self, *args, **kwargs)
+
+    import servers.server as server
+
+    server.app.logger.setLevel(logging.WARNING)
+
+    rng = np.random.default_rng(0)
+    cover = rng.integers(0, 255, (server.cover_height, server.cover_width, 3), dtype=np.uint8)
+
+    for index in range(seed_videos):
+        video_id = f'seed{index}'
+        scores = np.round(rng.random(rng.integers(100, 5000)), 2)
+
+        server.database.surveillance.videos.insert_one({
+            'videoId': video_id,
+            'name': video_id,
+            'note': '',
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            **server.score_store.score_fields(video_id, scores),
+        })
+
+        cv2.imwrite(f'servers/covers/result.{video_id}.jpg', cover)
+
+    if mode == 'async':
+        import aiohttp.web
+        import servers.streaming as streaming
+
+        aiohttp.web.run_app(streaming.create_application(), host='127.0.0.1', port=port, print=None)
+    else:
+        import werkzeug.serving
+
+        werkzeug.serving.make_server('127.0.0.1', port, server.app, threaded=True).serve_forever()
+
+
+class ProcessSampler:
+    """定期读取 /proc 中服务端进程及其所有子进程的 CPU 时间和常驻内存, realtime-processes 大于 0 时实时检测在工作进程中运行"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.clock_ticks = os.sysconf('SC_CLK_TCK')
+        self.page_size = os.sysconf('SC_PAGE_SIZE')
+
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        self.start_time = 0
+        self.start_cpu = 0
+        self.peak_rss = 0
+        self.peak_processes = 0
+
+    def process_stats(self):
+        # 按父进程编号遍历进程树, 返回服务端进程及其子孙进程 stat 中进程名之后的字段
+        stats = {}
+
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+
+            try:
+                with open(f'/proc/{entry}/stat') as stat_file:
+                    stats[int(entry)] = stat_file.read().rsplit(')', 1)[1].split()
+            except OSError:
+                continue
+
+        children = collections.defaultdict(list)
+
+        for pid, fields in stats.items():
+            children[int(fields[1])].append(pid)
+
+        tree = {}
+        pending = [self.pid]
+
+        while pending:
+            pid = pending.pop()
+
+            if pid in stats:
+                tree[pid] = stats[pid]
+                pending.extend(children[pid])
+
+        return tree
+
+    def cpu_seconds(self):
+        return sum(int(fields[11]) + int(fields[12]) for fields in self.process_stats().values()) / self.clock_ticks
+
+    def rss_bytes(self):
+        # 各进程常驻内存之和, 共享内存环形缓冲区等共享页面会被重复计算
+        stats = self.process_stats()
+        self.peak_processes = max(self.peak_processes, len(stats))
+
+        return sum(int(fields[21]) for fields in stats.values()) * self.page_size
+
+    def sample(self):
+        while not self.stop_event.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, self.rss_bytes())
+
+    def start(self):
+        self.stop_event.clear()
+        self.start_time = time.perf_counter()
+        self.start_cpu = self.cpu_seconds()
+        self.peak_processes = 0
+        self.peak_rss = self.rss_bytes()
+
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+        elapsed = time.perf_counter() - self.start_time
+
+        return {
+            'cpuPercent': 100 * (self.cpu_seconds() - self.start_cpu) / elapsed,
+            'peakRssMB': max(self.peak_rss, self.rss_bytes()) / 1024 ** 2,
+            'processes': self.peak_processes,
+        }
+
+
+def send_request(port, method, path, body=None, headers=None, timeout=120):
+    """发送一个请求, 返回状态码、响应内容和耗时"""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+
+    try:
+        start_seconds = time.perf_counter()
+        connection.request(method, path, body, headers or {})
+        response = connection.getresponse()
+        data = response.read()
+
+        return response.status, data, time.perf_counter() - start_seconds
+    finally:
+        connection.close()
+
+
+def send_json(port, path, params):
+    return send_request(port, 'POST', path, json.dumps(params).encode(), {'Content-Type': 'application/json'})
+
+
+def multipart_body(fields, file_name, file_data):
+    boundary = uuid.uuid4().hex
+    parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode() for name, value in fields.items()]
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="video"; filename="{file_name}"\r\nContent-Type: video/mp4\r\n\r\n'.encode() + file_data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def scenario_row(name, latencies, errors, elapsed, count=None):
+    """汇总一个场景的延迟分位数和吞吐量"""
+    latencies = np.asarray(latencies, dtype=np.float64) * 1000
+
+    return {
+        'scenario': name,
+        'count': len(latencies),
+        'errors': errors,
+        'p50Ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+        'p99Ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+        'throughput': (len(latencies) if count is None else count) / elapsed,
+    }
+
+
+def run_upload_scenario(port, workspace, arguments):
+    """
+    并发上传合成视频并等待检测任务结束, 分别统计上传耗时和任务完成耗时
+    每次上传在视频末尾追加不同的字节, 使内容哈希各不相同, 避免重复视频跳过检测; 服务端仍判定为重复的上传单独统计
+    """
+    with open(f'{workspace}/upload.mp4', 'rb') as video_file:
+        video_data = video_file.read()
+
+    def upload(index):
+        # 解码器忽略 moov 之后的多余字节, 追加的内容不影响检测
+        unique_data = video_data + f'loadtest-{index}-{uuid.uuid4().hex}'.encode()
+        body, content_type = multipart_body({'name': f'load{index}', 'note': ''}, 'upload.mp4', unique_data)
+        status, data, elapsed = send_request(port, 'POST', '/api/videoinference', body, {'Content-Type': content_type})
+
+        if status != 200:
+            return elapsed, None, None, False
+
+        response = json.loads(data)
+        job_start = time.perf_counter()
+
+        if response['duplicate']:
+            return elapsed, 'succeeded', elapsed, True
+
+        while True:
+            status, data, _ = send_request(port, 'GET', f'/api/videoinference/status/{response["videoId"]}')
+            state = json.loads(data)['state'] if status == 200 else 'failed'
+
+            if state not in ('queued', 'running'):
+                return elapsed, state, elapsed + time.perf_counter() - job_start, False
+
+            time.sleep(0.2)
+
+    start_seconds = time.perf_counter()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=arguments.upload_concurrency) as executor:
+        results = list(executor.map(upload, range(arguments.uploads)))
+
+    elapsed = time.perf_counter() - start_seconds
+
+    upload_latencies = [latency for latency, state, _, _ in results if state is not None]
+    job_latencies = [job_latency for _, state, job_latency, duplicate in results if state == 'succeeded' and not duplicate]
+    duplicate_latencies = [latency for latency, _, _, duplicate in results if duplicate]
+
+    return [
+        scenario_row('upload', upload_latencies, len(results) - len(upload_latencies), elapsed),
+        scenario_row('upload-job', job_latencies, len(upload_latencies) - len(duplicate_latencies) - len(job_latencies), elapsed),
+        scenario_row('upload-duplicate', duplicate_latencies, 0, elapsed),
+    ]
+
+
+def run_browse_scenario(port, arguments):
+    """并发请求视频列表、详情和封面拼接图"""
+    video_ids = [f'seed{index}' for index in range(arguments.seed_videos)]
+    page_count = max(1, -(-len(video_ids) // 12))
+
+    requests = {
+        'list': lambda: send_json(port, '/api/videoinference/list', {'pageNumber': random.randint(1, page_count), 'pageLength': 12}),
+        'detail': lambda: send_request(port, 'GET', f'/api/videoinference/detail/{random.choice(video_ids)}?width=856'),
+        'covers': lambda: send_request(port, 'GET', f'/api/videoinference/covers?videoIds={",".join(random.sample(video_ids, min(12, len(video_ids))))}'),
+    }
+
+    latencies = {name: [] for name in requests}
+    errors = {name: 0 for name in requests}
+    deadline = time.perf_counter() + arguments.duration
+
+    def browse():
+        while time.perf_counter() < deadline:
+            for name, send in requests.items():
+                try:
+                    status, _, elapsed = send()
+                except OSError:
+                    status, elapsed = None, 0
+
+                if status == 200:
+                    latencies[name].append(elapsed)
+                else:
+                    errors[name] += 1
+
+    start_seconds = time.perf_counter()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=arguments.browse_concurrency) as executor:
+        for future in [executor.submit(browse) for _ in range(arguments.browse_concurrency)]:
+            future.result()
+
+    elapsed = time.perf_counter() - start_seconds
+
+    return [scenario_row(name, latencies[name], errors[name], elapsed) for name in requests]
+
+
+def watch_stream(port, session_id, deadline):
+    """读取 MJPEG 视频流直到截止时间, 返回首帧耗时和帧间隔"""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    boundary = b'--frame\r\n'
+
+    try:
+        start_seconds = time.perf_counter()
+        connection.request('GET', f'/api/realtimeinference/session/{session_id}')
+        response = connection.getresponse()
+
+        if response.status != 200:
+            return None, []
+
+        first_frame = None
+        frame_times = []
+        pending = b''
+
+        while time.perf_counter() < deadline:
+            chunk = response.read1(64 * 1024)
+
+            if not chunk:
+                break
+
+            # 分隔符可能跨越两次读取, 保留末尾不足一个分隔符长度的数据
+            pending += chunk
+            frame_count = pending.count(boundary)
+            pending = pending[-(len(boundary) - 1):]
+
+            for _ in range(frame_count):
+                frame_times.append(time.perf_counter())
+
+            if first_frame is None and frame_times:
+                first_frame = frame_times[0] - start_seconds
+
+        return first_frame, np.diff(frame_times).tolist()
+
+    except (OSError, http.client.HTTPException):
+        return None, []
+
+    finally:
+        connection.close()
+
+
+def run_viewer_scenario(port, arguments):
+    """创建由视频文件模拟的摄像头会话, 并让大量观看者同时读取视频流"""
+    session_ids = []
+
+    for index in range(arguments.cameras):
+        status, data, _ = send_json(port, '/api/realtimeinference/create', {'source': f'cameras/camera.{index}.mp4', 'name': f'camera{index}', 'note': ''})
+
+        if status == 200:
+            session_ids.append(json.loads(data)['sessionId'])
+
+    if not session_ids:
+        logger.error("❌ 无法创建实时检测会话")
+        return []
+
+    start_seconds = time.perf_counter()
+    deadline = start_seconds + arguments.duration
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=arguments.viewers) as executor:
+        results = list(executor.map(lambda index: watch_stream(port, session_ids[index % len(session_ids)], deadline), range(arguments.viewers)))
+
+    elapsed = time.perf_counter() - start_seconds
+
+    send_json(port, '/api/realtimeinference/delete', {'sessionIds': session_ids})
+
+    first_frames = [first_frame for first_frame, _ in results if first_frame is not None]
+    intervals = [interval for _, frame_intervals in results for interval in frame_intervals]
+
+    return [
+        scenario_row('viewer-first-frame', first_frames, len(results) - len(first_frames), elapsed),
+        scenario_row('viewer-frame-interval', intervals, 0, elapsed, count=len(intervals) + len(first_frames)),
+    ]
+
+
+def find_free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def wait_server(port, process, timeout=120):
+    """等待服务端开始响应请求"""
+    deadline = time.perf_counter() + timeout
+
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            return False
+
+        try:
+            if send_request(port, 'GET', '/metrics', timeout=5)[0] == 200:
+                return True
+        except OSError:
+            time.sleep(0.5)
+
+    return False
+
+
+def count_server_errors(log_path):
+    """统计服务端日志中的数据库写入失败和未捕获的异常, 这些错误不会反映在请求的状态码中"""
+    errors = collections.Counter()
+
+    with open(log_path, errors='replace') as log_file:
+        for line in log_file:
+            match = server_error_pattern.search(line)
+
+            if match:
+                errors[match.group(0)] += 1
+
+    return errors
+
+
+def print_report(rows):
+    logger.info("=" * 100)
+    logger.info(f"{'场景':<24}{'请求数':>8}{'错误':>8}{'p50 (ms)':>12}{'p99 (ms)':>12}{'吞吐量 (/s)':>14}{'CPU (%)':>10}{'RSS (MB)':>10}")
+
+    for row in rows:
+        p50 = '-' if row['p50Ms'] is None else f"{row['p50Ms']:.1f}"
+        p99 = '-' if row['p99Ms'] is None else f"{row['p99Ms']:.1f}"
+        logger.info(f"{row['scenario']:<24}{row['count']:>8}{row['errors']:>8}{p50:>12}{p99:>12}{row['throughput']:>14.1f}{row['cpuPercent']:>10.1f}{row['peakRssMB']:>10.1f}")
+
+    logger.info("=" * 100)
+    logger.info(f"CPU 和 RSS 为服务端进程及其子进程 (最多 {max(row['processes'] for row in rows)} 个) 之和, RSS 中共享内存页面会被重复计算")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='在本地替代环境中对服务端进行压力测试')
+    parser.add_argument('--scenarios', default='upload,browse,viewers', help='逗号分隔的场景列表: upload, browse, viewers')
+    parser.add_argument('--mode', choices=['sync', 'async'], default='sync', help='服务端运行模式, async 需要安装 aiohttp')
+    parser.add_argument('--duration', type=float, default=20, help='browse 和 viewers 场景的持续时间 (秒)')
+    parser.add_argument('--uploads', type=int, default=8, help='上传的视频数')
+    parser.add_argument('--upload-concurrency', type=int, default=4, help='同时上传的客户端数')
+    parser.add_argument('--video-seconds', type=float, default=4, help='上传的合成视频时长 (秒)')
+    parser.add_argument('--seed-videos', type=int, default=200, help='启动时预先写入数据库的视频数')
+    parser.add_argument('--browse-concurrency', type=int, default=16, help='同时浏览的客户端数')
+    parser.add_argument('--cameras', type=int, default=4, help='模拟的摄像头数')
+    parser.add_argument('--viewers', type=int, default=100, help='同时观看的客户端数')
+    parser.add_argument('--realtime-processes', type=int, default=None, help='覆盖配置中的 realtime-processes')
+    parser.add_argument('--workspace', default=None, help='工作目录, 默认使用临时目录')
+    parser.add_argument('--output', default=None, help='将结果以 JSON 格式写入该文件')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, default=None, help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.serve:
+        serve(arguments.workspace, arguments.port, arguments.mode, arguments.seed_videos)
+        return 0
+
+    if arguments.mode == 'async' and importlib.util.find_spec('aiohttp') is None:
+        logger.error("❌ async 模式需要安装 aiohttp: pip install aiohttp")
+        return 1
+
+    with tempfile.TemporaryDirectory(prefix='loadtest-') as temporary_directory:
+        workspace = os.path.abspath(arguments.workspace or temporary_directory)
+        prepare_workspace(workspace, arguments)
+
+        port = find_free_port()
+        server_log = open(f'{workspace}/server.log', 'w')
+
+        logger.info(f"正在启动服务端: mode={arguments.mode}, port={port}")
+
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--serve', '--workspace', workspace, '--port', str(port), '--mode', arguments.mode, '--seed-videos', str(arguments.seed_videos)],
+            stdout=server_log, stderr=subprocess.STDOUT,
+        )
+
+        try:
+            if not wait_server(port, process):
+                logger.error(f"❌ 服务端启动失败, 请查看日志: {workspace}/server.log")
+                return 1
+
+            logger.info("✅ 服务端已启动")
+
+            scenarios = {
+                'upload': lambda: run_upload_scenario(port, workspace, arguments),
+                'browse': lambda: run_browse_scenario(port, arguments),
+                'viewers': lambda: run_viewer_scenario(port, arguments),
+            }
+
+            sampler = ProcessSampler(process.pid)
+            rows = []
+
+            for name in arguments.scenarios.split(','):
+                logger.info(f"正在执行场景: {name}")
+
+                sampler.start()
+                scenario_rows = scenarios[name]()
+                usage = sampler.stop()
+
+                rows.extend({**row, **usage} for row in scenario_rows)
+
+            print_report(rows)
+
+            server_errors = count_server_errors(f'{workspace}/server.log')
+
+            for message, count in server_errors.items():
+                logger.error(f"❌ 服务端日志中出现 {count} 次: {message}")
+
+            if arguments.output:
+                with open(arguments.output, 'w') as output_file:
+                    json.dump({'mode': arguments.mode, 'scenarios': rows, 'serverErrors': dict(server_errors)}, output_file, indent=2)
+
+            if server_errors:
+                logger.error(f"❌ 服务端出现错误, 请查看日志: {workspace}/server.log")
+                return 1
+
+        finally:
+            process.terminate()
+            process.wait()
+            server_log.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
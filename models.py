@@ -121,3 +121,51 @@ class AnomalyDetectionModel(nn.Module):
         outputs = self.classifier(outputs)
 
         return outputs.flatten(1)
+
+
+class LowRankLinear(nn.Module):
+    def __init__(self, in_features, out_features, rank):
+        super().__init__()
+        self.project = nn.Linear(in_features=in_features, out_features=rank, bias=False)
+        self.expand = nn.Linear(in_features=rank, out_features=out_features)
+
+    def forward(self, inputs):
+        return self.expand(self.project(inputs))
+
+    def initialize_from(self, linear):
+        # 使用截断奇异值分解逼近原始权重, W ≈ (U S) V^T
+        u, s, vh = torch.linalg.svd(linear.weight.detach(), full_matrices=False)
+        rank = self.project.out_features
+
+        self.project.weight.data.copy_(vh[:rank])
+        self.expand.weight.data.copy_(u[:, :rank] * s[:rank])
+        self.expand.bias.data.copy_(linear.bias.detach())
+
+
+class LiteAnomalyDetectionModel(AnomalyDetectionModel):
+    """
+    轻量异常检测模型, fc1 分解为秩为 projection_rank 的两个线性层, 注意力嵌入维度缩小为 embedding_features
+    输入输出与 AnomalyDetectionModel 一致, 可由完整模型蒸馏得到
+    """
+
+    def __init__(self, attention_window=5, alpha=0.5, projection_rank=64, embedding_features=64):
+        super().__init__(attention_window, alpha)
+        self.attention = ContextAttention(in_features=128, attention_window=attention_window, alpha=alpha, embedding_features=embedding_features)
+        self.fc1 = LowRankLinear(in_features=2304, out_features=256, rank=projection_rank)
+
+    def initialize_from(self, teacher):
+        # 除 fc1 和形状不同的注意力参数外直接复制教师模型的参数, fc1 使用其低秩近似
+        student_state = self.state_dict()
+
+        for name, parameter in teacher.state_dict().items():
+            if name in student_state and student_state[name].shape == parameter.shape:
+                student_state[name].copy_(parameter)
+
+        self.fc1.initialize_from(teacher.fc1)
+
+
+def create_model(configs):
+    if configs['model-variant'] == 'lite':
+        return LiteAnomalyDetectionModel(configs['attention-window'], configs['alpha'], configs['lite-projection-rank'], configs['lite-embedding-features'])
+
+    return AnomalyDetectionModel(configs['attention-window'], alpha=configs['alpha'])
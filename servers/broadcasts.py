@@ -0,0 +1,170 @@
+import threading
+import time
+
+import cv2
+
+import inferences.engines as engines
+import inferences.metrics as metrics
+import inferences.realtime as realtime
+
+
+broadcasters_lock = threading.Lock()
+broadcasters = {}
+
+encode_latency = metrics.Histogram()
+
+
+def fit_frame_size(frame, max_width, max_height):
+    height, width = frame.shape[:2]
+    scale = min(1.0, max_width / width if max_width else 1.0, max_height / height if max_height else 1.0)
+
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+class FrameBroadcaster:
+    """
+    每个会话的每种输出规格 (最大宽高, 帧率, JPEG质量) 对应一个广播器
+    新的检测结果帧只缩放、叠加和编码一次, 编码结果连同序号缓存后分发给所有订阅者, 没有订阅者时停止编码
+    """
+
+    def __init__(self, session, variant):
+        self.session = session
+        self.variant = variant
+
+        max_width, max_height, fps, quality = variant
+
+        self.max_width = max_width
+        self.max_height = max_height
+        self.interval = 1 / fps
+        self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+
+        self.condition = threading.Condition()
+        self.listeners = set()
+        self.subscribers = 0
+        self.sequence = 0
+        self.payload = None
+        self.running = True
+
+        self.last_key = None
+        self.thread = threading.Thread(target=self.broadcast_process, name="BroadcastThread", daemon=True)
+
+    def encode_frame(self, frame, score):
+        start_seconds = time.perf_counter()
+        frame_size = fit_frame_size(frame, self.max_width, self.max_height)
+
+        # 先缩放再叠加检测结果, 缩放或复制得到的新帧不影响会话中的原始帧
+        if frame_size == (frame.shape[1], frame.shape[0]):
+            result_frame = frame.copy()
+        else:
+            result_frame = cv2.resize(frame, frame_size, interpolation=cv2.INTER_AREA)
+
+        encode_success, encoded_frame = cv2.imencode('.jpg', engines.draw_detection_result(result_frame, score), self.encode_params)
+        encode_latency.observe(time.perf_counter() - start_seconds)
+
+        if encode_success:
+            return encoded_frame.tobytes()
+
+    def broadcast_task(self):
+        frame_sequence, frame, score = self.session.get_frame()
+
+        if frame is None or score is None:
+            return
+
+        # 视频帧和得分都没有变化时不重复编码
+        if (frame_sequence, score) == self.last_key:
+            return
+
+        payload = self.encode_frame(frame, score)
+
+        if payload is None or not self.session.valid(frame_sequence):
+            return
+
+        self.last_key = (frame_sequence, score)
+
+        with self.condition:
+            self.sequence += 1
+            self.payload = payload
+            self.condition.notify_all()
+
+            listeners = list(self.listeners)
+
+        self.notify_listeners(listeners)
+
+    def broadcast_process(self):
+        while True:
+            with broadcasters_lock:
+                if self.subscribers == 0 or self.session.released:
+                    broadcasters.pop((id(self.session), self.variant), None)
+                    break
+
+            realtime.execute_task_in_seconds(self.broadcast_task, target_seconds=self.interval)
+
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+            listeners = list(self.listeners)
+
+        self.notify_listeners(listeners)
+
+    def notify_listeners(self, listeners):
+        # 监听器不能阻塞广播线程, 异步服务模式下只将通知投递到事件循环
+        for listener in listeners:
+            listener()
+
+    def add_listener(self, listener):
+        # 广播器已停止时不会再通知监听器, 返回 False
+        with self.condition:
+            if not self.running:
+                return False
+
+            self.listeners.add(listener)
+
+            return True
+
+    def remove_listener(self, listener):
+        with self.condition:
+            self.listeners.discard(listener)
+
+    def latest(self):
+        # 非阻塞地返回 (序号, 编码结果), 广播器停止后编码结果为 None
+        with self.condition:
+            if not self.running:
+                return self.sequence, None
+
+            return self.sequence, self.payload
+
+    def wait(self, sequence, timeout=None):
+        # 阻塞直到有比 sequence 更新的编码结果、广播器停止或超时, 较慢的订阅者直接跳到最新帧
+        # 超时时返回的序号不大于 sequence, 广播器停止后编码结果为 None
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence > sequence or not self.running, timeout)
+
+            if not self.running:
+                return sequence, None
+
+            return self.sequence, self.payload
+
+
+def subscribe(session, variant):
+    with broadcasters_lock:
+        broadcaster = broadcasters.get((id(session), variant))
+
+        if broadcaster is None:
+            broadcaster = FrameBroadcaster(session, variant)
+            broadcasters[(id(session), variant)] = broadcaster
+            broadcaster.thread.start()
+
+        broadcaster.subscribers += 1
+
+        return broadcaster
+
+
+def unsubscribe(broadcaster):
+    with broadcasters_lock:
+        broadcaster.subscribers -= 1
+
+
+def viewer_count(session):
+    with broadcasters_lock:
+        return sum(broadcaster.subscribers for broadcaster in broadcasters.values() if broadcaster.session is session)
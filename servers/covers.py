@@ -0,0 +1,79 @@
+import threading
+import collections
+import os
+import cv2
+import numpy as np
+
+
+class CoverCache:
+    """
+    视频封面 LRU 缓存, 保存解码并缩放到统一尺寸后的封面, 拼接多个封面时不再逐个读取磁盘
+    """
+
+    def __init__(self, cover_directory, cover_width, cover_height, capacity):
+        self.cover_directory = cover_directory
+        self.cover_size = (cover_width, cover_height)
+        self.capacity = capacity
+
+        self.lock = threading.Lock()
+        self.covers = collections.OrderedDict()
+
+    def get(self, video_id):
+        with self.lock:
+            cover = self.covers.get(video_id)
+
+            if cover is not None:
+                self.covers.move_to_end(video_id)
+                return cover
+
+        cover_path = f'{self.cover_directory}/result.{video_id}.jpg'
+
+        if not os.path.exists(cover_path):
+            return None
+
+        cover = cv2.imread(cover_path)
+
+        if cover is None:
+            return None
+
+        if (cover.shape[1], cover.shape[0]) != self.cover_size:
+            cover = cv2.resize(cover, self.cover_size, interpolation=cv2.INTER_AREA)
+
+        with self.lock:
+            self.covers[video_id] = cover
+            self.covers.move_to_end(video_id)
+
+            while len(self.covers) > self.capacity:
+                self.covers.popitem(last=False)
+
+        return cover
+
+    def clear(self):
+        with self.lock:
+            self.covers.clear()
+
+    def invalidate(self, video_ids):
+        with self.lock:
+            for video_id in video_ids:
+                self.covers.pop(video_id, None)
+
+    def sprite(self, video_ids, quality):
+        # 按请求顺序纵向拼接封面, 第 i 个封面位于 y = i * cover_height, 缺失的封面留空
+        cover_width, cover_height = self.cover_size
+        sprite = np.zeros((cover_height * len(video_ids), cover_width, 3), dtype=np.uint8)
+
+        offsets = {}
+
+        for index, video_id in enumerate(video_ids):
+            cover = self.get(video_id)
+
+            if cover is not None:
+                sprite[index * cover_height:(index + 1) * cover_height] = cover
+                offsets[video_id] = index * cover_height
+
+        encode_success, encoded_sprite = cv2.imencode('.jpg', sprite, [cv2.IMWRITE_JPEG_QUALITY, quality])
+
+        if not encode_success:
+            return None, offsets
+
+        return encoded_sprite.tobytes(), offsets
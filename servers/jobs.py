@@ -0,0 +1,175 @@
+import threading
+import concurrent.futures
+import datetime
+import logging
+
+import pymongo
+import pymongo.errors
+
+logger = logging.getLogger(__name__)
+
+active_states = ('queued', 'running')
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobProgress:
+    """
+    任务进度回调, 处理过程中按比例调用, 只在整数百分比变化时写入数据库
+    任务已被取消时抛出 JobCancelled, 由处理过程向上传播以中止任务
+    """
+
+    def __init__(self, job_queue, job_id, cancel_event):
+        self.job_queue = job_queue
+        self.job_id = job_id
+        self.cancel_event = cancel_event
+        self.percent = -1
+
+    def __call__(self, done, total, start=0, stop=100):
+        if self.cancel_event.is_set():
+            raise JobCancelled(self.job_id)
+
+        percent = min(stop, start + (stop - start) * done // max(1, total))
+
+        if percent != self.percent:
+            self.percent = percent
+            self.job_queue.update(self.job_id, {'progress': percent})
+
+
+class VideoJobQueue:
+    """
+    视频检测任务队列, 固定数量的工作线程依次执行任务, 排队任务数超过上限时拒绝新任务
+    任务状态和进度保存在数据库的 jobs 集合中, 取消请求在任务开始前或处理下一个segment时生效
+    多个服务端节点共用 jobs 集合, 每个任务记录所属节点并由该节点定期心跳, 只有心跳超过 expiry 秒的任务才会被其他节点或重启后的节点接管
+    """
+
+    def __init__(self, database, worker_count, queue_size, node_id, expiry):
+        self.database = database
+        self.capacity = worker_count + queue_size
+        self.node_id = node_id
+        self.expiry = expiry
+
+        self.lock = threading.Lock()
+        self.cancel_events = {}
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=worker_count, thread_name_prefix='VideoJob')
+
+    def setup(self):
+        jobs = self.database.surveillance.jobs
+        jobs.create_index('jobId', unique=True)
+        jobs.create_index([('state', pymongo.ASCENDING), ('heartbeatAt', pymongo.ASCENDING)])
+
+    def heartbeat(self):
+        with self.lock:
+            job_ids = list(self.cancel_events)
+
+        if job_ids:
+            self.database.surveillance.jobs.update_many({'jobId': {'$in': job_ids}, 'nodeId': self.node_id}, {'$set': {'heartbeatAt': datetime.datetime.now()}})
+
+    def recover(self, resume):
+        """
+        接管心跳已过期的未完成任务, 执行中的任务标记为失败, 尚未开始的任务通过 resume(job) 重新创建后再次排队
+        resume 返回 (task, cleanup), 无法继续执行时返回 None, 返回接管的任务数
+        """
+        jobs = self.database.surveillance.jobs
+        now = datetime.datetime.now()
+        expired = {'state': {'$in': list(active_states)}, 'heartbeatAt': {'$not': {'$gte': now - datetime.timedelta(seconds=self.expiry)}}}
+        recovered_count = 0
+
+        # 逐个以原子操作认领, 多个节点同时接管时每个任务只由一个节点处理
+        while (job := jobs.find_one_and_update(expired, {'$set': {'nodeId': self.node_id, 'heartbeatAt': now}})) is not None:
+            recovered_count += 1
+
+            if job['state'] == 'queued':
+                resumed = resume(job)
+
+                if resumed is not None and self.submit(job['jobId'], *resumed, job.get('parameters')):
+                    logger.info(f'video job {job["jobId"]} re-queued from node {job.get("nodeId")}')
+                    continue
+
+            self.update(job['jobId'], {'state': 'failed', 'error': 'interrupted: the node running this job stopped'})
+
+        return recovered_count
+
+    def update(self, job_id, fields):
+        try:
+            self.database.surveillance.jobs.update_one({'jobId': job_id}, {'$set': {**fields, 'updatedAt': datetime.datetime.now()}})
+        except pymongo.errors.PyMongoError as e:
+            logger.warning(f'failed to update job {job_id}: {e}')
+
+    def submit(self, job_id, task, cleanup=None, parameters=None):
+        # task(progress) 在工作线程中执行, cleanup 在任务未成功完成时执行, parameters 保存在任务记录中, 接管任务时用于重新创建 task
+        with self.lock:
+            if len(self.cancel_events) >= self.capacity:
+                return False
+
+            cancel_event = threading.Event()
+            self.cancel_events[job_id] = cancel_event
+
+        now = datetime.datetime.now()
+
+        try:
+            self.database.surveillance.jobs.update_one({'jobId': job_id}, {
+                '$set': {
+                    'state': 'queued',
+                    'progress': 0,
+                    'error': None,
+                    'parameters': parameters,
+                    'nodeId': self.node_id,
+                    'heartbeatAt': now,
+                    'updatedAt': now,
+                },
+                '$setOnInsert': {'createdAt': now},
+            }, upsert=True)
+        except pymongo.errors.PyMongoError:
+            with self.lock:
+                self.cancel_events.pop(job_id, None)
+
+            raise
+
+        self.executor.submit(self.run, job_id, task, cleanup, cancel_event)
+
+        return True
+
+    def run(self, job_id, task, cleanup, cancel_event):
+        state, error = 'succeeded', None
+
+        try:
+            if cancel_event.is_set():
+                raise JobCancelled(job_id)
+
+            self.update(job_id, {'state': 'running'})
+            task(JobProgress(self, job_id, cancel_event))
+        except JobCancelled:
+            state = 'cancelled'
+        except Exception as e:
+            logger.exception(f'video job {job_id} failed')
+            state, error = 'failed', str(e)
+        finally:
+            with self.lock:
+                self.cancel_events.pop(job_id, None)
+
+        if state != 'succeeded' and cleanup is not None:
+            cleanup()
+
+        self.update(job_id, {'state': state, 'error': error, **({'progress': 100} if state == 'succeeded' else {})})
+
+    def cancel(self, job_id):
+        with self.lock:
+            cancel_event = self.cancel_events.get(job_id)
+
+        if cancel_event is None:
+            return False
+
+        cancel_event.set()
+
+        return True
+
+    def active_count(self):
+        with self.lock:
+            return len(self.cancel_events)
+
+    def status(self, job_id):
+        return self.database.surveillance.jobs.find_one({'jobId': job_id}, {'_id': 0, 'jobId': 1, 'state': 1, 'progress': 1, 'error': 1})
@@ -0,0 +1,183 @@
+import datetime
+import os
+import socket
+import time
+import logging
+
+import pymongo.errors
+
+logger = logging.getLogger(__name__)
+
+# 没有任何节点运行会话时每个会话的估计负载, 此时按会话数均衡
+nominal_session_cost = 1e-3
+
+
+def default_node_id():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+class SessionLeaseManager:
+    """
+    实时检测会话分片, 每个服务端节点通过 leases 集合中的租约认领会话, 并在心跳中续约和上报测量的负载
+    节点失效后其租约过期, 由其余节点按负载接管, 节点负载或会话数明显高于其他节点时每次心跳释放一个会话以重新分配
+    """
+
+    def __init__(self, database, node_id, node_url, lease_ttl, rebalance_margin):
+        self.database = database
+        self.node_id = node_id
+        self.node_url = node_url
+        self.lease_ttl = datetime.timedelta(seconds=lease_ttl)
+        self.rebalance_margin = rebalance_margin
+
+        self.cpu_sample = None
+        self.load = 0.0
+
+    def setup(self):
+        self.database.surveillance.leases.create_index('sessionId', unique=True)
+        self.database.surveillance.leases.create_index('nodeId')
+        self.database.surveillance.nodes.create_index('nodeId', unique=True)
+
+    def measure_load(self, cpu_seconds):
+        # 两次心跳之间节点进程占用的 CPU 时间占全部核心的比例
+        now = time.monotonic()
+
+        if self.cpu_sample is not None:
+            sample_time, sample_cpu_seconds = self.cpu_sample
+            self.load = max(0.0, (cpu_seconds - sample_cpu_seconds) / max(1e-6, now - sample_time) / (os.cpu_count() or 1))
+
+        self.cpu_sample = (now, cpu_seconds)
+
+        return self.load
+
+    def live_nodes(self, now):
+        return list(self.database.surveillance.nodes.find({'heartbeat': {'$gt': now - self.lease_ttl}}, {'_id': 0, 'nodeId': 1, 'url': 1, 'load': 1, 'sessionCount': 1}))
+
+    def claim(self, session_id, now=None):
+        # 租约不存在或已过期时原子地认领, 其他节点持有有效租约时唯一索引使插入失败
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+
+        try:
+            self.database.surveillance.leases.update_one(
+                {'sessionId': session_id, 'expires': {'$lt': now}},
+                {'$set': {'nodeId': self.node_id, 'expires': now + self.lease_ttl, 'claimedAt': now}},
+                upsert=True,
+            )
+        except pymongo.errors.DuplicateKeyError:
+            return False
+
+        return True
+
+    def release(self, session_ids):
+        self.database.surveillance.leases.delete_many({'nodeId': self.node_id, 'sessionId': {'$in': list(session_ids)}})
+
+    def remove(self, session_ids):
+        # 会话被删除时移除其租约, 持有租约的节点在下一次心跳中停止会话
+        self.database.surveillance.leases.delete_many({'sessionId': {'$in': list(session_ids)}})
+
+    def leave(self):
+        # 正常退出时立即交出所有会话, 不必等待租约过期
+        self.database.surveillance.leases.delete_many({'nodeId': self.node_id})
+        self.database.surveillance.nodes.delete_one({'nodeId': self.node_id})
+
+    def owner_url(self, session_id):
+        # 返回持有会话有效租约的其他节点地址, 会话由本节点持有或无人持有时返回 None
+        now = datetime.datetime.now(datetime.timezone.utc)
+        lease = self.database.surveillance.leases.find_one({'sessionId': session_id, 'expires': {'$gt': now}}, {'nodeId': 1})
+
+        if lease is None or lease['nodeId'] == self.node_id:
+            return None
+
+        node = self.database.surveillance.nodes.find_one({'nodeId': lease['nodeId'], 'heartbeat': {'$gt': now - self.lease_ttl}}, {'url': 1})
+
+        return None if node is None or not node.get('url') else node['url']
+
+    def plan_claims(self, unclaimed_session_ids, nodes):
+        # 所有节点基于相同的数据计算同样的分配方案, 每个会话分配给预计负载最低的节点, 本节点只认领分配给自己的会话
+        loaded_nodes = [node for node in nodes if node['sessionCount'] > 0]
+        total_sessions = sum(node['sessionCount'] for node in loaded_nodes)
+        average_cost = sum(node['load'] for node in loaded_nodes) / total_sessions if total_sessions else 0.0
+        average_cost = max(average_cost, nominal_session_cost)
+
+        projections = {
+            node['nodeId']: [node['load'], node['sessionCount'], node['load'] / node['sessionCount'] if node['sessionCount'] > 0 and node['load'] > 0 else average_cost]
+            for node in nodes
+        }
+
+        claims = []
+
+        for session_id in sorted(unclaimed_session_ids):
+            node_id = min(projections, key=lambda candidate: (projections[candidate][0], projections[candidate][1], candidate))
+            projection = projections[node_id]
+            projection[0] += projection[2]
+            projection[1] += 1
+
+            if node_id == self.node_id:
+                claims.append(session_id)
+
+        return claims
+
+    def pick_release(self, owned_session_ids, nodes):
+        # 移出一个会话后本节点负载仍不低于接收节点时才释放, 避免会话在节点之间来回迁移
+        if len(owned_session_ids) <= 1:
+            return None
+
+        session_cost = self.load / len(owned_session_ids)
+
+        for node in nodes:
+            if node['nodeId'] == self.node_id:
+                continue
+
+            if self.load - node['load'] > self.rebalance_margin:
+                movable = self.load - session_cost >= node['load'] + session_cost
+            else:
+                # 测量的负载相差不超过 rebalance_margin 时按会话数均衡
+                movable = node['load'] - self.load <= self.rebalance_margin and len(owned_session_ids) - node['sessionCount'] >= 2
+
+            if movable:
+                return max(owned_session_ids)
+
+        return None
+
+    def heartbeat(self, cpu_seconds):
+        """
+        上报本节点负载并续约, 清理已删除会话的租约, 认领无人持有的会话, 必要时释放一个会话
+        返回本节点应当运行的会话编号及其视频源
+        """
+        surveillance = self.database.surveillance
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+        load = self.measure_load(cpu_seconds)
+
+        surveillance.leases.update_many({'nodeId': self.node_id}, {'$set': {'expires': now + self.lease_ttl}})
+        owned_session_ids = {lease['sessionId'] for lease in surveillance.leases.find({'nodeId': self.node_id}, {'sessionId': 1})}
+
+        session_sources = {session['sessionId']: session['source'] for session in surveillance.sessions.find({}, {'sessionId': 1, 'source': 1})}
+
+        deleted_session_ids = owned_session_ids - session_sources.keys()
+
+        if deleted_session_ids:
+            self.release(deleted_session_ids)
+            owned_session_ids -= deleted_session_ids
+
+        surveillance.nodes.update_one(
+            {'nodeId': self.node_id},
+            {'$set': {'url': self.node_url, 'heartbeat': now, 'load': load, 'sessionCount': len(owned_session_ids)}},
+            upsert=True,
+        )
+
+        nodes = self.live_nodes(now)
+        leased_session_ids = {lease['sessionId'] for lease in surveillance.leases.find({'expires': {'$gt': now}}, {'sessionId': 1})}
+
+        for session_id in self.plan_claims(session_sources.keys() - leased_session_ids, nodes):
+            if self.claim(session_id, now):
+                logger.info(f'claimed realtime session {session_id}')
+                owned_session_ids.add(session_id)
+
+        released_session_id = self.pick_release(owned_session_ids, nodes)
+
+        if released_session_id is not None:
+            logger.info(f'released realtime session {released_session_id} for rebalancing')
+            self.release([released_session_id])
+            owned_session_ids.discard(released_session_id)
+
+        return {session_id: session_sources[session_id] for session_id in owned_session_ids}
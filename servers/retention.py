@@ -0,0 +1,182 @@
+import concurrent.futures
+import collections
+import contextlib
+import datetime
+import os
+import time
+import logging
+
+import gridfs
+
+logger = logging.getLogger(__name__)
+
+time_format = '%Y-%m-%d %H:%M:%S'
+delete_batch_size = 1000
+
+video_directory = 'servers/videos'
+cover_directory = 'servers/covers'
+clip_directory = 'servers/clips'
+
+
+def scan_files(directory):
+    # 使用 scandir 一次遍历取得文件名、大小和修改时间, 文件名格式为 <类型>.<编号>.<扩展名>
+    # 重复上传的视频通过硬链接共享结果文件, 大小按链接数均摊, 使配额统计不重复计算
+    files = collections.defaultdict(list)
+
+    with contextlib.suppress(FileNotFoundError):
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                name_parts = entry.name.split('.')
+
+                if len(name_parts) != 3 or not entry.is_file():
+                    continue
+
+                # 上传中的临时文件 upload.<随机字符>.part 同样符合该格式, 不属于任何视频, 不能当作孤立文件删除
+                if name_parts[0] == 'upload' or name_parts[2] == 'part':
+                    continue
+
+                entry_stat = entry.stat()
+                files[name_parts[1]].append((entry.path, entry_stat.st_size // max(1, entry_stat.st_nlink), entry_stat.st_mtime))
+
+    return files
+
+
+def access_time(video):
+    # 最近访问时间以 datetime 存储, 没有访问记录的视频以创建时间计
+    last_accessed = video.get('lastAccessed')
+
+    if isinstance(last_accessed, datetime.datetime):
+        return last_accessed
+
+    return datetime.datetime.strptime(last_accessed or video['time'], time_format)
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return True
+    except OSError as e:
+        logger.warning(f"⚠️ 删除文件失败: {path} ({e})")
+        return False
+
+
+def delete_in_batches(collection, field, values):
+    deleted_count = 0
+
+    for index in range(0, len(values), delete_batch_size):
+        deleted_count += collection.delete_many({field: {'$in': values[index:index + delete_batch_size]}}).deleted_count
+
+    return deleted_count
+
+
+def run_retention(database, max_age_days=0, quota_bytes=0, grace_seconds=3600, workers=8, dry_run=False, remove_orphans=False, orphan_max_ratio=0.1):
+    """
+    按照保留天数和磁盘配额清理视频检测结果及异常事件片段, 并对齐磁盘文件与数据库记录
+    超出配额时按最近访问时间淘汰最久未访问的视频, 正在执行的检测任务及 grace_seconds 内修改的文件不会被清理
+    结果视频丢失的记录默认只统计, remove_orphans 为 True 时才删除, 疑似丢失的记录超过 orphan_max_ratio 时视为存储异常, 不删除
+    返回清理报告, dry_run 为 True 时只生成报告而不删除任何内容
+    """
+    surveillance = database.surveillance
+    now = time.time()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+        video_files, cover_files, clip_files = executor.map(scan_files, [video_directory, cover_directory, clip_directory])
+
+    result_files = collections.defaultdict(list)
+
+    for files in (video_files, cover_files):
+        for video_id, entries in files.items():
+            result_files[video_id].extend(entries)
+
+    active_job_ids = {job['jobId'] for job in surveillance.jobs.find({'state': {'$in': ['queued', 'running']}}, {'jobId': 1})}
+    videos = {video['videoId']: video for video in surveillance.videos.find({}, {'videoId': 1, 'time': 1, 'lastAccessed': 1, 'scoreFile': 1})}
+    event_ids = {event['eventId'] for event in surveillance.events.find({}, {'eventId': 1})}
+
+    def settled(entries):
+        return all(now - modified_time > grace_seconds for _, _, modified_time in entries)
+
+    expired_video_ids = []
+    expired_event_ids = []
+
+    if max_age_days > 0:
+        cutoff = datetime.datetime.now() - datetime.timedelta(days=max_age_days)
+        cutoff_time = cutoff.strftime(time_format)
+
+        expired_video_ids = [video_id for video_id, video in videos.items() if video['time'] < cutoff_time]
+        expired_event_ids = [event['eventId'] for event in surveillance.events.find({'start': {'$lt': cutoff}}, {'eventId': 1})]
+
+    # 数据库中存在但结果视频已丢失的记录, 以及没有对应记录的文件
+    result_video_ids = {video_id for video_id, entries in video_files.items() if any(os.path.basename(path).startswith('result.') for path, _, _ in entries)}
+
+    # 记录创建后 grace_seconds 内结果视频可能尚未写入
+    settled_time = datetime.datetime.fromtimestamp(now - grace_seconds).strftime(time_format)
+
+    orphan_video_ids = [video_id for video_id, video in videos.items() if video_id not in result_video_ids and video_id not in active_job_ids and video['time'] < settled_time]
+    orphan_file_ids = [video_id for video_id, entries in result_files.items() if video_id not in videos and video_id not in active_job_ids and settled(entries)]
+    orphan_clip_ids = [event_id for event_id, entries in clip_files.items() if event_id not in event_ids and settled(entries)]
+
+    # 存储卷未挂载或读取失败时所有记录都像是丢失了结果视频, 此时不能据此删除记录
+    orphan_aborted = len(orphan_video_ids) > len(videos) * orphan_max_ratio
+
+    if orphan_aborted:
+        logger.warning(f"⚠️ {len(orphan_video_ids)}/{len(videos)} 条视频记录的结果视频丢失, 超过比例上限 {orphan_max_ratio:.0%}, 请检查存储目录 {video_directory}")
+
+    removed_video_ids = set(expired_video_ids)
+
+    if remove_orphans and not orphan_aborted:
+        removed_video_ids.update(orphan_video_ids)
+
+    # 磁盘配额按最近访问时间淘汰
+    evicted_video_ids = []
+
+    if quota_bytes > 0:
+        used_bytes = sum(size for video_id, entries in result_files.items() if video_id not in removed_video_ids and video_id not in orphan_file_ids for _, size, _ in entries)
+        used_bytes += sum(size for event_id, entries in clip_files.items() if event_id not in expired_event_ids and event_id not in orphan_clip_ids for _, size, _ in entries)
+
+        candidates = sorted((video for video_id, video in videos.items() if video_id not in removed_video_ids), key=access_time)
+
+        for video in candidates:
+            if used_bytes <= quota_bytes:
+                break
+
+            evicted_video_ids.append(video['videoId'])
+            used_bytes -= sum(size for _, size, _ in result_files.get(video['videoId'], []))
+
+    removed_video_ids.update(evicted_video_ids)
+
+    removed_files = [entry for video_id in removed_video_ids | set(orphan_file_ids) for entry in result_files.get(video_id, [])]
+    removed_files += [entry for event_id in set(expired_event_ids) | set(orphan_clip_ids) for entry in clip_files.get(event_id, [])]
+
+    report = {
+        'dryRun': dry_run,
+        'expiredVideos': len(expired_video_ids),
+        'evictedVideos': len(evicted_video_ids),
+        'orphanVideos': len(orphan_video_ids),
+        'orphanAborted': orphan_aborted,
+        'orphanFiles': len(orphan_file_ids) + len(orphan_clip_ids),
+        'expiredEvents': len(expired_event_ids),
+        'removedFiles': len(removed_files),
+        'freedBytes': sum(size for _, size, _ in removed_files),
+    }
+
+    if dry_run:
+        return report
+
+    removed_video_ids = list(removed_video_ids)
+
+    score_files = gridfs.GridFS(surveillance, collection='scores_files')
+
+    for video_id in removed_video_ids:
+        if 'scoreFile' in videos.get(video_id, {}):
+            score_files.delete(videos[video_id]['scoreFile'])
+
+    delete_in_batches(surveillance.videos, 'videoId', removed_video_ids)
+    delete_in_batches(surveillance.jobs, 'jobId', removed_video_ids)
+    delete_in_batches(surveillance.events, 'eventId', expired_event_ids)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        report['failedFiles'] = sum(not removed for removed in executor.map(remove_file, [path for path, _, _ in removed_files]))
+
+    return report
@@ -0,0 +1,94 @@
+import json
+import threading
+import time
+
+
+feeds_lock = threading.Lock()
+feeds = {}
+
+
+def format_event(event_id, name, data):
+    # Server-Sent Events 消息, 客户端断线重连时通过 Last-Event-ID 从下一条消息继续
+    return f'id: {event_id}\nevent: {name}\ndata: {json.dumps(data)}\n\n'.encode()
+
+
+class ScoreFeed:
+    """
+    视频检测任务的得分消息, 检测线程依次发布临时得分和最终得分, 订阅者按消息序号读取, 不会错过任何消息
+    任务结束后不再发布新消息, 在 linger 秒内仍可读取
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.listeners = set()
+        self.events = []
+        self.finished_time = None
+
+    def publish(self, name, data):
+        with self.condition:
+            if self.finished_time is not None:
+                return
+
+            self.events.append((name, data))
+            self.condition.notify_all()
+
+            listeners = list(self.listeners)
+
+        self.notify_listeners(listeners)
+
+    def finish(self, name, data):
+        # 重复结束时忽略, 任务失败时检测线程和清理回调都会尝试结束
+        with self.condition:
+            if self.finished_time is not None:
+                return
+
+            self.events.append((name, data))
+            self.finished_time = time.monotonic()
+            self.condition.notify_all()
+
+            listeners = list(self.listeners)
+
+        self.notify_listeners(listeners)
+
+    def notify_listeners(self, listeners):
+        # 监听器不能阻塞检测线程, 异步服务模式下只将通知投递到事件循环
+        for listener in listeners:
+            listener()
+
+    def add_listener(self, listener):
+        with self.condition:
+            self.listeners.add(listener)
+
+    def remove_listener(self, listener):
+        with self.condition:
+            self.listeners.discard(listener)
+
+    def events_after(self, position):
+        # 非阻塞地返回 (消息序号, 消息名称, 消息内容) 列表及任务是否已结束
+        with self.condition:
+            return [(event_id, *event) for event_id, event in enumerate(self.events[position:], start=position)], self.finished_time is not None
+
+    def wait(self, position, timeout):
+        # 阻塞直到有序号不小于 position 的消息、任务结束或超时
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.events) > position or self.finished_time is not None, timeout)
+
+        return self.events_after(position)
+
+
+def create(video_id, linger):
+    with feeds_lock:
+        # 创建新消息流时顺便移除已结束且超过保留时间的消息流
+        now = time.monotonic()
+
+        for expired_id in [feed_id for feed_id, feed in feeds.items() if feed.finished_time is not None and now - feed.finished_time > linger]:
+            del feeds[expired_id]
+
+        feed = feeds[video_id] = ScoreFeed()
+
+        return feed
+
+
+def get(video_id):
+    with feeds_lock:
+        return feeds.get(video_id)
@@ -0,0 +1,133 @@
+import bson
+import gridfs
+import numpy as np
+
+
+score_dtypes = {'uint8': np.uint8, 'float16': np.float16}
+
+
+def encode_scores(scores, encoding):
+    scores = np.asarray(scores, dtype=np.float64)
+
+    # uint8 以 1/255 为步长量化 [0, 1] 范围内的得分, float16 保留约三位有效数字
+    if encoding == 'uint8':
+        return np.round(np.clip(scores, 0, 1) * 255).astype(np.uint8).tobytes()
+
+    return scores.astype(np.float16).tobytes()
+
+
+def decode_scores(data, encoding):
+    scores = np.frombuffer(data, dtype=score_dtypes[encoding]).astype(np.float64)
+
+    if encoding == 'uint8':
+        scores /= 255
+
+    return scores
+
+
+def build_pyramid(scores, base_length, max_length):
+    # 每一层将上一层相邻两个元素合并为最小值和最大值, 直到长度不超过 base_length, 只保留长度不超过 max_length 的层
+    levels = []
+    minimum = maximum = np.asarray(scores)
+    step = 1
+
+    while len(minimum) > base_length:
+        if len(minimum) % 2:
+            minimum = np.append(minimum, minimum[-1])
+            maximum = np.append(maximum, maximum[-1])
+
+        minimum = np.minimum(minimum[0::2], minimum[1::2])
+        maximum = np.maximum(maximum[0::2], maximum[1::2])
+        step *= 2
+
+        if len(minimum) <= max_length:
+            levels.append((step, minimum, maximum))
+
+    return levels
+
+
+class ScoreStore:
+    """
+    视频异常得分的紧凑存储, 得分序列编码为 uint8 或 float16 二进制, 超过 gridfs-threshold 字节时存入 GridFS
+    同时预先计算逐层减半的最小值/最大值金字塔, 按照前端热力图宽度返回对应分辨率的得分
+    """
+
+    def __init__(self, database, encoding, gridfs_threshold, pyramid_base, pyramid_max):
+        self.database = database
+        self.encoding = encoding
+        self.gridfs_threshold = gridfs_threshold
+        self.pyramid_base = pyramid_base
+        self.pyramid_max = pyramid_max
+
+        self.files = gridfs.GridFS(database.surveillance, collection='scores_files')
+
+    def score_fields(self, video_id, scores):
+        # 返回写入 videos 文档的得分字段
+        data = encode_scores(scores, self.encoding)
+
+        fields = {
+            'scoreEncoding': self.encoding,
+            'scoreCount': len(scores),
+            'scorePyramid': [
+                {'step': step, 'min': bson.Binary(encode_scores(minimum, self.encoding)), 'max': bson.Binary(encode_scores(maximum, self.encoding))}
+                for step, minimum, maximum in build_pyramid(scores, self.pyramid_base, self.pyramid_max)
+            ],
+        }
+
+        if len(data) > self.gridfs_threshold:
+            fields['scoreFile'] = self.files.put(data, filename=f'scores.{video_id}')
+        else:
+            fields['scoreData'] = bson.Binary(data)
+
+        return fields
+
+    def copy_fields(self, video_id, video):
+        # 复用已有视频的得分字段, GridFS 中的得分复制为新文件, 使两条记录可以分别删除
+        fields = {key: video[key] for key in ('scores', 'scoreEncoding', 'scoreCount', 'scorePyramid', 'scoreData') if key in video}
+
+        if 'scoreFile' in video:
+            fields['scoreFile'] = self.files.put(self.files.get(video['scoreFile']).read(), filename=f'scores.{video_id}')
+
+        return fields
+
+    def delete(self, video):
+        if 'scoreFile' in video:
+            self.files.delete(video['scoreFile'])
+
+    def load_range(self, video, start=0, end=None):
+        # 返回原始分辨率下 [start, end) 范围内的得分, GridFS 中的得分只读取所需的部分
+        if 'scores' in video:
+            return np.asarray(video['scores'][start:end], dtype=np.float64)
+
+        count = video['scoreCount']
+        start = min(max(start, 0), count)
+        end = count if end is None else min(max(end, start), count)
+
+        encoding = video['scoreEncoding']
+        item_size = np.dtype(score_dtypes[encoding]).itemsize
+
+        if 'scoreFile' in video:
+            score_file = self.files.get(video['scoreFile'])
+            score_file.seek(start * item_size)
+            data = score_file.read((end - start) * item_size)
+        else:
+            data = video['scoreData'][start * item_size:end * item_size]
+
+        return decode_scores(data, encoding)
+
+    def load_resolution(self, video, width):
+        # 选择长度不小于 width 的最粗一层, 返回 (每个元素对应的原始得分数, 最小值, 最大值)
+        if 'scores' in video:
+            scores = np.asarray(video['scores'], dtype=np.float64)
+            return 1, scores, scores
+
+        candidates = [level for level in video['scorePyramid'] if -(-video['scoreCount'] // level['step']) >= width]
+
+        # 没有足够精细的层时返回原始分辨率
+        if not candidates:
+            scores = self.load_range(video)
+            return 1, scores, scores
+
+        level = max(candidates, key=lambda candidate: candidate['step'])
+
+        return level['step'], decode_scores(level['min'], video['scoreEncoding']), decode_scores(level['max'], video['scoreEncoding'])
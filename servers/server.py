@@ -1,9 +1,19 @@
 import queue
+import concurrent.futures
 import contextlib
+import hashlib
 import os
+import shutil
+import tempfile
 import datetime
+import json
 import threading
+import time
+import atexit
+import urllib.error
+import urllib.request
 
+import bson
 import flask
 import pymongo
 import cv2
@@ -11,12 +21,64 @@ import toml
 import snowflake
 
 import inferences.engines as engines
+import inferences.decoders as decoders
 import inferences.realtime as realtime
+import inferences.workers as workers
+import inferences.metrics as metrics
+import servers.broadcasts as broadcasts
+import servers.timeseries as timeseries
+import servers.jobs as jobs
+import servers.scorestore as scorestore
+import servers.covers as covers
+import servers.retention as retention
+import servers.leases as leases
+import servers.scorefeeds as scorefeeds
 
 from apscheduler.schedulers.background import BackgroundScheduler
 
 
+class HashingUpload:
+    """
+    上传文件的存储流, werkzeug 解析请求时直接写入 servers/videos 下的临时文件, 写入的同时计算 SHA-256
+    """
+
+    def __init__(self, directory):
+        self.file = tempfile.NamedTemporaryFile(dir=directory, prefix='upload.', suffix='.part', delete=False)
+        self.digest = hashlib.sha256()
+
+    def write(self, data):
+        self.digest.update(data)
+
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+class UploadRequest(flask.Request):
+    """
+    只有视频上传接口的文件直接写入 servers/videos 并计算哈希, 其他请求使用 werkzeug 默认的临时文件
+    创建的上传文件记录在 hashing_uploads 中, 请求结束时删除未被移动为源视频的文件
+    """
+
+    upload_endpoint = 'video_inference'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hashing_uploads = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint != self.upload_endpoint or not filename:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+        upload = HashingUpload('servers/videos')
+        self.hashing_uploads.append(upload)
+
+        return upload
+
+
 app = flask.Flask(__name__)
+app.request_class = UploadRequest
 
 configs = toml.load('servers/configs/config.toml')
 
@@ -33,7 +95,15 @@ realtime_sessions = {}
 
 remove_queue = queue.Queue()
 
+# 写入失败的实时检测得分和异常事件, 下次批量写入时重试
+pending_scores = []
+pending_events = []
+
 frames_interval = configs['frames-interval']
+score_flush_interval = configs['score-flush-interval']
+score_flush_backlog = configs['score-flush-backlog']
+stream_quality = configs['stream-quality']
+stream_keepalive = configs['stream-keepalive']
 remove_interval = configs['remove-interval']
 
 video_speed = configs['video-speed']
@@ -45,9 +115,134 @@ cover_height = configs['cover-height']
 
 id_generator = snowflake.SnowflakeGenerator(0)
 
+sync_timeout = configs['sync-timeout']
+sync_executor = concurrent.futures.ThreadPoolExecutor(max_workers=configs['sync-workers'], thread_name_prefix='SessionOpener')
+
+video_inference_duration = metrics.Histogram(metrics.duration_buckets)
+
+
+def setup_collection_indexes():
+    database.surveillance.videos.create_index('videoId', unique=True)
+    database.surveillance.videos.create_index('contentHash')
+    database.surveillance.sessions.create_index('sessionId', unique=True)
+
+
+try:
+    setup_collection_indexes()
+    timeseries.setup_score_collections(database, configs['score-retention-days'])
+except pymongo.errors.PyMongoError as e:
+    app.logger.warning(f'failed to set up collections: {e}')
+
+cover_cache = covers.CoverCache('servers/covers', cover_width, cover_height, configs['cover-cache-size'])
+cover_sprite_max = configs['cover-sprite-max']
+
+score_store = scorestore.ScoreStore(database, configs['score-encoding'], configs['score-gridfs-threshold'], configs['score-pyramid-base'], configs['score-pyramid-max'])
+
+video_jobs = jobs.VideoJobQueue(database, configs['job-workers'], configs['job-queue-size'], leases.default_node_id(), configs['job-expiry'])
+
+score_feed_linger = configs['score-feed-linger']
+score_feed_keepalive = configs['score-feed-keepalive']
+
+access_time_interval = datetime.timedelta(seconds=configs['retention-access-interval'])
+
+try:
+    video_jobs.setup()
+except pymongo.errors.PyMongoError as e:
+    app.logger.warning(f'failed to set up video jobs: {e}')
+
+if configs['realtime-processes'] > 0:
+    realtime_workers = workers.RealtimeWorkerPool(configs['realtime-processes'], configs['realtime-ring-slots'])
+else:
+    realtime_workers = None
+
+shard_forward = configs['shard-forward']
+shard_proxy_timeout = configs['shard-proxy-timeout']
+shard_lock = threading.Lock()
+
+if configs['shard-enabled']:
+    shard_leases = leases.SessionLeaseManager(
+        database,
+        leases.default_node_id(),
+        os.environ.get('SURVEILLANCE_NODE_URL', configs['shard-node-url']),
+        configs['shard-lease-ttl'],
+        configs['shard-rebalance-margin'],
+    )
+
+    try:
+        shard_leases.setup()
+    except pymongo.errors.PyMongoError as e:
+        app.logger.warning(f'failed to set up session leases: {e}')
+else:
+    shard_leases = None
+
+
+def open_realtime_session(source):
+    if realtime_workers is None:
+        return realtime.RealtimeInferenceSession(source)
+
+    return realtime_workers.create_session(source)
+
+
+def find_page(collection, request_params, projection):
+    # 提供 cursor 时按 _id 进行键集分页, 否则按页码分页, 两种方式的顺序一致
+    length = request_params['pageLength']
+
+    if not isinstance(length, int) or length <= 0:
+        raise ValueError('invalid page length')
+
+    if 'cursor' in request_params:
+        cursor = request_params['cursor']
+        query = {} if cursor is None else {'_id': {'$gt': bson.ObjectId(cursor)}}
+
+        documents = list(collection.find(query, projection).sort('_id', pymongo.ASCENDING).limit(length))
+    else:
+        number = request_params['pageNumber']
+
+        documents = list(collection.find({}, projection).sort('_id', pymongo.ASCENDING).skip(length * (number - 1)).limit(length))
+
+    next_cursor = str(documents[-1]['_id']) if len(documents) == length else None
+
+    return documents, next_cursor
+
+
+def release_late_session(future):
+    # 超时后才打开成功的会话已不再需要, 直接释放
+    if future.exception() is None:
+        future.result().release()
+
+
+def open_realtime_sessions(session_sources):
+    # 并发打开视频源, 所有视频源共享同一个超时时间, 返回打开成功的会话和失败的会话编号
+    futures = {session_id: sync_executor.submit(open_realtime_session, source) for session_id, source in session_sources.items()}
+    deadline = time.monotonic() + sync_timeout
+
+    opened_sessions = {}
+    failed_session_ids = []
+
+    for session_id, future in futures.items():
+        try:
+            opened_sessions[session_id] = future.result(timeout=max(0, deadline - time.monotonic()))
+        except concurrent.futures.TimeoutError:
+            app.logger.warning(f'timed out opening realtime session {session_id}')
+            failed_session_ids.append(session_id)
+
+            if not future.cancel():
+                future.add_done_callback(release_late_session)
+        except Exception as e:
+            app.logger.warning(f'failed to open realtime session {session_id}: {e}')
+            failed_session_ids.append(session_id)
+
+    return opened_sessions, failed_session_ids
+
+
+def release_sessions(sessions):
+    # 会话释放需要等待读取和计算任务结束, 并发执行且不持有 realtime_sessions_lock
+    for _ in sync_executor.map(lambda session: session.release(), sessions):
+        pass
+
 
 def save_video_cover(source, output):
-    capture = cv2.VideoCapture(source)
+    capture = decoders.open_video(source, (cover_width, cover_height))
 
     if capture.isOpened():
         read_success, image = capture.read()
@@ -58,46 +253,64 @@ def save_video_cover(source, output):
     capture.release()
 
 
-def save_detection_result(source, output, scores):
-    reader = cv2.VideoCapture(source)
+def save_detection_result(source, output, scores, progress=None):
+    reader = decoders.open_video(source, (video_width, video_height))
     writer = cv2.VideoWriter(output, cv2.VideoWriter.fourcc(*'h264'), video_speed, (video_width, video_height))
 
-    for score in scores:
-        read_success, frame = reader.read()
+    # 按提取配置的目标帧率采样时, 每个得分覆盖的源视频帧数随源帧率变化
+    scores = engines.expand_scores(scores, engines.sample_stride(reader.get(cv2.CAP_PROP_FPS)))
 
-        if read_success:
-            writer.write(engines.draw_detection_result(frame, score))
+    try:
+        for index, score in enumerate(scores):
+            read_success, frame = reader.read()
+
+            if read_success:
+                writer.write(engines.draw_detection_result(frame, score))
 
-    reader.release()
-    writer.release()
+            if progress is not None:
+                progress(index + 1, len(scores))
+    finally:
+        reader.release()
+        writer.release()
 
     remove_queue.put(source)
 
 
-def get_realtime_data(session):
-    realtime_frame = session.get_result()
+def parse_stream_variant(request_args):
+    max_width = request_args.get('maxWidth', default=0, type=int)
+    max_height = request_args.get('maxHeight', default=0, type=int)
+    fps = request_args.get('fps', default=1 / frames_interval, type=float)
+    quality = request_args.get('quality', default=stream_quality, type=int)
 
-    if realtime_frame is not None:
-        encode_success, encoded_frame = cv2.imencode('.jpg', realtime_frame)
+    if max_width < 0 or max_height < 0 or fps <= 0 or not 1 <= quality <= 100:
+        raise ValueError('invalid stream variant')
 
-        if encode_success:
-            return encoded_frame.tobytes()
+    # 帧率不超过服务端返回间隔, 相同规格的观看者共享同一份编码结果
+    return max_width, max_height, round(min(fps, 1 / frames_interval), 2), quality
 
 
-def generate_realtime_response(session):
-    while True:
-        response_bytes = realtime.execute_task_in_seconds(get_realtime_data, session, frames_interval)
+def generate_realtime_response(session, variant):
+    broadcaster = broadcasts.subscribe(session, variant)
 
-        if response_bytes is not None:
-            yield b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + response_bytes + b'\r\n'
+    try:
+        sequence = 0
 
+        while True:
+            latest_sequence, response_bytes = broadcaster.wait(sequence, stream_keepalive)
 
-def release_and_delete_session(session_id):
-    if session_id in realtime_sessions:
-        session = realtime_sessions[session_id]
+            if not broadcaster.running or session.released:
+                break
 
-        session.release()
-        realtime_sessions.pop(session_id)
+            # 会话停滞时定期发送空行, 客户端已断开时写入失败, 生成器随之结束并取消订阅
+            if latest_sequence <= sequence or response_bytes is None:
+                yield b'\r\n'
+                continue
+
+            sequence = latest_sequence
+
+            yield b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + response_bytes + b'\r\n'
+    finally:
+        broadcasts.unsubscribe(broadcaster)
 
 
 @scheduler.scheduled_job(trigger='interval', seconds=remove_interval)
@@ -115,63 +328,399 @@ def remove_task():
             remove_queue.put(remove_path)
 
 
-@app.post('/api/videoinference')
-def video_inference():
-    video_id = str(next(id_generator))
+def write_realtime_metrics(writer):
+    with realtime_sessions_lock:
+        sessions = list(realtime_sessions.items())
+
+    session_snapshots = []
+
+    for session_id, session in sessions:
+        snapshot = session.metrics_snapshot()
+
+        if snapshot is not None:
+            session_snapshots.append(({'session': session_id}, snapshot))
+
+    writer.gauge('realtime_sessions', 'Number of running realtime sessions.', [({}, len(sessions))])
+    writer.gauge('realtime_capture_fps', 'Smoothed capture frame rate per session.', [(labels, snapshot['capture-fps']) for labels, snapshot in session_snapshots])
+
+    for name, key, help_text in [
+        ('realtime_grabbed_frames_total', 'grabbed', 'Frames pulled from the source per session, including frames skipped without decoding.'),
+        ('realtime_sampled_out_frames_total', 'sampled-out', 'Frames skipped without decoding to resample the source to the extraction profile frame rate.'),
+        ('realtime_frames_total', 'frames', 'Frames captured per session.'),
+        ('realtime_segments_total', 'segments', 'Segments assembled per session.'),
+        ('realtime_predictions_total', 'predictions', 'Scores predicted per session.'),
+        ('realtime_dropped_frames_total', 'dropped', 'Frames dropped because the session backlog was full.'),
+        ('realtime_errors_total', 'errors', 'Capture and inference errors per session.'),
+    ]:
+        writer.counter(name, help_text, [(labels, snapshot[key]) for labels, snapshot in session_snapshots])
+
+    writer.histogram('realtime_segment_lag_seconds', 'Delay from the last frame of a segment being captured to the segment being assembled.', [(labels, snapshot['segment-lag']) for labels, snapshot in session_snapshots])
+    writer.histogram('realtime_score_latency_seconds', 'Glass-to-score latency: delay from the last frame of a segment leaving the source buffer to its score.', [(labels, snapshot['score-latency']) for labels, snapshot in session_snapshots])
+
+    writer.gauge('realtime_viewers', 'Live stream viewers per session.', [({'session': session_id}, broadcasts.viewer_count(session)) for session_id, session in sessions])
+
+    if realtime_workers is None and realtime.scheduler is not None:
+        scheduler_statistics = realtime.get_scheduler().statistics()
+        writer.gauge('realtime_scheduler_backlog', 'Frames and segments waiting for a compute worker.', [({}, scheduler_statistics['backlog'])])
+        writer.gauge('realtime_scheduler_latency_seconds', 'Recent scheduler latency percentiles.', [
+            ({'stage': name.rsplit('-', 1)[0], 'quantile': {'p50': '0.5', 'p99': '0.99'}[name.rsplit('-', 1)[1]]}, value)
+            for name, value in scheduler_statistics.items() if name.endswith(('-p50', '-p99'))
+        ])
+
+
+def write_pending(write, session_items, name):
+    """
+    写入 (会话编号, 数据列表) 形式的批量数据, 成功时返回空列表, 失败时返回待重试的数据
+    待重试的数据超过 score-flush-backlog 条时丢弃最早的数据, 部分写入成功后重试可能重复写入少量得分
+    """
+    session_items = [(session_id, items) for session_id, items in session_items if items]
+
+    try:
+        write(database, session_items)
+        return []
+    except pymongo.errors.BulkWriteError as e:
+        # 异常事件以 eventId 唯一索引去重, 重试时已写入的事件不再视为失败
+        if all(error['code'] == 11000 for error in e.details['writeErrors']):
+            return []
+
+        app.logger.warning(f'failed to write {name}, will retry: {e}')
+    except Exception as e:
+        app.logger.warning(f'failed to write {name}, will retry: {e}')
+
+    pending_count = sum(len(items) for _, items in session_items)
+
+    while pending_count > score_flush_backlog:
+        pending_count -= len(session_items.pop(0)[1])
+
+    return session_items
+
+
+@scheduler.scheduled_job(trigger='interval', seconds=score_flush_interval)
+def flush_scores_task():
+    global pending_scores, pending_events
+
+    with realtime_sessions_lock:
+        sessions = list(realtime_sessions.items())
+
+    session_scores = pending_scores + [(session_id, session.drain_scores()) for session_id, session in sessions]
+    session_events = pending_events + [(session_id, session.drain_events()) for session_id, session in sessions]
+
+    pending_scores = write_pending(timeseries.write_scores, session_scores, 'realtime scores')
+    pending_events = write_pending(timeseries.write_events, session_events, 'anomaly events')
+
+
+def retention_task():
+    report = retention.run_retention(
+        database,
+        configs['retention-days'],
+        int(configs['retention-quota-gb'] * 1024 ** 3),
+        configs['retention-grace'],
+        configs['retention-workers'],
+        remove_orphans=configs['retention-remove-orphans'],
+        orphan_max_ratio=configs['retention-orphan-max-ratio'],
+    )
+
+    cover_cache.clear()
+    app.logger.info(f'retention finished: {report}')
+
+
+if configs['retention-interval'] > 0:
+    scheduler.add_job(retention_task, trigger='interval', seconds=configs['retention-interval'], max_instances=1, coalesce=True)
+
+
+@app.get('/metrics')
+def get_metrics():
+    writer = metrics.MetricsWriter()
+    write_realtime_metrics(writer)
+
+    engine_snapshots = [engines.metrics_snapshot()]
+
+    if realtime_workers is not None:
+        engine_snapshots.extend(realtime_workers.engine_metrics())
+
+    for name, key, help_text in [
+        ('engine_extraction_latency_seconds', 'extraction-latency', 'Feature extraction model run time.'),
+        ('engine_detection_latency_seconds', 'detection-latency', 'Anomaly detection model run time.'),
+    ]:
+        writer.histogram(name, help_text, [({}, metrics.merge_snapshots(snapshot[key] for snapshot in engine_snapshots))])
+
+    writer.histogram('stream_encode_latency_seconds', 'Live stream frame resize, overlay and JPEG encode time.', [({}, broadcasts.encode_latency.snapshot())])
+    writer.gauge('video_inference_jobs', 'Queued and running video inference jobs.', [({}, video_jobs.active_count())])
+    writer.histogram('video_inference_duration_seconds', 'Uploaded video inference job duration.', [({}, video_inference_duration.snapshot())])
+
+    if shard_leases is not None:
+        writer.gauge('realtime_node_load', 'Measured CPU load of this node used to balance realtime sessions.', [({'node': shard_leases.node_id}, shard_leases.load)])
+
+    return flask.Response(writer.render(), mimetype='text/plain; version=0.0.4')
+
+
+def video_inference_task(video_id, name, note, content_hash, progress):
+    start_seconds = time.perf_counter()
 
     video_source = f'servers/videos/source.{video_id}.mp4'
     video_output = f'servers/videos/result.{video_id}.mp4'
     cover_output = f'servers/covers/result.{video_id}.jpg'
 
+    score_feed = scorefeeds.get(video_id)
+
     try:
-        flask.request.files['video'].save(video_source)
-    except KeyError:
-        return flask.abort(400)
+        save_video_cover(video_source, cover_output)
+
+        # 特征提取占总进度的 90%, 结果视频写入占其余 10%, 每个segment的临时得分和最终得分同时发布到得分消息流
+        for event in engines.progressive_detection_by_video(video_source, lambda done, total: progress(done, total, 0, 90)):
+            if event[0] == 'provisional':
+                _, segment, total, score = event
+                score_feed.publish('provisional', {'segment': segment, 'total': total, 'score': round(score, 2)})
+            else:
+                scores = event[1].tolist()
+                score_feed.publish('final', {'scores': scores})
+
+        save_detection_result(video_source, video_output, scores, lambda done, total: progress(done, total, 90, 100))
+
+        database.surveillance.videos.insert_one({
+            'videoId': video_id,
+            'name': name,
+            'note': note,
+            'time': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'contentHash': content_hash,
+            **score_store.score_fields(video_id, scores),
+        })
+    except jobs.JobCancelled:
+        score_feed.finish('error', {'state': 'cancelled', 'error': None})
+        raise
+    except Exception as e:
+        score_feed.finish('error', {'state': 'failed', 'error': str(e)})
+        raise
+
+    score_feed.finish('done', {'videoId': video_id})
 
+    video_inference_duration.observe(time.perf_counter() - start_seconds)
+
+
+def remove_video_files(video_id):
+    remove_queue.put(f'servers/videos/source.{video_id}.mp4')
+    remove_queue.put(f'servers/videos/result.{video_id}.mp4')
+    remove_queue.put(f'servers/covers/result.{video_id}.jpg')
+
+
+def link_file(source, target):
+    # 硬链接由文件系统按链接数计数, 删除任一视频只移除它自己的链接, 文件系统不支持硬链接时复制文件
     try:
-        name = flask.request.form['name']
-        note = flask.request.form['note']
-    except KeyError:
-        return flask.abort(400)
+        os.link(source, target)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copyfile(source, target)
 
-    save_video_cover(video_source, cover_output)
+
+def link_duplicate_video(video_id, name, note, content_hash):
+    # 内容与已完成的视频完全相同时链接其结果视频和封面并复用其得分, 已有视频的结果文件已被删除时返回 False
+    duplicate = database.surveillance.videos.find_one({'contentHash': content_hash}, {'_id': 0})
+
+    if duplicate is None:
+        return False
+
+    duplicate_id = duplicate['videoId']
 
     try:
-        scores = engines.detection_by_video(video_source).tolist()
-    except ValueError:
-        return flask.abort(400)
+        link_file(f'servers/videos/result.{duplicate_id}.mp4', f'servers/videos/result.{video_id}.mp4')
+    except FileNotFoundError:
+        return False
 
-    save_detection_result(video_source, video_output, engines.expand_scores(scores))
+    with contextlib.suppress(FileNotFoundError):
+        link_file(f'servers/covers/result.{duplicate_id}.jpg', f'servers/covers/result.{video_id}.jpg')
 
     database.surveillance.videos.insert_one({
         'videoId': video_id,
         'name': name,
         'note': note,
         'time': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'scores': scores,
+        'contentHash': content_hash,
+        **score_store.copy_fields(video_id, duplicate),
     })
 
-    return flask.jsonify({'videoId': video_id})
+    return True
 
 
-@app.post('/api/videoinference/list')
-def get_video_list():
+def video_job_callbacks(video_id, name, note, content_hash):
+    return (
+        lambda progress: video_inference_task(video_id, name, note, content_hash, progress),
+        lambda: abort_video_inference(video_id),
+    )
+
+
+def resume_video_job(job):
+    # 接管的任务只有源视频仍在本节点的 servers/videos 中时才能继续执行
+    parameters = job.get('parameters')
+
+    if parameters is None or not os.path.exists(f"servers/videos/source.{job['jobId']}.mp4"):
+        return None
+
+    scorefeeds.create(job['jobId'], score_feed_linger)
+
+    return video_job_callbacks(job['jobId'], parameters['name'], parameters['note'], parameters['contentHash'])
+
+
+def video_jobs_task():
+    try:
+        video_jobs.heartbeat()
+        video_jobs.recover(resume_video_job)
+    except Exception as e:
+        app.logger.warning(f'failed to maintain video jobs: {e}')
+
+
+scheduler.add_job(video_jobs_task, trigger='interval', seconds=configs['job-heartbeat'], max_instances=1, coalesce=True, next_run_time=datetime.datetime.now())
+
+
+def abort_video_inference(video_id):
+    # 任务在开始前被取消时检测过程没有机会结束得分消息流
+    scorefeeds.get(video_id).finish('error', {'state': 'cancelled', 'error': None})
+    remove_video_files(video_id)
+
+
+@app.teardown_request
+def remove_unused_uploads(exception):
+    # 已移动为源视频的上传文件不再存在, 重复视频、参数错误或处理失败时的上传文件在此删除
+    for upload in flask.request.hashing_uploads:
+        upload.close()
+
+        try:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(upload.name)
+        except OSError:
+            remove_queue.put(upload.name)
+
+
+@app.post('/api/videoinference')
+def video_inference():
+    video_id = str(next(id_generator))
+    video_source = f'servers/videos/source.{video_id}.mp4'
+
+    upload = flask.request.files.get('video')
+
+    try:
+        name = flask.request.form['name']
+        note = flask.request.form['note']
+    except KeyError:
+        return flask.abort(400)
+
+    if upload is None or not isinstance(upload.stream, HashingUpload):
+        return flask.abort(400)
+
+    # 上传文件在接收的同时已写入磁盘并计算哈希, 内容重复时不再检测, 否则直接移动为源视频文件
+    upload.stream.close()
+    content_hash = upload.stream.digest.hexdigest()
+
+    if link_duplicate_video(video_id, name, note, content_hash):
+        return flask.jsonify({'videoId': video_id, 'duplicate': True})
+
+    os.replace(upload.stream.name, video_source)
+
+    # 上传完成后立即返回, 检测在任务队列中执行, 通过状态接口查询进度或通过得分消息接口接收临时得分
+    score_feed = scorefeeds.create(video_id, score_feed_linger)
+
+    submitted = video_jobs.submit(video_id, *video_job_callbacks(video_id, name, note, content_hash), {'name': name, 'note': note, 'contentHash': content_hash})
+
+    if not submitted:
+        score_feed.finish('error', {'state': 'rejected', 'error': 'job queue is full'})
+        remove_queue.put(video_source)
+        return flask.abort(503)
+
+    return flask.jsonify({'videoId': video_id, 'duplicate': False})
+
+
+@app.get('/api/videoinference/status/<string:video_id>')
+def get_video_status(video_id):
+    job = video_jobs.status(video_id)
+
+    if job is None:
+        # 任务队列引入之前创建的视频没有任务记录
+        if database.surveillance.videos.find_one({'videoId': video_id}, {'_id': 1}) is None:
+            return flask.abort(404)
+
+        job = {'jobId': video_id, 'state': 'succeeded', 'progress': 100, 'error': None}
+
+    return flask.jsonify({
+        'videoId': job['jobId'],
+        'state': job['state'],
+        'progress': job['progress'],
+        'error': job['error'],
+    })
+
+
+def generate_video_events(score_feed, position):
+    while True:
+        events, finished = score_feed.wait(position, score_feed_keepalive)
+
+        # 长时间没有新消息时发送注释行, 避免代理服务器断开空闲连接
+        if not events and not finished:
+            yield b': keepalive\n\n'
+            continue
+
+        for event_id, name, data in events:
+            yield scorefeeds.format_event(event_id, name, data)
+
+        position += len(events)
+
+        if finished:
+            break
+
+
+def stored_video_events(video_id):
+    # 得分消息流已过期或服务端已重启时, 已完成的视频直接返回最终得分
+    video = database.surveillance.videos.find_one({'videoId': video_id}, {'_id': 0, 'scorePyramid': 0})
+
+    if video is None:
+        return None
+
+    scores = score_store.load_range(video).round(2).tolist()
+
+    return scorefeeds.format_event(0, 'final', {'scores': scores}) + scorefeeds.format_event(1, 'done', {'videoId': video_id})
+
+
+@app.get('/api/videoinference/events/<string:video_id>')
+def stream_video_events(video_id):
+    score_feed = scorefeeds.get(video_id)
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+    if score_feed is None:
+        events = stored_video_events(video_id)
+
+        if events is None:
+            return flask.abort(404)
+
+        return flask.Response(events, mimetype='text/event-stream', headers=headers)
+
+    position = int(flask.request.headers['Last-Event-ID']) + 1 if flask.request.headers.get('Last-Event-ID', '').isdigit() else 0
+
+    return flask.Response(generate_video_events(score_feed, position), mimetype='text/event-stream', headers=headers)
+
+
+@app.post('/api/videoinference/cancel')
+def cancel_video_inference():
     request_params = flask.request.get_json()
 
     try:
-        number = request_params['pageNumber']
-        length = request_params['pageLength']
+        video_id = request_params['videoId']
     except KeyError:
         return flask.abort(400)
 
+    return flask.jsonify({'cancelled': video_jobs.cancel(video_id)})
+
+
+@app.post('/api/videoinference/list')
+def get_video_list():
+    request_params = flask.request.get_json()
+
     response_videos = []
 
     try:
-        pagination_videos = database.surveillance.videos.find().limit(length).skip(length * (number - 1))
-    except ValueError:
+        pagination_videos, next_cursor = find_page(database.surveillance.videos, request_params, {'name': 1, 'note': 1, 'time': 1, 'videoId': 1})
+    except (KeyError, ValueError, TypeError, bson.errors.InvalidId):
         return flask.abort(400)
 
-    total_count = database.surveillance.videos.count_documents({})
+    # 元数据中的文档数, 不扫描集合
+    total_count = database.surveillance.videos.estimated_document_count()
 
     for video in pagination_videos:
         response_videos.append({
@@ -181,25 +730,65 @@ def get_video_list():
             'videoId': video['videoId'],
         })
 
-    return flask.jsonify({'videos': response_videos, 'totalCount': total_count})
+    return flask.jsonify({'videos': response_videos, 'totalCount': total_count, 'nextCursor': next_cursor})
 
 
 @app.get('/api/videoinference/detail/<string:video_id>')
 def get_video_detail(video_id):
-    video = database.surveillance.videos.find_one({'videoId': video_id})
+    width = flask.request.args.get('width', default=0, type=int)
+
+    if width < 0:
+        return flask.abort(400)
+
+    video = database.surveillance.videos.find_one({'videoId': video_id}, {'_id': 0})
 
     if video is None:
         return flask.abort(404)
 
+    # 最近访问时间只用于磁盘配额淘汰, 超过 retention-access-interval 才写入, 避免每次查看详情都写数据库
+    now = datetime.datetime.now()
+    last_accessed = video.get('lastAccessed')
+
+    if not isinstance(last_accessed, datetime.datetime) or now - last_accessed > access_time_interval:
+        database.surveillance.videos.update_one({'videoId': video_id}, {'$set': {'lastAccessed': now}})
+
+    # 指定 width 时返回与之匹配的分辨率, scores 为每个区间的最大值, 保留其中的异常峰值
+    if width > 0:
+        score_step, minimum_scores, scores = score_store.load_resolution(video, width)
+    else:
+        score_step, scores = 1, score_store.load_range(video)
+        minimum_scores = scores
+
     return flask.jsonify({
         'videoId': video['videoId'],
         'name': video['name'],
         'note': video['note'],
         'time': video['time'],
-        'scores': video['scores'],
+        'scores': scores.round(2).tolist(),
+        'minScores': minimum_scores.round(2).tolist(),
+        'scoreStep': score_step,
+        'scoreCount': video.get('scoreCount', len(scores)),
     })
 
 
+@app.get('/api/videoinference/scores/<string:video_id>')
+def get_video_scores(video_id):
+    start = flask.request.args.get('start', default=0, type=int)
+    end = flask.request.args.get('end', default=None, type=int)
+
+    if start < 0 or (end is not None and end < start):
+        return flask.abort(400)
+
+    video = database.surveillance.videos.find_one({'videoId': video_id}, {'_id': 0, 'scorePyramid': 0})
+
+    if video is None:
+        return flask.abort(404)
+
+    scores = score_store.load_range(video, start, end)
+
+    return flask.jsonify({'start': start, 'scores': scores.round(2).tolist()})
+
+
 @app.get('/api/videoinference/video/<string:video_id>')
 def get_result_video(video_id):
     try:
@@ -216,6 +805,24 @@ def get_result_cover(video_id):
         return flask.abort(404)
 
 
+@app.get('/api/videoinference/covers')
+def get_cover_sprite():
+    video_ids = [video_id for video_id in flask.request.args.get('videoIds', default='').split(',') if video_id]
+
+    if not 1 <= len(video_ids) <= cover_sprite_max:
+        return flask.abort(400)
+
+    sprite_bytes, offsets = cover_cache.sprite(video_ids, stream_quality)
+
+    if sprite_bytes is None:
+        return flask.abort(500)
+
+    response = flask.Response(sprite_bytes, mimetype='image/jpeg')
+    response.headers['X-Sprite-Offsets'] = json.dumps(offsets, separators=(',', ':'))
+
+    return response
+
+
 @app.post('/api/videoinference/delete')
 def delete_videos():
     request_params = flask.request.get_json()
@@ -225,12 +832,20 @@ def delete_videos():
     except KeyError:
         return flask.abort(400)
 
+    for video in database.surveillance.videos.find({'videoId': {'$in': video_ids}, 'scoreFile': {'$exists': True}}, {'scoreFile': 1}):
+        score_store.delete(video)
+
     delete_result = database.surveillance.videos.delete_many({'videoId': {'$in': video_ids}})
 
+    cover_cache.invalidate(video_ids)
+
     for video_id in video_ids:
+        video_jobs.cancel(video_id)
         remove_queue.put(f'servers/videos/result.{video_id}.mp4')
         remove_queue.put(f'servers/covers/result.{video_id}.jpg')
 
+    database.surveillance.jobs.delete_many({'jobId': {'$in': video_ids}, 'state': {'$nin': list(jobs.active_states)}})
+
     return flask.jsonify({'deletedCount': delete_result.deleted_count})
 
 
@@ -258,41 +873,96 @@ def create_realtime_session():
         'sessionId': session_id,
     })
 
+    # 分片模式下由创建会话的节点认领, 认领与心跳互斥, 视频源在锁外打开以免阻塞心跳
+    if shard_leases is not None:
+        with shard_lock:
+            claimed = shard_leases.claim(session_id)
+
+        # 会话已被其他节点认领时由该节点运行, 视频流请求按 shard-forward 转发
+        owner_url = None if claimed else shard_leases.owner_url(session_id)
+
+        if owner_url is not None:
+            return flask.jsonify({'sessionId': session_id, 'nodeUrl': owner_url})
+
+    session = open_realtime_session(source)
+
+    # 打开视频源期间心跳可能已经启动了同一会话
     with realtime_sessions_lock:
-        realtime_sessions[session_id] = realtime.RealtimeInferenceSession(source)
+        duplicate = session_id in realtime_sessions
+
+        if not duplicate:
+            realtime_sessions[session_id] = session
+
+    if duplicate:
+        release_sessions([session])
 
     return flask.jsonify({'sessionId': session_id})
 
 
+def proxy_realtime_frames(upstream):
+    with upstream:
+        while True:
+            chunk = upstream.read1(64 * 1024)
+
+            if not chunk:
+                break
+
+            yield chunk
+
+
+def forward_realtime_frames(session_id):
+    # 会话由其他节点运行时重定向或代理到该节点, 已经转发过的请求不再转发以免循环
+    if shard_leases is None or 'X-Forwarded-Session' in flask.request.headers:
+        return flask.abort(404)
+
+    owner_url = shard_leases.owner_url(session_id)
+
+    if owner_url is None:
+        return flask.abort(404)
+
+    target_url = owner_url.rstrip('/') + flask.request.full_path.rstrip('?')
+
+    if shard_forward == 'redirect':
+        return flask.redirect(target_url, 307)
+
+    try:
+        upstream = urllib.request.urlopen(urllib.request.Request(target_url, headers={'X-Forwarded-Session': shard_leases.node_id}), timeout=shard_proxy_timeout)
+    except urllib.error.HTTPError as e:
+        return flask.abort(e.code)
+    except OSError:
+        return flask.abort(502)
+
+    return flask.Response(proxy_realtime_frames(upstream), mimetype=upstream.headers['Content-Type'])
+
+
 @app.get('/api/realtimeinference/session/<string:session_id>')
 def generate_realtime_frames(session_id):
     with realtime_sessions_lock:
-        try:
-            session = realtime_sessions[session_id]
-        except KeyError:
-            return flask.abort(404)
+        session = realtime_sessions.get(session_id)
 
-    return flask.Response(generate_realtime_response(session), mimetype='multipart/x-mixed-replace; boundary=frame')
+    if session is None:
+        return forward_realtime_frames(session_id)
+
+    try:
+        variant = parse_stream_variant(flask.request.args)
+    except ValueError:
+        return flask.abort(400)
+
+    return flask.Response(generate_realtime_response(session, variant), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 
 @app.post('/api/realtimeinference/list')
 def get_realtime_sessions():
     request_params = flask.request.get_json()
 
-    try:
-        number = request_params['pageNumber']
-        length = request_params['pageLength']
-    except KeyError:
-        return flask.abort(400)
-
     response_sessions = []
 
     try:
-        pagination_sessions = database.surveillance.sessions.find().limit(length).skip(length * (number - 1))
-    except ValueError:
+        pagination_sessions, next_cursor = find_page(database.surveillance.sessions, request_params, {'source': 1, 'name': 1, 'note': 1, 'sessionId': 1})
+    except (KeyError, ValueError, TypeError, bson.errors.InvalidId):
         return flask.abort(400)
 
-    total_count = database.surveillance.sessions.count_documents({})
+    total_count = database.surveillance.sessions.estimated_document_count()
 
     for session in pagination_sessions:
         response_sessions.append({
@@ -302,12 +972,12 @@ def get_realtime_sessions():
             'sessionId': session['sessionId'],
         })
 
-    return flask.jsonify({'sessions': response_sessions, 'totalCount': total_count})
+    return flask.jsonify({'sessions': response_sessions, 'totalCount': total_count, 'nextCursor': next_cursor})
 
 
 @app.get('/api/realtimeinference/detail/<string:session_id>')
 def get_session_detail(session_id):
-    session = database.surveillance.sessions.find_one({'sessionId': session_id})
+    session = database.surveillance.sessions.find_one({'sessionId': session_id}, {'name': 1, 'note': 1, 'source': 1})
 
     if session is None:
         return flask.abort(404)
@@ -319,6 +989,49 @@ def get_session_detail(session_id):
     })
 
 
+@app.get('/api/realtimeinference/scores/<string:session_id>')
+def get_session_scores(session_id):
+    end = flask.request.args.get('end', default=int(time.time() * 1000), type=int)
+    start = flask.request.args.get('start', default=end - 60 * 60 * 1000, type=int)
+    bucket_count = flask.request.args.get('buckets', default=200, type=int)
+
+    if start >= end or not 1 <= bucket_count <= 2000:
+        return flask.abort(400)
+
+    bucket_milliseconds, buckets = timeseries.query_score_buckets(database, session_id, start, end, bucket_count)
+
+    return flask.jsonify({'start': start, 'end': end, 'bucketMilliseconds': bucket_milliseconds, 'buckets': buckets})
+
+
+@app.get('/api/realtimeinference/events/<string:session_id>')
+def get_session_events(session_id):
+    limit = flask.request.args.get('limit', default=50, type=int)
+
+    if not 1 <= limit <= 500:
+        return flask.abort(400)
+
+    response_events = []
+
+    for event in database.surveillance.events.find({'sessionId': session_id}).sort('start', pymongo.DESCENDING).limit(limit):
+        response_events.append({
+            'eventId': event['eventId'],
+            'start': int(event['start'].replace(tzinfo=datetime.timezone.utc).timestamp() * 1000),
+            'finish': int(event['finish'].replace(tzinfo=datetime.timezone.utc).timestamp() * 1000),
+            'peakScore': round(event['peakScore'], 4),
+            'clipUrl': f"/api/realtimeinference/clip/{event['eventId']}",
+        })
+
+    return flask.jsonify({'events': response_events})
+
+
+@app.get('/api/realtimeinference/clip/<string:event_id>')
+def get_event_clip(event_id):
+    try:
+        return flask.send_file(f'clips/clip.{event_id}.avi', mimetype='video/x-msvideo')
+    except FileNotFoundError:
+        return flask.abort(404)
+
+
 @app.post('/api/realtimeinference/delete')
 def delete_realtime_sessions():
     request_params = flask.request.get_json()
@@ -330,24 +1043,88 @@ def delete_realtime_sessions():
 
     delete_result = database.surveillance.sessions.delete_many({'sessionId': {'$in': session_ids}})
 
-    for session_id in session_ids:
-        with realtime_sessions_lock:
-            release_and_delete_session(session_id)
+    if shard_leases is not None:
+        shard_leases.remove(session_ids)
+
+    with realtime_sessions_lock:
+        removed_sessions = [realtime_sessions.pop(session_id) for session_id in session_ids if session_id in realtime_sessions]
+
+    release_sessions(removed_sessions)
+
+    for event in database.surveillance.events.find({'sessionId': {'$in': session_ids}}, {'eventId': 1}):
+        remove_queue.put(f"servers/clips/clip.{event['eventId']}.avi")
+
+    database.surveillance.events.delete_many({'sessionId': {'$in': session_ids}})
 
     return flask.jsonify({'deletedCount': delete_result.deleted_count})
 
 
-@app.get('/api/realtimeinference/sync')
-def sync_realtime_sessions():
-    sessions = database.surveillance.sessions.find()
+def reconcile_realtime_sessions(session_sources):
+    # 只停止已删除或视频源已变更的会话, 只启动尚未运行的会话, 视频源的打开和释放均不持有锁
+    with realtime_sessions_lock:
+        stopped_sessions = [realtime_sessions.pop(session_id) for session_id, session in list(realtime_sessions.items()) if session_sources.get(session_id) != session.source]
+        starting_sources = {session_id: source for session_id, source in session_sources.items() if session_id not in realtime_sessions}
+
+    release_sessions(stopped_sessions)
+    opened_sessions, failed_session_ids = open_realtime_sessions(starting_sources)
+
+    duplicate_sessions = []
 
     with realtime_sessions_lock:
-        for session in realtime_sessions.values():
-            session.release()
+        for session_id, session in opened_sessions.items():
+            # 同步期间通过创建接口启动的会话优先
+            if session_id in realtime_sessions:
+                duplicate_sessions.append(session)
+            else:
+                realtime_sessions[session_id] = session
+
+        session_count = len(realtime_sessions)
+
+    release_sessions(duplicate_sessions)
+
+    return {
+        'sessionCount': session_count,
+        'startedCount': len(opened_sessions) - len(duplicate_sessions),
+        'stoppedCount': len(stopped_sessions),
+        'failedSessionIds': failed_session_ids,
+    }
+
+
+def node_cpu_seconds():
+    cpu_seconds = time.process_time()
+
+    if realtime_workers is not None:
+        cpu_seconds += realtime_workers.cpu_seconds()
+
+    return cpu_seconds
+
+
+def shard_task():
+    # 本节点只运行持有租约的会话, 打开失败的会话交出租约由其他节点尝试
+    with shard_lock:
+        sync_result = reconcile_realtime_sessions(shard_leases.heartbeat(node_cpu_seconds()))
 
-        realtime_sessions.clear()
+        if sync_result['failedSessionIds']:
+            shard_leases.release(sync_result['failedSessionIds'])
+
+    return sync_result
+
+
+def leave_shard():
+    with contextlib.suppress(pymongo.errors.PyMongoError):
+        shard_leases.leave()
+
+
+if shard_leases is not None:
+    scheduler.add_job(shard_task, trigger='interval', seconds=configs['shard-heartbeat'], max_instances=1, coalesce=True, next_run_time=datetime.datetime.now())
+    atexit.register(leave_shard)
+
+
+@app.get('/api/realtimeinference/sync')
+def sync_realtime_sessions():
+    if shard_leases is not None:
+        return flask.jsonify(shard_task())
 
-        for session in sessions:
-            realtime_sessions[session['sessionId']] = realtime.RealtimeInferenceSession(session['source'])
+    session_sources = {session['sessionId']: session['source'] for session in database.surveillance.sessions.find({}, {'sessionId': 1, 'source': 1})}
 
-        return flask.jsonify({'sessionCount': len(realtime_sessions)})
+    return flask.jsonify(reconcile_realtime_sessions(session_sources))
@@ -0,0 +1,311 @@
+import argparse
+import asyncio
+import concurrent.futures
+import sys
+import tempfile
+import urllib.parse
+
+import werkzeug.datastructures
+
+try:
+    import aiohttp.web
+except ImportError as e:
+    # aiohttp 是可选依赖, 只有异步服务模式需要
+    if __name__ == '__main__':
+        sys.exit('异步服务模式需要安装 aiohttp: pip install aiohttp')
+
+    raise ImportError('servers.streaming requires aiohttp, install it with: pip install aiohttp') from e
+
+import servers.broadcasts as broadcasts
+import servers.scorefeeds as scorefeeds
+import servers.server as server
+
+
+bridge_executor = concurrent.futures.ThreadPoolExecutor(max_workers=server.configs['async-bridge-workers'], thread_name_prefix='WsgiBridge')
+
+stream_write_timeout = server.configs['stream-write-timeout']
+upload_spool_size = 8 * 1024 * 1024
+
+hop_by_hop_headers = {'connection', 'keep-alive', 'transfer-encoding', 'upgrade'}
+
+
+async def forward_realtime_frames(request, session_id):
+    # 会话由其他节点运行时重定向或代理到该节点, 已经转发过的请求不再转发以免循环
+    if server.shard_leases is None or 'X-Forwarded-Session' in request.headers:
+        raise aiohttp.web.HTTPNotFound()
+
+    owner_url = await asyncio.get_running_loop().run_in_executor(bridge_executor, server.shard_leases.owner_url, session_id)
+
+    if owner_url is None:
+        raise aiohttp.web.HTTPNotFound()
+
+    target_url = owner_url.rstrip('/') + request.raw_path
+
+    if server.shard_forward == 'redirect':
+        raise aiohttp.web.HTTPTemporaryRedirect(target_url)
+
+    response = aiohttp.web.StreamResponse()
+    timeout = aiohttp.ClientTimeout(sock_connect=server.shard_proxy_timeout, sock_read=server.shard_proxy_timeout)
+
+    try:
+        async with aiohttp.ClientSession(timeout=timeout) as client:
+            async with client.get(target_url, headers={'X-Forwarded-Session': server.shard_leases.node_id}) as upstream:
+                if upstream.status != 200:
+                    return aiohttp.web.Response(status=upstream.status)
+
+                response.headers['Content-Type'] = upstream.headers['Content-Type']
+                await response.prepare(request)
+
+                async for chunk in upstream.content.iter_any():
+                    await asyncio.wait_for(response.write(chunk), stream_write_timeout)
+
+    except (aiohttp.ClientError, ConnectionResetError, asyncio.TimeoutError):
+        if not response.prepared:
+            raise aiohttp.web.HTTPBadGateway()
+
+    return response
+
+
+async def stream_realtime_frames(request):
+    session_id = request.match_info['session_id']
+
+    with server.realtime_sessions_lock:
+        session = server.realtime_sessions.get(session_id)
+
+    if session is None:
+        return await forward_realtime_frames(request, session_id)
+
+    try:
+        variant = server.parse_stream_variant(werkzeug.datastructures.MultiDict(request.query.items()))
+    except ValueError:
+        raise aiohttp.web.HTTPBadRequest()
+
+    loop = asyncio.get_running_loop()
+    frame_event = asyncio.Event()
+
+    # 广播线程只投递通知, 不等待任何观看者
+    def on_frame():
+        loop.call_soon_threadsafe(frame_event.set)
+
+    broadcaster = broadcasts.subscribe(session, variant)
+
+    # 订阅时广播器可能恰好因会话释放而停止, 此时直接进入循环并结束
+    if not broadcaster.add_listener(on_frame):
+        frame_event.set()
+
+    response = aiohttp.web.StreamResponse(headers={'Content-Type': 'multipart/x-mixed-replace; boundary=frame'})
+
+    try:
+        await response.prepare(request)
+
+        sequence = 0
+
+        while True:
+            try:
+                await asyncio.wait_for(frame_event.wait(), server.stream_keepalive)
+            except asyncio.TimeoutError:
+                # 会话停滞时定期发送空行并重新检查会话状态
+                if not broadcaster.running or session.released:
+                    break
+
+                await asyncio.wait_for(response.write(b'\r\n'), stream_write_timeout)
+                continue
+
+            frame_event.clear()
+
+            latest_sequence, payload = broadcaster.latest()
+
+            if payload is None:
+                if not broadcaster.running:
+                    break
+
+                continue
+
+            if latest_sequence <= sequence:
+                continue
+
+            sequence = latest_sequence
+
+            # 写入在发送缓冲区超过上限时等待, 期间到达的帧被跳过, 较慢的观看者总是收到最新帧
+            await asyncio.wait_for(response.write(b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + payload + b'\r\n'), stream_write_timeout)
+
+    except (ConnectionResetError, asyncio.TimeoutError):
+        pass
+
+    finally:
+        broadcaster.remove_listener(on_frame)
+        broadcasts.unsubscribe(broadcaster)
+
+    return response
+
+
+async def stream_video_events(request):
+    video_id = request.match_info['video_id']
+    score_feed = scorefeeds.get(video_id)
+    headers = {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+    if score_feed is None:
+        events = await asyncio.get_running_loop().run_in_executor(bridge_executor, server.stored_video_events, video_id)
+
+        if events is None:
+            raise aiohttp.web.HTTPNotFound()
+
+        return aiohttp.web.Response(body=events, headers=headers)
+
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    position = int(last_event_id) + 1 if last_event_id.isdigit() else 0
+
+    loop = asyncio.get_running_loop()
+    event_signal = asyncio.Event()
+
+    # 检测线程只投递通知, 不等待任何订阅者
+    def on_event():
+        loop.call_soon_threadsafe(event_signal.set)
+
+    score_feed.add_listener(on_event)
+
+    response = aiohttp.web.StreamResponse(headers=headers)
+
+    try:
+        await response.prepare(request)
+
+        while True:
+            events, finished = score_feed.events_after(position)
+
+            for event_id, name, data in events:
+                await asyncio.wait_for(response.write(scorefeeds.format_event(event_id, name, data)), stream_write_timeout)
+
+            position += len(events)
+
+            if finished:
+                break
+
+            # 长时间没有新消息时发送注释行, 避免代理服务器断开空闲连接
+            try:
+                await asyncio.wait_for(event_signal.wait(), server.score_feed_keepalive)
+            except asyncio.TimeoutError:
+                await asyncio.wait_for(response.write(b': keepalive\n\n'), stream_write_timeout)
+
+            event_signal.clear()
+
+    except (ConnectionResetError, asyncio.TimeoutError):
+        pass
+
+    finally:
+        score_feed.remove_listener(on_event)
+
+    return response
+
+
+async def spool_request_body(request):
+    body = tempfile.SpooledTemporaryFile(max_size=upload_spool_size)
+
+    async for chunk in request.content.iter_chunked(64 * 1024):
+        body.write(chunk)
+
+    body.seek(0)
+
+    return body
+
+
+def build_environ(request, body):
+    path = urllib.parse.unquote(request.raw_path.split('?', 1)[0])
+
+    environ = {
+        'REQUEST_METHOD': request.method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': request.query_string,
+        'SERVER_NAME': request.host.split(':', 1)[0],
+        'SERVER_PORT': str(request.url.port or ''),
+        'SERVER_PROTOCOL': f'HTTP/{request.version.major}.{request.version.minor}',
+        'REMOTE_ADDR': request.remote or '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': request.scheme,
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+
+    for name, value in request.headers.items():
+        key = name.upper().replace('-', '_')
+
+        if key == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif key == 'CONTENT_LENGTH':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            environ[f'HTTP_{key}'] = value if f'HTTP_{key}' not in environ else environ[f'HTTP_{key}'] + ',' + value
+
+    return environ
+
+
+async def bridge_wsgi_request(request):
+    # 其余接口交给原有的 Flask 应用处理, 保持其行为不变, 阻塞调用在线程池中执行
+    loop = asyncio.get_running_loop()
+    body = await spool_request_body(request)
+
+    response_start = {}
+
+    def start_response(status, headers, exc_info=None):
+        response_start['status'] = int(status.split(' ', 1)[0])
+        response_start['headers'] = headers
+
+    def call_application():
+        result = server.app(build_environ(request, body), start_response)
+
+        return result, iter(result)
+
+    result, chunks = await loop.run_in_executor(bridge_executor, call_application)
+
+    try:
+        response = aiohttp.web.StreamResponse(status=response_start['status'])
+
+        for name, value in response_start['headers']:
+            if name.lower() not in hop_by_hop_headers:
+                response.headers.add(name, value)
+
+        await response.prepare(request)
+
+        while True:
+            chunk = await loop.run_in_executor(bridge_executor, next, chunks, None)
+
+            if chunk is None:
+                break
+
+            if chunk:
+                await response.write(chunk)
+
+        await response.write_eof()
+
+    finally:
+        if hasattr(result, 'close'):
+            await loop.run_in_executor(bridge_executor, result.close)
+
+        body.close()
+
+    return response
+
+
+def create_application():
+    application = aiohttp.web.Application(client_max_size=0)
+    application.router.add_get('/api/realtimeinference/session/{session_id}', stream_realtime_frames)
+    application.router.add_get('/api/videoinference/events/{video_id}', stream_video_events)
+    application.router.add_route('*', '/{path:.*}', bridge_wsgi_request)
+
+    return application
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the API with asyncio streaming endpoints.')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    arguments = parser.parse_args()
+
+    aiohttp.web.run_app(create_application(), host=arguments.host, port=arguments.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import collections
+import datetime
+import math
+
+import pymongo
+import pymongo.errors
+
+
+rollup_milliseconds = 60 * 1000
+
+
+def utc_datetime(seconds):
+    # 与 pymongo 默认行为一致, 使用不带时区信息的 UTC 时间
+    return datetime.datetime.fromtimestamp(seconds, tz=datetime.timezone.utc).replace(tzinfo=None)
+
+
+def setup_score_collections(database, retention_days):
+    surveillance = database.surveillance
+
+    # 保留天数不大于 0 时永久保留, 不设置过期时间, 否则过期时间为 0 秒会使写入的得分立即被删除
+    expiry_options = {'expireAfterSeconds': int(retention_days * 24 * 60 * 60)} if retention_days > 0 else {}
+
+    # 优先使用 MongoDB 时间序列集合, 旧版本数据库退化为普通集合加 TTL 索引
+    try:
+        surveillance.create_collection('scores', timeseries={'timeField': 'time', 'metaField': 'sessionId', 'granularity': 'seconds'}, **expiry_options)
+    except pymongo.errors.CollectionInvalid:
+        pass
+    except pymongo.errors.OperationFailure:
+        surveillance.scores.create_index('time', **expiry_options)
+
+    surveillance.scores.create_index([('sessionId', pymongo.ASCENDING), ('time', pymongo.ASCENDING)])
+
+    surveillance.score_rollups.create_index([('sessionId', pymongo.ASCENDING), ('time', pymongo.ASCENDING)], unique=True)
+    surveillance.score_rollups.create_index('time', **expiry_options)
+
+    surveillance.events.create_index([('sessionId', pymongo.ASCENDING), ('start', pymongo.DESCENDING)])
+    surveillance.events.create_index('eventId', unique=True)
+
+
+def write_scores(database, session_scores):
+    documents = []
+    rollups = collections.defaultdict(lambda: [math.inf, -math.inf, 0.0, 0])
+
+    for session_id, scores in session_scores:
+        for score_time, score in scores:
+            time = utc_datetime(score_time)
+            minute = time.replace(second=0, microsecond=0)
+
+            documents.append({'time': time, 'sessionId': session_id, 'score': score})
+
+            rollup = rollups[(session_id, minute)]
+            rollup[0] = min(rollup[0], score)
+            rollup[1] = max(rollup[1], score)
+            rollup[2] += score
+            rollup[3] += 1
+
+    if not documents:
+        return 0
+
+    database.surveillance.scores.insert_many(documents, ordered=False)
+
+    # 按分钟预聚合, 长时间范围的查询直接读取聚合结果
+    database.surveillance.score_rollups.bulk_write([
+        pymongo.UpdateOne(
+            {'sessionId': session_id, 'time': minute},
+            {'$min': {'min': minimum}, '$max': {'max': maximum}, '$inc': {'sum': total, 'count': count}},
+            upsert=True,
+        )
+        for (session_id, minute), (minimum, maximum, total, count) in rollups.items()
+    ], ordered=False)
+
+    return len(documents)
+
+
+def write_events(database, session_events):
+    documents = []
+
+    for session_id, events in session_events:
+        for event in events:
+            documents.append({
+                'eventId': event['clipId'],
+                'sessionId': session_id,
+                'start': utc_datetime(event['start']),
+                'finish': utc_datetime(event['finish']),
+                'peakScore': event['peakScore'],
+                'clipStart': utc_datetime(event['clipStart']),
+                'clipFinish': utc_datetime(event['clipFinish']),
+            })
+
+    if not documents:
+        return 0
+
+    database.surveillance.events.insert_many(documents, ordered=False)
+
+    return len(documents)
+
+
+def query_score_buckets(database, session_id, start_milliseconds, end_milliseconds, bucket_count):
+    bucket_milliseconds = max(1, math.ceil((end_milliseconds - start_milliseconds) / bucket_count))
+    use_rollups = bucket_milliseconds >= rollup_milliseconds
+
+    # 按分钟聚合的结果只能整体落入某个区间, 范围和区间长度对齐到整分钟, 第一个区间可能早于 start_milliseconds 开始
+    if use_rollups:
+        bucket_milliseconds = math.ceil(bucket_milliseconds / rollup_milliseconds) * rollup_milliseconds
+        start_milliseconds = start_milliseconds // rollup_milliseconds * rollup_milliseconds
+        end_milliseconds = math.ceil(end_milliseconds / rollup_milliseconds) * rollup_milliseconds
+
+    start = utc_datetime(start_milliseconds / 1000)
+    end = utc_datetime(end_milliseconds / 1000)
+
+    bucket_index = {'$floor': {'$divide': [{'$subtract': ['$time', start]}, bucket_milliseconds]}}
+
+    if use_rollups:
+        collection = database.surveillance.score_rollups
+        group = {'_id': bucket_index, 'min': {'$min': '$min'}, 'max': {'$max': '$max'}, 'sum': {'$sum': '$sum'}, 'count': {'$sum': '$count'}}
+    else:
+        collection = database.surveillance.scores
+        group = {'_id': bucket_index, 'min': {'$min': '$score'}, 'max': {'$max': '$score'}, 'sum': {'$sum': '$score'}, 'count': {'$sum': 1}}
+
+    pipeline = [
+        {'$match': {'sessionId': session_id, 'time': {'$gte': start, '$lt': end}}},
+        {'$group': group},
+        {'$sort': {'_id': 1}},
+    ]
+
+    buckets = []
+
+    for bucket in collection.aggregate(pipeline):
+        buckets.append({
+            'time': start_milliseconds + int(bucket['_id']) * bucket_milliseconds,
+            'min': round(bucket['min'], 4),
+            'max': round(bucket['max'], 4),
+            'mean': round(bucket['sum'] / bucket['count'], 4),
+            'count': bucket['count'],
+        })
+
+    return bucket_milliseconds, buckets
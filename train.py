@@ -7,7 +7,7 @@ import torch.optim as optim
 
 from torch.utils.data import DataLoader
 
-from models import AnomalyDetectionModel
+from models import AnomalyDetectionModel, create_model
 from dataset import AnomalyDetectionDataset
 
 
@@ -50,6 +50,19 @@ def criterion(outputs, targets, lengths):
     return batch_loss / lengths.shape[0]
 
 
+def distillation_loss(outputs, teacher_outputs, lengths, temperature):
+    batch_loss = torch.tensor(0).to(lengths.device).float()
+
+    for batch, length in enumerate(lengths):
+        output = (outputs[batch, :length] / temperature).sigmoid()
+        target = (teacher_outputs[batch, :length] / temperature).sigmoid()
+
+        batch_loss += nn.functional.binary_cross_entropy(output, target)
+
+    # 乘以 temperature 的平方使梯度量级与温度无关
+    return batch_loss / lengths.shape[0] * temperature ** 2
+
+
 configs = toml.load('configs/config.toml')
 
 train_dataset = AnomalyDetectionDataset('datasets/train')
@@ -81,9 +94,25 @@ smoothing_window = configs['smoothing-window']
 
 log_interval = configs['log-interval']
 
-model = AnomalyDetectionModel(attention_window, alpha=configs['alpha'])
+model = create_model(configs)
 model = model.to(device)
 
+teacher = None
+
+distill_weight = configs['distill-weight']
+distill_temperature = configs['distill-temperature']
+
+if configs['distill']:
+    # 教师模型为完整模型, 轻量模型的 fc1 以教师 fc1 的低秩近似初始化
+    teacher = AnomalyDetectionModel(attention_window, alpha=configs['alpha'])
+    teacher.load_state_dict(torch.load(configs['distill-checkpoint-path'], map_location='cpu', weights_only=True))
+
+    if not configs['load-checkpoint'] and hasattr(model, 'initialize_from'):
+        model.initialize_from(teacher)
+
+    teacher = teacher.to(device)
+    teacher.eval()
+
 optimizer = optim.Adam(model.parameters(), lr=configs['learning-rate'], weight_decay=configs['weight-decay'])
 
 load_checkpoint_path = configs['load-checkpoint-path']
@@ -93,12 +122,16 @@ last_checkpoint_path = configs['last-checkpoint-path']
 if configs['load-checkpoint']:
     model.load_state_dict(torch.load(load_checkpoint_path, map_location=device, weights_only=True))
 
+step_profiler = utils.StepProfiler(configs, 'train', device)
+
 print(f'\n---------- training start at: {device} ----------\n')
 
+step_profiler.start()
+
 for epoch in range(num_epochs):
     model.train()
 
-    for batch, (inputs, labels, lengths) in enumerate(train_dataloader, start=1):
+    for batch, (inputs, labels, lengths) in enumerate(step_profiler.iterate(train_dataloader, 'train'), start=1):
         inputs = inputs.to(device)
         labels = labels.to(device)
         lengths = lengths.to(device)
@@ -106,6 +139,13 @@ for epoch in range(num_epochs):
         optimizer.zero_grad()
         outputs = model(inputs)
         loss = criterion(outputs.sigmoid(), labels, lengths)
+
+        if teacher is not None:
+            with torch.no_grad():
+                teacher_outputs = teacher(inputs)
+
+            loss = (1 - distill_weight) * loss + distill_weight * distillation_loss(outputs, teacher_outputs, lengths, distill_temperature)
+
         loss.backward()
         optimizer.step()
 
@@ -118,7 +158,7 @@ for epoch in range(num_epochs):
         all_scores = []
         all_labels = []
 
-        for index, (inputs, labels, _) in enumerate(valid_dataloader, start=1):
+        for index, (inputs, labels, _) in enumerate(step_profiler.iterate(valid_dataloader, 'valid'), start=1):
             inputs = inputs.to(device)
             labels = labels.to(device)
 
@@ -148,6 +188,8 @@ for epoch in range(num_epochs):
 
     print(f'{utils.current_time()} [valid] [{epoch:03d}] IoU: {iou_score:.4f}')
 
+step_profiler.stop()
+
 print(f'best IoU: {best_iou_score:.3f}')
 print(f'last IoU: {last_iou_score:.3f}')
 
@@ -1,4 +1,7 @@
 import datetime
+import json
+import os
+import time
 import torch
 import torch.nn as nn
 
@@ -43,3 +46,83 @@ def dice_score(sequence1, sequence2, eps=1e-6):
 
 def bidirectional_dice_score(sequence1, sequence2, alpha, eps=1e-6):
     return alpha * dice_score(sequence1, sequence2, eps) + (1 - alpha) * dice_score(1 - sequence1, 1 - sequence2, eps)
+
+
+class StepProfiler:
+    """
+    训练及评估步骤的可选性能分析, 启用后按 wait/warmup/active 周期使用 torch.profiler 记录 Chrome trace
+    同时统计每一步等待数据和计算的耗时, 结束时写入 <name>-steps.json
+    """
+
+    def __init__(self, configs, name, device):
+        self.directory = configs['profiling-directory']
+        self.name = name
+        self.device = device
+        self.steps = []
+        self.profiler = None
+
+        if configs['profiling']:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+
+            if device.type == 'cuda':
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+            self.profiler = torch.profiler.profile(
+                activities=activities,
+                schedule=torch.profiler.schedule(wait=configs['profiling-wait'], warmup=configs['profiling-warmup'], active=configs['profiling-active'], repeat=1),
+                on_trace_ready=self.export_trace,
+            )
+
+    def export_trace(self, profiler):
+        profiler.export_chrome_trace(f'{self.directory}/{self.name}-trace-{profiler.step_num}.json')
+
+    def start(self):
+        if self.profiler is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.profiler.start()
+
+    def stop(self):
+        if self.profiler is None:
+            return
+
+        self.profiler.stop()
+
+        data_wait = sum(step['dataWait'] for step in self.steps)
+        compute = sum(step['compute'] for step in self.steps)
+
+        with open(f'{self.directory}/{self.name}-steps.json', 'w') as steps_file:
+            json.dump({'dataWait': data_wait, 'compute': compute, 'steps': self.steps}, steps_file, indent=2)
+
+        print(f'{current_time()} [profile] steps: {len(self.steps)} data wait: {data_wait:.3f}s compute: {compute:.3f}s')
+
+    def iterate(self, iterable, phase):
+        # 未启用时直接返回原迭代器, 不引入任何开销
+        if self.profiler is None:
+            return iterable
+
+        return self.profile_steps(iterable, phase)
+
+    def profile_steps(self, iterable, phase):
+        iterator = iter(iterable)
+
+        while True:
+            fetch_start = time.perf_counter()
+
+            with torch.profiler.record_function(f'{phase}-data-wait'):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+
+            compute_start = time.perf_counter()
+
+            with torch.profiler.record_function(f'{phase}-compute'):
+                yield item
+
+                if self.device.type == 'cuda':
+                    torch.cuda.synchronize(self.device)
+
+            compute_finish = time.perf_counter()
+
+            self.steps.append({'phase': phase, 'dataWait': compute_start - fetch_start, 'compute': compute_finish - compute_start})
+            self.profiler.step()